@@ -10,17 +10,24 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 import os
 
 from channels.routing import ProtocolTypeRouter, URLRouter
+from channels.sessions import SessionMiddlewareStack
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "DjangoChat.settings")
 
 django_application = get_asgi_application()
 
+from webchat.auth import WebsocketAuthMiddleware  # noqa isort:skip
+from webchat.presence import lifespan  # noqa isort:skip
+
 from . import urls  # noqa isort:skip
 
 application = ProtocolTypeRouter(
     {
         "http": get_asgi_application(),
-        "websocket": URLRouter(urls.websocket_urlpatterns),
+        # sockets without a valid token or logged in session are turned away by the consumers before accept()
+        "websocket": SessionMiddlewareStack(WebsocketAuthMiddleware(URLRouter(urls.websocket_urlpatterns))),
+        # starts the presence listener with the process, see webchat/presence.py
+        "lifespan": lifespan,
     }
 )
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from asgiref.testing import ApplicationCommunicator
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+
+
+@contextmanager
+def benchmark_database(on_disk=False):
+    """Runs the wrapped block against a throwaway test database so benchmarks never touch real data.
+
+    SQLite test databases live in memory by default, ``on_disk`` puts them in a temporary file instead so that write
+    heavy benchmarks pay for real disk writes and locking.
+    """
+    setup_test_environment()
+    old_name = connection.settings_dict["NAME"]
+    test_settings = connection.settings_dict.setdefault("TEST", {})
+    old_test_name = test_settings.get("NAME")
+    if on_disk and connection.vendor == "sqlite":
+        test_settings["NAME"] = os.path.join(tempfile.mkdtemp(prefix="djangochat-bench-"), "db.sqlite3")
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        from webchat.persistence import stop_background_writers
+
+        # while the tables they write to still exist
+        stop_background_writers()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        test_settings["NAME"] = old_test_name
+        teardown_test_environment()
+
+
+def measure(func, repeat=5):
+    """Calls ``func`` ``repeat`` times, returns the number of queries of one call and the median wall time in ms."""
+    with CaptureQueriesContext(connection) as queries:
+        func()
+    num_queries = len(queries)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return num_queries, statistics.median(timings)
+
+
+def run_concurrently(send, total, workers, finish=None):
+    """Splits ``total`` units of work over ``workers`` threads calling ``send(count)`` and returns the seconds taken.
+
+    ``finish`` runs once every thread is done and counts towards the time, e.g. to wait for queued writes.
+    """
+    counts = [total // workers + (1 if i < total % workers else 0) for i in range(workers)]
+
+    def worker(count):
+        try:
+            send(count)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker, args=(count,)) for count in counts]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if finish is not None:
+        finish()
+    return time.perf_counter() - start
+
+
+def start_fake_redis(host="127.0.0.1", port=0):
+    """Starts fakeredis' TCP server in a background thread and returns it with its redis:// URL.
+
+    It speaks enough of the Redis protocol, including pub/sub, for the channels_redis layers, so several worker
+    processes can share a channel layer without a real Redis server.
+    """
+    try:
+        from fakeredis import TcpFakeServer
+    except ImportError:
+        raise ImportError(
+            "fakeredis is not installed, run `pip install -r requirements-dev.txt` or point REDIS_URL at a Redis server"
+        )
+
+    server = TcpFakeServer((host, port))
+    threading.Thread(target=server.serve_forever, name="fakeredis", daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"redis://{host}:{port}"
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(percent / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class WebsocketClient:
+    """Minimal in-process websocket client that talks to an ASGI application through asgiref's communicator.
+
+    Same idea as channels' WebsocketCommunicator, which can't be imported without daphne installed.
+    """
+
+    def __init__(self, application, path, query_string=b"", headers=None, subprotocols=None):
+        scope = {
+            "type": "websocket",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query_string,
+            "headers": headers or [],
+            "subprotocols": subprotocols or [],
+        }
+        self.communicator = ApplicationCommunicator(application, scope)
+        self.subprotocol = None
+
+    async def connect(self, timeout=5):
+        await self.communicator.send_input({"type": "websocket.connect"})
+        response = await self.communicator.receive_output(timeout)
+        self.subprotocol = response.get("subprotocol")
+        return response["type"] == "websocket.accept"
+
+    async def send_json(self, content):
+        await self.communicator.send_input({"type": "websocket.receive", "text": json.dumps(content)})
+
+    async def receive(self, timeout=5):
+        response = await self.communicator.receive_output(timeout)
+        if response["type"] == "websocket.close":
+            raise ConnectionError(f"websocket closed with code {response.get('code')}")
+        return response.get("text"), response.get("bytes")
+
+    async def receive_json(self, timeout=5):
+        text, _ = await self.receive(timeout)
+        return json.loads(text)
+
+    async def disconnect(self, code=1000, timeout=5):
+        await self.communicator.send_input({"type": "websocket.disconnect", "code": code})
+        try:
+            await self.communicator.wait(timeout)
+        except asyncio.TimeoutError:
+            pass
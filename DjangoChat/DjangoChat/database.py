@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.db import migrations
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def fold_case(text):
+    """Lowercases ``text`` the way server search lowercases its queries, ``None`` stays ``None``."""
+    return None if text is None else text.lower()
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """Applies ``settings.SQLITE_PRAGMAS`` to each SQLite connection as soon as it is opened."""
+    if connection.vendor != "sqlite":
+        return
+    for name, value in getattr(settings, "SQLITE_PRAGMAS", {}).items():
+        # straight on the driver connection, these shouldn't show up as queries
+        connection.connection.execute(f"PRAGMA {name} = {value}")
+
+
+def vendor_sql(forward, backward):
+    """Returns a migration operation running the statements ``forward`` lists for the database vendor in use, and
+    those ``backward`` lists when it is unapplied. Vendors without statements are left alone."""
+
+    def run(statements):
+        def execute(apps, schema_editor):
+            for statement in statements.get(schema_editor.connection.vendor, []):
+                schema_editor.execute(statement)
+
+        return execute
+
+    return migrations.RunPython(run(forward), run(backward))
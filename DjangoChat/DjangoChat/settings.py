@@ -75,13 +75,57 @@ WSGI_APPLICATION = "DjangoChat.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# DATABASE_ENGINE=postgresql switches to PostgreSQL (needs `pip install psycopg[binary]`), configured through the
+# POSTGRES_* variables below; anything else keeps the SQLite file next to manage.py
+DATABASE_ENGINE = os.environ.get("DATABASE_ENGINE", "sqlite")
+
+# seconds a connection is kept open and reused by the thread that opened it, 0 closes it after every request or
+# websocket message; under ASGI the sync code runs in a bounded thread pool (ASGI_THREADS), so this also bounds the
+# number of open connections per worker process
+DATABASE_CONN_MAX_AGE = int(os.environ.get("DATABASE_CONN_MAX_AGE", 60))
+
+if DATABASE_ENGINE == "postgresql":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("POSTGRES_DB", "djangochat"),
+            "USER": os.environ.get("POSTGRES_USER", "djangochat"),
+            "PASSWORD": os.environ.get("POSTGRES_PASSWORD", ""),
+            "HOST": os.environ.get("POSTGRES_HOST", "127.0.0.1"),
+            "PORT": os.environ.get("POSTGRES_PORT", "5432"),
+            "CONN_MAX_AGE": DATABASE_CONN_MAX_AGE,
+            # a reused connection is checked before the request that picks it up, so a restarted database or a
+            # connection dropped by a pooler doesn't fail that request
+            "CONN_HEALTH_CHECKS": True,
+            # set when connecting through pgbouncer in transaction pooling mode
+            "DISABLE_SERVER_SIDE_CURSORS": os.environ.get("POSTGRES_PGBOUNCER", "false").lower()
+            in ("1", "true", "yes"),
+            "OPTIONS": {"connect_timeout": int(os.environ.get("POSTGRES_CONNECT_TIMEOUT", 5))},
+        }
     }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ.get("SQLITE_PATH", BASE_DIR / "db.sqlite3"),
+            "CONN_MAX_AGE": DATABASE_CONN_MAX_AGE,
+            # seconds a write waits for the database lock before failing with "database is locked"
+            "OPTIONS": {"timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000)) / 1000},
+        }
+    }
+
+# applied to every new SQLite connection by DjangoChat.database; WAL lets readers carry on while a message is being
+# written and synchronous=NORMAL only syncs to disk at checkpoints, which is safe in WAL mode
+SQLITE_PRAGMAS = {
+    "journal_mode": os.environ.get("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.environ.get("SQLITE_BUSY_TIMEOUT", 5000)),
+    "mmap_size": int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
 }
 
+# stops webchat's background writers before the test database is dropped
+TEST_RUNNER = "DjangoChat.test_runner.TestRunner"
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -123,6 +167,9 @@ MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
 MEDIA_URL = "media/"
 
+# threads that resize uploaded server and category images into their WebP/JPEG derivatives (server/images.py)
+IMAGE_DERIVATIVE_WORKERS = int(os.environ.get("IMAGE_DERIVATIVE_WORKERS", 2))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -135,6 +182,16 @@ REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": [
         "rest_framework.authentication.SessionAuthentication",
     ],
+    # orjson when it is installed, the json module otherwise, see DjangoChat/jsoncodec.py
+    "DEFAULT_RENDERER_CLASSES": [
+        "DjangoChat.jsoncodec.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "DjangoChat.jsoncodec.FastJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ],
 }
 
 SPECTACULAR_SETTINGS = {
@@ -148,4 +205,108 @@ CORS_ALLOWED_ORIGINS = [
     "http://localhost:5173",
 ]
 
-CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+# the server directory listings are cached per process by default, point REDIS_URL at a shared Redis when running
+# more than one worker so that every worker sees the same invalidations
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": os.environ["REDIS_URL"]}
+    }
+else:
+    CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+# seconds a cached server or category listing is kept, listings are also invalidated whenever the data changes
+SERVER_DIRECTORY_CACHE_TIMEOUT = int(os.environ.get("SERVER_DIRECTORY_CACHE_TIMEOUT", 300))
+
+# the in-memory channel layer only delivers messages inside one process, so with more than one ASGI worker
+# WebChatConsumer.group_send has to go through Redis to reach sockets held by the other workers
+# `python manage.py run_fakeredis` starts a local stand-in when no Redis server is available
+if os.environ.get("REDIS_URL"):
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": os.environ.get("CHANNEL_LAYER_BACKEND", "channels_redis.pubsub.RedisPubSubChannelLayer"),
+            "CONFIG": {"hosts": [os.environ["REDIS_URL"]]},
+        }
+    }
+else:
+    CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+# "sync" runs WebChatConsumer in the threadpool, "async" runs AsyncWebChatConsumer on the event loop and writes
+# messages in batches through webchat.persistence.message_writer
+WEBCHAT_CONSUMER_MODE = os.environ.get("WEBCHAT_CONSUMER_MODE", "sync")
+
+# with WEBCHAT_WRITE_BEHIND the sync consumer also hands messages to the write-behind queue instead of inserting
+# each one in its own transaction, the async consumer always does. Either way messages get their ids from
+# webchat.persistence.message_ids, so it can be switched freely
+WEBCHAT_WRITE_BEHIND = os.environ.get("WEBCHAT_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+
+# the write-behind queue is flushed once it holds this many messages or the oldest queued message has waited this
+# many seconds; senders wait once WEBCHAT_WRITE_QUEUE_SIZE messages are queued and not yet written
+WEBCHAT_WRITE_BATCH_SIZE = int(os.environ.get("WEBCHAT_WRITE_BATCH_SIZE", 100))
+WEBCHAT_WRITE_FLUSH_INTERVAL = float(os.environ.get("WEBCHAT_WRITE_FLUSH_INTERVAL", 0.05))
+WEBCHAT_WRITE_QUEUE_SIZE = int(os.environ.get("WEBCHAT_WRITE_QUEUE_SIZE", 10000))
+# times a batch that failed to write is retried before its messages are written one by one
+WEBCHAT_WRITE_RETRIES = int(os.environ.get("WEBCHAT_WRITE_RETRIES", 3))
+
+# message ids carry a worker id that has to differ between all the processes writing messages, or they write the
+# same ids; give every process its own WEBCHAT_WORKER_ID (0-1023), or leave it unset with REDIS_URL and each process
+# takes the next one from a counter in Redis on its first message
+WEBCHAT_WORKER_ID = os.environ.get("WEBCHAT_WORKER_ID") or None
+WEBCHAT_WORKER_ID_REDIS_URL = os.environ.get("REDIS_URL")
+
+# number of channel_id -> conversation id entries the websocket consumers keep in webchat.cache.conversation_cache
+WEBCHAT_CONVERSATION_CACHE_SIZE = int(os.environ.get("WEBCHAT_CONVERSATION_CACHE_SIZE", 1024))
+
+# AsyncWebChatConsumer can coalesce the messages that reach a socket within this many milliseconds into a single
+# chat.batch frame, 0 disables it (the sync consumer always sends one frame per message)
+WEBCHAT_COALESCE_WINDOW = float(os.environ.get("WEBCHAT_COALESCE_WINDOW_MS", 0)) / 1000
+# while coalescing, each socket buffers at most this many outgoing messages; when a slow client lets the buffer fill
+# up, "drop_oldest" discards its oldest pending messages and "disconnect" closes the socket
+WEBCHAT_OUTBOUND_QUEUE_SIZE = int(os.environ.get("WEBCHAT_OUTBOUND_QUEUE_SIZE", 1000))
+WEBCHAT_SLOW_CONSUMER_POLICY = os.environ.get("WEBCHAT_SLOW_CONSUMER_POLICY", "drop_oldest")
+
+# most messages replayed to a reconnecting websocket (?since=<message id>), a client that missed more is told to
+# refetch the history instead
+WEBCHAT_REPLAY_LIMIT = int(os.environ.get("WEBCHAT_REPLAY_LIMIT", 500))
+
+# webchat.recent.recent_messages keeps up to this many of the newest messages of each channel that has a websocket
+# open in the process, for the messages API and reconnect replays, and at most this many bytes over all channels
+WEBCHAT_RECENT_MESSAGES_PER_CHANNEL = int(os.environ.get("WEBCHAT_RECENT_MESSAGES_PER_CHANNEL", 200))
+WEBCHAT_RECENT_MESSAGES_MAX_BYTES = int(os.environ.get("WEBCHAT_RECENT_MESSAGES_MAX_BYTES", 32 * 1024 * 1024))
+# a channel's buffer is seeded from the database only after it has been subscribed for this many seconds, which has to
+# be longer than other workers take to write what they queued (WEBCHAT_WRITE_FLUSH_INTERVAL plus the write itself)
+WEBCHAT_RECENT_SEED_DELAY = float(os.environ.get("WEBCHAT_RECENT_SEED_DELAY", 1.0))
+
+# channels a single multiplexed websocket (webchat.consumer.MultiplexWebChatConsumer) can follow at once
+WEBCHAT_MAX_SUBSCRIPTIONS = int(os.environ.get("WEBCHAT_MAX_SUBSCRIPTIONS", 50))
+
+# websocket authentication, see webchat/auth.py: tokens from /api/ws-token/ are valid for WEBCHAT_TOKEN_MAX_AGE
+# seconds; each process remembers resolved tokens and sessions for WEBCHAT_AUTH_CACHE_TTL seconds, up to
+# WEBCHAT_AUTH_CACHE_SIZE of them, and the shared cache keeps the servers of each user for
+# WEBCHAT_MEMBERSHIP_CACHE_TIMEOUT seconds unless a membership change clears them first
+WEBCHAT_TOKEN_MAX_AGE = int(os.environ.get("WEBCHAT_TOKEN_MAX_AGE", 3600))
+WEBCHAT_AUTH_CACHE_TTL = int(os.environ.get("WEBCHAT_AUTH_CACHE_TTL", 60))
+WEBCHAT_AUTH_CACHE_SIZE = int(os.environ.get("WEBCHAT_AUTH_CACHE_SIZE", 10000))
+WEBCHAT_MEMBERSHIP_CACHE_TIMEOUT = int(os.environ.get("WEBCHAT_MEMBERSHIP_CACHE_TIMEOUT", 300))
+
+# popular channels and servers, see webchat/activity.py: a message's weight in the activity scores halves every
+# WEBCHAT_ACTIVITY_HALF_LIFE seconds and every process writes the scores it gathered to the database every
+# WEBCHAT_ACTIVITY_CHECKPOINT_INTERVAL seconds, which is also how long the rankings are cached; changing the half
+# life makes the stored scores meaningless, run rebuild_activity afterwards
+WEBCHAT_ACTIVITY_HALF_LIFE = float(os.environ.get("WEBCHAT_ACTIVITY_HALF_LIFE", 6 * 3600))
+WEBCHAT_ACTIVITY_CHECKPOINT_INTERVAL = float(os.environ.get("WEBCHAT_ACTIVITY_CHECKPOINT_INTERVAL", 10))
+
+# presence, see webchat/presence.py: every process tells the others which users it holds sockets of every
+# WEBCHAT_PRESENCE_HEARTBEAT seconds and forgets the users of a process it hasn't heard from for WEBCHAT_PRESENCE_TTL
+# seconds; a server's sockets are told who came online or went offline at most once per WEBCHAT_PRESENCE_DEBOUNCE
+# seconds, and typing notices of a user in a channel at most once per WEBCHAT_TYPING_DEBOUNCE seconds
+WEBCHAT_PRESENCE_HEARTBEAT = float(os.environ.get("WEBCHAT_PRESENCE_HEARTBEAT", 15))
+WEBCHAT_PRESENCE_TTL = float(os.environ.get("WEBCHAT_PRESENCE_TTL", 45))
+WEBCHAT_PRESENCE_DEBOUNCE = float(os.environ.get("WEBCHAT_PRESENCE_DEBOUNCE", 1.0))
+WEBCHAT_TYPING_DEBOUNCE = float(os.environ.get("WEBCHAT_TYPING_DEBOUNCE", 3))
+
+# unread counts, see webchat/unread.py: a channel with more than WEBCHAT_UNREAD_CAP unread messages shows the cap with
+# a "+", read watermarks from the websocket are written every WEBCHAT_READ_CHECKPOINT_INTERVAL seconds and the newest
+# message id of each conversation is cached for WEBCHAT_LATEST_MESSAGE_CACHE_TIMEOUT seconds after it was written
+WEBCHAT_UNREAD_CAP = int(os.environ.get("WEBCHAT_UNREAD_CAP", 99))
+WEBCHAT_READ_CHECKPOINT_INTERVAL = float(os.environ.get("WEBCHAT_READ_CHECKPOINT_INTERVAL", 2))
+WEBCHAT_LATEST_MESSAGE_CACHE_TIMEOUT = int(os.environ.get("WEBCHAT_LATEST_MESSAGE_CACHE_TIMEOUT", 3600))
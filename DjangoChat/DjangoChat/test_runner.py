@@ -0,0 +1,12 @@
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """Writes what webchat's background writers still hold before the test databases are dropped, instead of at
+    exit when their tables are gone."""
+
+    def teardown_databases(self, old_config, **kwargs):
+        from webchat.persistence import stop_background_writers
+
+        stop_background_writers()
+        super().teardown_databases(old_config, **kwargs)
@@ -20,23 +20,35 @@ from django.contrib import admin
 from django.urls import path
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 from rest_framework.routers import DefaultRouter
-from server.views import CategoryListViewSet, ServerListViewSet
-from webchat.consumer import WebChatConsumer
-from webchat.views import MessageViewSet
+from server.views import CategoryListViewSet, ServerListViewSet, ServerSearchViewSet
+from webchat.consumer import AsyncWebChatConsumer, MultiplexWebChatConsumer, WebChatConsumer
+from webchat.views import MessageViewSet, OnlineMembersView, PopularViewSet, UnreadCountView, WebsocketTokenView
 
 router = DefaultRouter()
 router.register("api/server/select", ServerListViewSet)
 router.register("api/server/category", CategoryListViewSet)
+router.register("api/server/search", ServerSearchViewSet, basename="server-search")
 router.register("api/messages", MessageViewSet, basename="message")
+router.register("api/popular", PopularViewSet, basename="popular")
 
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/docs/schema/", SpectacularAPIView.as_view(), name="schema"),
     path("api/docs/schema/ui/", SpectacularSwaggerView.as_view()),
+    path("api/ws-token/", WebsocketTokenView.as_view(), name="ws-token"),
+    path("api/presence/<int:server_id>/", OnlineMembersView.as_view(), name="online-members"),
+    path("api/unread/", UnreadCountView.as_view(), name="unread-counts"),
 ] + router.urls
 
-websocket_urlpatterns = [path("<str:serverId>/<str:channelId>", WebChatConsumer.as_asgi())]
+# WEBCHAT_CONSUMER_MODE picks between the thread based consumer and the async one with batched message writes
+ChatConsumer = AsyncWebChatConsumer if settings.WEBCHAT_CONSUMER_MODE == "async" else WebChatConsumer
+
+websocket_urlpatterns = [
+    path("<str:serverId>/<str:channelId>", ChatConsumer.as_asgi()),
+    # one socket for all the channels of a server the client subscribes to, see MultiplexWebChatConsumer
+    path("<str:serverId>", MultiplexWebChatConsumer.as_asgi()),
+]
 
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
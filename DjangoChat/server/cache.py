@@ -0,0 +1,102 @@
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils.cache import patch_vary_headers
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import Category, Channel, Server
+
+DIRECTORY_VERSION_KEY = "server:directory:version"
+
+
+# every cached listing is stored under the current directory version, so bumping the version on any change to the
+# servers, channels, categories or memberships invalidates all of them at once without having to know their keys
+def get_directory_version():
+    version = cache.get(DIRECTORY_VERSION_KEY)
+    if version is None:
+        # start from the current time rather than 1, so a version key that was evicted can never come back to a
+        # value whose listings are still cached
+        cache.add(DIRECTORY_VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(DIRECTORY_VERSION_KEY)
+    return version
+
+
+def bump_directory_version():
+    try:
+        cache.incr(DIRECTORY_VERSION_KEY)
+    except ValueError:
+        get_directory_version()
+
+
+@receiver(post_save, sender=Server)
+@receiver(post_delete, sender=Server)
+@receiver(post_save, sender=Channel)
+@receiver(post_delete, sender=Channel)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def directory_changed(sender, **kwargs):
+    bump_directory_version()
+
+
+@receiver(m2m_changed, sender=Server.member.through)
+def directory_members_changed(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        bump_directory_version()
+
+
+def if_none_match(request, etag):
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def cache_directory_response(name, params=(), per_user=None):
+    """Caches a directory listing keyed on its normalised query parameters and the directory version.
+
+    ``params`` lists the query parameters the response depends on, ``per_user`` names the boolean parameter that
+    makes it depend on the authenticated user as well. Responses carry an ETag derived from the same key, so a client
+    sending a matching If-None-Match gets a 304 without the listing being fetched or serialised.
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            by_user = per_user is not None and request.query_params.get(per_user) == "true"
+            if by_user and not request.user.is_authenticated:
+                return method(self, request, *args, **kwargs)
+
+            normalised = [(param, request.query_params.get(param, "").strip()) for param in sorted(params)]
+            if by_user:
+                normalised.append(("user", request.user.id))
+            digest = hashlib.md5(repr(normalised).encode()).hexdigest()
+            version = get_directory_version()
+            key = f"server:directory:{version}:{name}:{digest}"
+            etag = f'"{version}-{digest}"'
+
+            if if_none_match(request, etag):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+            else:
+                data = cache.get(key)
+                if data is None:
+                    response = method(self, request, *args, **kwargs)
+                    if response.status_code != status.HTTP_200_OK:
+                        return response
+                    data = list(response.data) if isinstance(response.data, list) else dict(response.data)
+                    cache.set(key, data, settings.SERVER_DIRECTORY_CACHE_TIMEOUT)
+                response = Response(data)
+            response["ETag"] = etag
+            if by_user:
+                patch_vary_headers(response, ["Cookie"])
+            return response
+
+        return wrapper
+
+    return decorator
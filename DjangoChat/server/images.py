@@ -0,0 +1,138 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+# widths of the resized copies generated for each image field, a copy is never wider than its original
+DERIVATIVE_WIDTHS = {
+    "icon": (32, 64),
+    "banner": (480, 960, 1440),
+}
+DERIVATIVE_FORMATS = (("webp", "WEBP"), ("jpg", "JPEG"))
+
+executor = ThreadPoolExecutor(max_workers=settings.IMAGE_DERIVATIVE_WORKERS, thread_name_prefix="image-derivatives")
+
+
+def derivative_name(name, width, extension):
+    # stored next to the original, e.g. server/1/server_banner/banner.png -> server/1/server_banner/banner_480w.webp
+    root, _ = os.path.splitext(name)
+    return f"{root}_{width}w.{extension}"
+
+
+def derivative_urls(instance, field_name):
+    """Returns ``[{"width", "format", "url"}]`` for the derivatives of the file currently stored in ``field_name``."""
+    file = getattr(instance, field_name)
+    return stored_derivative_urls(file.storage, file.name, instance.image_derivatives, field_name)
+
+
+def stored_derivative_urls(storage, name, derivatives, field_name):
+    """Same as derivative_urls, from the stored file name and image_derivatives column of a ``.values()`` row."""
+    entry = (derivatives or {}).get(field_name)
+    # derivatives of a file that has since been replaced are still being regenerated, don't hand them out
+    if not name or not entry or entry["source"] != name:
+        return []
+    return [
+        {"width": item["width"], "format": item["format"], "url": storage.url(item["name"])} for item in entry["files"]
+    ]
+
+
+def schedule_derivatives(instance):
+    """Queues derivative generation for every image field whose file changed since the derivatives were made."""
+    derivatives = instance.image_derivatives or {}
+    for field_name in DERIVATIVE_WIDTHS:
+        if not hasattr(instance, field_name):
+            continue
+        file = getattr(instance, field_name)
+        source = derivatives.get(field_name, {}).get("source")
+        if (file.name or None) != source:
+            label, pk = instance._meta.label, instance.pk
+            # run after the commit, so the worker sees the saved row and the request doesn't wait for the resizing
+            transaction.on_commit(
+                lambda field_name=field_name: executor.submit(build_derivatives, label, pk, field_name)
+            )
+
+
+def delete_derivatives(instance, field_name=None):
+    # read the list from the database, the instance being deleted may predate the last derivatives job
+    derivatives = type(instance).objects.filter(pk=instance.pk).values_list("image_derivatives", flat=True).first()
+    derivatives = derivatives or {}
+    for name, entry in derivatives.items():
+        if field_name is not None and name != field_name:
+            continue
+        storage = getattr(instance, name).storage
+        for item in entry["files"]:
+            storage.delete(item["name"])
+
+
+def flatten(image):
+    """Returns an RGB copy for formats without transparency, transparent parts white rather than black."""
+    if image.mode != "RGBA":
+        return image.convert("RGB")
+    return Image.alpha_composite(Image.new("RGBA", image.size, (255, 255, 255, 255)), image).convert("RGB")
+
+
+def render_derivatives(file, field_name):
+    with file.open("rb"), Image.open(file) as image:
+        image.load()
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        widths = sorted({min(width, image.width) for width in DERIVATIVE_WIDTHS[field_name]})
+        for width in widths:
+            resized = image.copy()
+            resized.thumbnail((width, image.height))
+            for extension, image_format in DERIVATIVE_FORMATS:
+                output = flatten(resized) if image_format == "JPEG" else resized
+                buffer = BytesIO()
+                output.save(buffer, image_format, quality=80)
+                yield width, extension, buffer.getvalue()
+
+
+def build_derivatives(label, pk, field_name):
+    try:
+        model = apps.get_model(label)
+        instance = model.objects.filter(pk=pk).first()
+        if instance is None:
+            return
+        file = getattr(instance, field_name)
+
+        files = []
+        if file:
+            try:
+                for width, extension, content in render_derivatives(file, field_name):
+                    name = file.storage.save(derivative_name(file.name, width, extension), ContentFile(content))
+                    files.append({"width": width, "format": extension, "name": name})
+            except (UnidentifiedImageError, OSError):
+                # e.g. SVG category icons, which are served as they are
+                logger.info("No derivatives for %s %s.%s, not a raster image", label, pk, field_name)
+
+        with transaction.atomic():
+            instance = model.objects.select_for_update().filter(pk=pk).first()
+            if instance is None or (getattr(instance, field_name).name or None) != (file.name or None):
+                # the row was deleted or got another file while we were busy, that upload has its own job
+                for item in files:
+                    file.storage.delete(item["name"])
+                return
+            delete_derivatives(instance, field_name)
+            derivatives = dict(instance.image_derivatives or {})
+            derivatives.pop(field_name, None)
+            if file:
+                derivatives[field_name] = {"source": file.name, "files": files}
+            # update() rather than save(), saving would schedule this job again
+            model.objects.filter(pk=pk).update(image_derivatives=derivatives)
+
+        # the directory listings embed the derivative URLs
+        from .cache import bump_directory_version
+
+        bump_directory_version()
+    except Exception:
+        logger.exception("Failed to build image derivatives for %s %s.%s", label, pk, field_name)
+    finally:
+        close_old_connections()
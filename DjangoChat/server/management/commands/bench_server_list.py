@@ -0,0 +1,66 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from DjangoChat.benchmarks import benchmark_database, measure
+from rest_framework.test import APIRequestFactory
+
+from server.models import Category, Channel, Server
+from server.serializer import ServerSerializer
+from server.views import ServerListViewSet
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Reports the query count and wall time of the server list endpoint for growing numbers of servers: the full "
+        "listing, the fields a sidebar asks for, and the full listing through ServerSerializer for reference"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", type=int, default=[10, 100, 1000])
+        parser.add_argument("--channels", type=int, default=3, help="Channels per server")
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        view = ServerListViewSet.as_view({"get": "list"})
+        factory = APIRequestFactory()
+
+        def list_servers(query=""):
+            return view(factory.get(f"/api/server/select/{query}")).render()
+
+        def list_servers_sidebar():
+            return list_servers("?fields=id,name,icon,category")
+
+        def list_servers_serializer():
+            # what the endpoint did before ServerListSerializer, kept as a reference point
+            queryset = Server.objects.select_related("category").prefetch_related("channel_server")
+            return ServerSerializer(queryset, many=True, context={"num_members": False}).data
+
+        with benchmark_database():
+            owner = User.objects.create(username="benchmark")
+            category = Category.objects.create(name="benchmark")
+            created = 0
+            self.stdout.write(
+                f"{'servers':>8} {'queries':>8} {'ms':>10} {'sidebar queries':>16} {'ms':>10}"
+                f" {'ServerSerializer queries':>25} {'ms':>10}"
+            )
+            for size in sorted(options["sizes"]):
+                servers = Server.objects.bulk_create(
+                    Server(name=f"server {i}", owner=owner, category=category) for i in range(created, size)
+                )
+                Channel.objects.bulk_create(
+                    Channel(name=f"channel {i}", topic="benchmark", owner=owner, server=server)
+                    for server in servers
+                    for i in range(options["channels"])
+                )
+                created = size
+                # the directory cache would answer every call after the first one
+                with override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}):
+                    queries, ms = measure(list_servers, options["repeat"])
+                    sidebar_queries, sidebar_ms = measure(list_servers_sidebar, options["repeat"])
+                old_queries, old_ms = measure(list_servers_serializer, options["repeat"])
+                self.stdout.write(
+                    f"{size:>8} {queries:>8} {ms:>10.2f} {sidebar_queries:>16} {sidebar_ms:>10.2f}"
+                    f" {old_queries:>25} {old_ms:>10.2f}"
+                )
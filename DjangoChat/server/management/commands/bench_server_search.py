@@ -0,0 +1,100 @@
+import random
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+from django.test.utils import CaptureQueriesContext
+from DjangoChat.benchmarks import benchmark_database, percentile
+from DjangoChat.database import fold_case
+
+from server.models import Category, Server
+from server.search import search_servers
+
+User = get_user_model()
+
+WORDS = (
+    "mine craft pixel dragon shadow quest arena guild legends rocket galaxy storm ninja coffee anime music chess "
+    "coding python rust retro racing tactics kingdom empire frontier studio lounge garden forest ocean".split()
+)
+CATEGORIES = "gaming music programming art science sports movies books travel food".split()
+QUERIES = {
+    "prefix": "drag",
+    "substring": "craft",
+    "typo": "dragoon",
+    "short": "mi",
+    "category": "programming",
+    "no match": "zzqxv",
+}
+
+
+class Command(BaseCommand):
+    help = "Reports server search latency against a plain icontains scan for a directory of generated servers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--servers", type=int, default=100000)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument("--limit", type=int, default=20)
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        limit = options["limit"]
+
+        def scan(text):
+            # what filtering a listing by substring amounts to without an index
+            return list(
+                Server.objects.filter(
+                    Q(name__icontains=text) | Q(description__icontains=text) | Q(category__name__icontains=text)
+                )
+                .select_related("category")
+                .order_by("-member_count")[:limit]
+            )
+
+        with benchmark_database():
+            owner = User.objects.create(username="benchmark")
+            categories = [Category.objects.create(name=name) for name in CATEGORIES]
+            start = time.perf_counter()
+            for offset in range(0, options["servers"], 5000):
+                names = [
+                    " ".join(rng.sample(WORDS, rng.randint(1, 3))).title() + f" {offset + i}"
+                    for i in range(min(5000, options["servers"] - offset))
+                ]
+                # bulk_create skips Server.save, which fills in name_folded
+                Server.objects.bulk_create(
+                    Server(
+                        name=name,
+                        name_folded=fold_case(name),
+                        description=" ".join(rng.choices(WORDS, k=12)),
+                        owner=owner,
+                        category=rng.choice(categories),
+                        # a few huge servers and a long tail of small ones
+                        member_count=int(rng.paretovariate(1.2)),
+                    )
+                    for name in names
+                )
+            self.stdout.write(f"created {options['servers']} servers in {time.perf_counter() - start:.1f}s")
+
+            self.stdout.write(
+                f"{'query':>10} {'text':>14} {'hits':>5} {'queries':>8} {'p50 ms':>8} {'p95 ms':>8}"
+                f" {'scan hits':>10} {'scan p50':>9} {'scan p95':>9}"
+            )
+            for label, text in QUERIES.items():
+                hits, queries, timings = self.time(lambda: search_servers(text, limit), options["repeat"])
+                scan_hits, _, scan_timings = self.time(lambda: scan(text), options["repeat"])
+                self.stdout.write(
+                    f"{label:>10} {text:>14} {hits:>5} {queries:>8} {percentile(timings, 50):>8.2f}"
+                    f" {percentile(timings, 95):>8.2f} {scan_hits:>10} {percentile(scan_timings, 50):>9.2f}"
+                    f" {percentile(scan_timings, 95):>9.2f}"
+                )
+
+    def time(self, search, repeat):
+        with CaptureQueriesContext(connection) as queries:
+            hits = len(search())
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            search()
+            timings.append((time.perf_counter() - start) * 1000)
+        return hits, len(queries), timings
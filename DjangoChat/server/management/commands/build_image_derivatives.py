@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from server.images import DERIVATIVE_WIDTHS, build_derivatives
+from server.models import Category, Server
+
+
+class Command(BaseCommand):
+    help = "Generates the resized image derivatives for servers and categories uploaded before they existed"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Rebuild derivatives that are already up to date")
+
+    def handle(self, *args, **options):
+        built = 0
+        for model in (Server, Category):
+            for instance in model.objects.order_by("pk").iterator():
+                for field_name in DERIVATIVE_WIDTHS:
+                    if not hasattr(instance, field_name):
+                        continue
+                    file = getattr(instance, field_name)
+                    entry = (instance.image_derivatives or {}).get(field_name)
+                    if not file or (entry and entry["source"] == file.name and not options["force"]):
+                        continue
+                    build_derivatives(model._meta.label, instance.pk, field_name)
+                    built += 1
+        self.stdout.write(self.style.SUCCESS(f"Built derivatives for {built} images"))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from server.cache import bump_directory_version
+from server.models import Server
+
+
+class Command(BaseCommand):
+    help = "Recomputes Server.member_count from the member table and repairs servers whose count has drifted"
+
+    def add_arguments(self, parser):
+        parser.add_argument("server_ids", nargs="*", type=int, help="Only check these servers")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true", help="Report drifted servers without fixing them")
+
+    def handle(self, *args, **options):
+        servers = Server.objects.order_by("pk")
+        if options["server_ids"]:
+            servers = servers.filter(pk__in=options["server_ids"])
+
+        checked = repaired = 0
+        last_pk = 0
+        while True:
+            # walk the servers in primary key batches so a large table is never counted in one go
+            batch = list(
+                servers.filter(pk__gt=last_pk)
+                .annotate(actual=Count("member"))
+                .values_list("pk", "member_count", "actual")[: options["batch_size"]]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1][0]
+            checked += len(batch)
+            for pk, member_count, actual in batch:
+                if member_count == actual:
+                    continue
+                repaired += 1
+                self.stdout.write(f"server {pk}: member_count {member_count}, actual {actual}")
+                if not options["dry_run"]:
+                    Server.objects.filter(pk=pk).update(member_count=actual)
+
+        if repaired and not options["dry_run"]:
+            # the updates above bypass the save signals, so invalidate the cached listings once here
+            bump_directory_version()
+
+        verb = "drifted" if options["dry_run"] else "repaired"
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} servers, {repaired} {verb}"))
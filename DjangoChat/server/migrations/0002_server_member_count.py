@@ -0,0 +1,31 @@
+# Generated by Django 4.2.4 on 2026-10-17 12:53
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_members(apps, schema_editor):
+    Server = apps.get_model("server", "Server")
+    counts = (
+        Server.member.through.objects.filter(server_id=OuterRef("pk"))
+        .values("server_id")
+        .annotate(total=Count("pk"))
+        .values("total")
+    )
+    Server.objects.update(member_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("server", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="server",
+            name="member_count",
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(count_members, migrations.RunPython.noop),
+    ]
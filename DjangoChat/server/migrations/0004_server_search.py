@@ -0,0 +1,54 @@
+from django.db import migrations
+from DjangoChat.database import vendor_sql
+
+# the search index lives outside the models, see server/search.py: an FTS5 table with the trigram tokenizer kept in
+# sync by triggers on SQLite, pg_trgm GIN indexes on PostgreSQL, and an index on lower(name) for prefix lookups
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE server_server_fts USING fts5(name, description, tokenize='trigram')",
+    """CREATE TRIGGER server_server_fts_insert AFTER INSERT ON server_server BEGIN
+        INSERT OR REPLACE INTO server_server_fts(rowid, name, description)
+        VALUES (new.id, new.name, coalesce(new.description, ''));
+    END""",
+    """CREATE TRIGGER server_server_fts_delete AFTER DELETE ON server_server BEGIN
+        DELETE FROM server_server_fts WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER server_server_fts_update AFTER UPDATE OF name, description ON server_server BEGIN
+        UPDATE server_server_fts SET name = new.name, description = coalesce(new.description, '')
+        WHERE rowid = new.id;
+    END""",
+    """INSERT INTO server_server_fts(rowid, name, description)
+        SELECT id, name, coalesce(description, '') FROM server_server""",
+    "CREATE INDEX server_server_name_lower_idx ON server_server (lower(name))",
+]
+SQLITE_DROP = [
+    "DROP INDEX IF EXISTS server_server_name_lower_idx",
+    "DROP TRIGGER IF EXISTS server_server_fts_insert",
+    "DROP TRIGGER IF EXISTS server_server_fts_delete",
+    "DROP TRIGGER IF EXISTS server_server_fts_update",
+    "DROP TABLE IF EXISTS server_server_fts",
+]
+POSTGRES_CREATE = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX server_server_name_trgm_idx ON server_server USING GIN (lower(name) gin_trgm_ops)",
+    """CREATE INDEX server_server_description_trgm_idx ON server_server
+        USING GIN (lower(coalesce(description, '')) gin_trgm_ops)""",
+    'CREATE INDEX server_server_name_lower_idx ON server_server ((lower(name) COLLATE "C"))',
+]
+POSTGRES_DROP = [
+    "DROP INDEX IF EXISTS server_server_name_lower_idx",
+    "DROP INDEX IF EXISTS server_server_name_trgm_idx",
+    "DROP INDEX IF EXISTS server_server_description_trgm_idx",
+]
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("server", "0003_image_derivatives"),
+    ]
+
+    operations = [
+        vendor_sql(
+            {"sqlite": SQLITE_CREATE, "postgresql": POSTGRES_CREATE},
+            {"sqlite": SQLITE_DROP, "postgresql": POSTGRES_DROP},
+        ),
+    ]
@@ -0,0 +1,50 @@
+from django.db import migrations, models
+from DjangoChat.database import fold_case, vendor_sql
+
+# prefix search looks up names folded by fold_case(), the same function the query is normalised with. SQLite's
+# lower() leaves non-ASCII letters alone, and an index on a Python function would need it on every connection
+# writing to the table, so the folded name is a column that Server.save() keeps and the index is built on that.
+# The column is nullable so that SQLite adds it in place: rebuilding the table would drop the search triggers
+SQLITE_FOLD = [
+    "DROP INDEX IF EXISTS server_server_name_lower_idx",
+    "CREATE INDEX server_server_name_folded_idx ON server_server (name_folded)",
+]
+SQLITE_UNFOLD = [
+    "DROP INDEX IF EXISTS server_server_name_folded_idx",
+    "CREATE INDEX server_server_name_lower_idx ON server_server (lower(name))",
+]
+POSTGRES_FOLD = [
+    "DROP INDEX IF EXISTS server_server_name_lower_idx",
+    'CREATE INDEX server_server_name_folded_idx ON server_server ((name_folded COLLATE "C"))',
+]
+POSTGRES_UNFOLD = [
+    "DROP INDEX IF EXISTS server_server_name_folded_idx",
+    'CREATE INDEX server_server_name_lower_idx ON server_server ((lower(name) COLLATE "C"))',
+]
+
+
+def fold_names(apps, schema_editor):
+    Server = apps.get_model("server", "Server")
+    servers = list(Server.objects.only("name"))
+    for server in servers:
+        server.name_folded = fold_case(server.name)
+    Server.objects.bulk_update(servers, ["name_folded"], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("server", "0004_server_search"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="server",
+            name="name_folded",
+            field=models.TextField(null=True, editable=False),
+        ),
+        migrations.RunPython(fold_names, migrations.RunPython.noop),
+        vendor_sql(
+            {"sqlite": SQLITE_FOLD, "postgresql": POSTGRES_FOLD},
+            {"sqlite": SQLITE_UNFOLD, "postgresql": POSTGRES_UNFOLD},
+        ),
+    ]
@@ -2,7 +2,9 @@ from django.conf import settings
 from django.db import models
 from django.dispatch import receiver
 from django.shortcuts import get_object_or_404
+from DjangoChat.database import fold_case
 
+from .images import delete_derivatives, schedule_derivatives
 from .validators import validate_icon_image_size, validate_image_file_exstension
 
 
@@ -33,6 +35,8 @@ class Category(models.Model):
     # when the admin user adds a new role to the Category table, we don't have to supply a description, unlike name
     description = models.TextField(blank=True, null=True)
     icon = models.FileField(upload_to=category_icon_upload_path, null=True, blank=True)
+    # resized copies of the icon, maintained by images.build_derivatives off the request thread
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
 
     # method that allows us to, if we upload a new image, delete the old one
     # save the new image, whenever we save smth in this model, this method will be initiated
@@ -47,6 +51,7 @@ class Category(models.Model):
                 existing.icon.delete(save=False)
         self.name = self.name.lower()
         super(Category, self).save(*args, **kwargs)
+        schedule_derivatives(self)
 
     # Django signals - when an event takes place in the model here, we can capture the fact that that event has taken place, and we can then go ahead and
     # perform additional tasks
@@ -59,6 +64,7 @@ class Category(models.Model):
                 file = getattr(instance, field.name)
                 if file:
                     file.delete(save=False)
+        delete_derivatives(instance)
 
     # when we return objects from the Category table, we'll be able to easily identify that object by its name
     def __str__(self):
@@ -89,6 +95,9 @@ class Server(models.Model):
     description = models.TextField(max_length=250, blank=True, null=True)
     # a server can have multiple members or users, and a user can be a member of multiple servers: many to many relationship between server and account/user tables
     member = models.ManyToManyField(settings.AUTH_USER_MODEL)
+    # denormalised number of members, kept in sync by server_members_changed below so listings don't have to COUNT
+    # the member join table; run the recount_members command to repair it if it ever drifts
+    member_count = models.PositiveIntegerField(default=0, db_index=True, editable=False)
 
     banner = models.ImageField(
         upload_to=server_banner_upload_path,
@@ -102,8 +111,17 @@ class Server(models.Model):
         blank=True,
         validators=[validate_icon_image_size, validate_image_file_exstension],
     )
+    # resized WebP/JPEG copies of the icon and banner, maintained by images.build_derivatives off the request thread
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
+    # name lowercased with fold_case, kept by save() for prefix search; a stored column rather than an index on a
+    # function so that only Django needs to know how names are folded, see server/search.py
+    name_folded = models.TextField(null=True, editable=False)
 
     def save(self, *args, **kwargs):
+        self.name_folded = fold_case(self.name)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "name" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "name_folded"}
         if self.id:
             existing = get_object_or_404(Server, id=self.id)
             if existing.icon != self.icon:
@@ -111,6 +129,7 @@ class Server(models.Model):
             if existing.banner != self.banner:
                 existing.banner.delete(save=False)
         super(Server, self).save(*args, **kwargs)
+        schedule_derivatives(self)
 
     @receiver(models.signals.pre_delete, sender="server.Server")
     def server_delete_files(sender, instance, **kwargs):
@@ -119,11 +138,44 @@ class Server(models.Model):
                 file = getattr(instance, field.name)
                 if file:
                     file.delete(save=False)
+        delete_derivatives(instance)
 
     def __str__(self):
         return f"{self.name}-{self.id}"
 
 
+# keep Server.member_count in step with the member table, adjusting only the servers whose membership changed
+# pk_set for a remove holds the requested ids rather than the removed ones, so the rows that really exist are looked
+# up in pre_remove/pre_clear and applied once the change went through
+@receiver(models.signals.m2m_changed, sender=Server.member.through)
+def server_members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "post_add" and pk_set:
+        if reverse:
+            Server.objects.filter(pk__in=pk_set).update(member_count=models.F("member_count") + 1)
+        else:
+            Server.objects.filter(pk=instance.pk).update(member_count=models.F("member_count") + len(pk_set))
+    elif action in ("pre_remove", "pre_clear"):
+        if reverse:
+            memberships = sender.objects.filter(account_id=instance.pk)
+            if action == "pre_remove":
+                memberships = memberships.filter(server_id__in=pk_set)
+            instance._removed_memberships = list(memberships.values_list("server_id", flat=True))
+        elif action == "pre_remove":
+            instance._removed_memberships = sender.objects.filter(server_id=instance.pk, account_id__in=pk_set).count()
+    elif action in ("post_remove", "post_clear"):
+        if not reverse and action == "post_clear":
+            Server.objects.filter(pk=instance.pk).update(member_count=0)
+            return
+        removed = getattr(instance, "_removed_memberships", None)
+        if removed is None:
+            return
+        del instance._removed_memberships
+        if reverse:
+            Server.objects.filter(pk__in=removed).update(member_count=models.F("member_count") - 1)
+        elif removed:
+            Server.objects.filter(pk=instance.pk).update(member_count=models.F("member_count") - removed)
+
+
 class Channel(models.Model):
     name = models.CharField(max_length=100)
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="channel_owner")
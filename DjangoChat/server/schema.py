@@ -1,7 +1,7 @@
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import OpenApiParameter, extend_schema
 
-from .serializer import ChannelSerializer, ServerSerializer
+from .serializer import ChannelSerializer, ServerSearchResultSerializer, ServerSerializer
 
 server_list_docs = extend_schema(
     responses=ServerSerializer(many=True),
@@ -30,11 +30,58 @@ server_list_docs = extend_schema(
             location=OpenApiParameter.QUERY,
             description="Include the number of members for each server in the response",
         ),
+        OpenApiParameter(
+            name="min_members",
+            type=OpenApiTypes.INT,
+            location=OpenApiParameter.QUERY,
+            description="Only include servers with at least this many members",
+        ),
+        OpenApiParameter(
+            name="ordering",
+            type=OpenApiTypes.STR,
+            location=OpenApiParameter.QUERY,
+            enum=["member_count", "-member_count"],
+            description="Sort servers by number of members",
+        ),
         OpenApiParameter(
             name="by_serverid",
             type=OpenApiTypes.INT,
             location=OpenApiParameter.QUERY,
             description="Include server by id",
         ),
+        OpenApiParameter(
+            name="fields",
+            type=OpenApiTypes.STR,
+            location=OpenApiParameter.QUERY,
+            description=(
+                "Comma separated fields to return, e.g. id,name,icon,category. All fields and channels by default"
+            ),
+        ),
+        OpenApiParameter(
+            name="expand",
+            type=OpenApiTypes.STR,
+            location=OpenApiParameter.QUERY,
+            enum=["channel_server"],
+            description="Nested objects to include along with fields",
+        ),
+    ],
+)
+
+server_search_docs = extend_schema(
+    responses=ServerSearchResultSerializer(many=True),
+    parameters=[
+        OpenApiParameter(
+            name="q",
+            type=OpenApiTypes.STR,
+            location=OpenApiParameter.QUERY,
+            required=True,
+            description="Text to look for in server names, descriptions and categories, tolerates typos in names",
+        ),
+        OpenApiParameter(
+            name="limit",
+            type=OpenApiTypes.INT,
+            location=OpenApiParameter.QUERY,
+            description="Number of servers to return (default 20, max 50)",
+        ),
     ],
 )
@@ -0,0 +1,161 @@
+from django.db import NotSupportedError, connection
+from DjangoChat.database import fold_case
+
+from .models import Category, Server
+
+MAX_QUERY_LENGTH = 64
+# names pulled from the index for a fuzzy match before they are checked
+FUZZY_CANDIDATES = 200
+# a substring matching more servers than this is common enough that walking the member_count index and checking
+# each server finds the most popular matches sooner than sorting everything the text index returns
+MAX_INDEX_MATCHES = 1000
+# share of the query's trigrams a server name needs to count as a fuzzy match. A typo changes the trigrams around
+# it, so this finds names with a letter missing, extra or wrong in a longer word, but two swapped letters break up
+# to three trigrams ("gmaers" shares only "ers" with "gamers") and such queries usually find nothing
+MIN_SIMILARITY = 0.4
+
+PREFIX, NAME, DESCRIPTION, FUZZY = range(4)
+# what match_tier looks at
+RANK_FIELDS = ("id", "name", "description", "member_count", "category__name")
+
+
+def normalize(text):
+    return " ".join(fold_case(text or "").split())[:MAX_QUERY_LENGTH]
+
+
+def trigrams(text):
+    return {word[i : i + 3] for word in text.split() for i in range(len(word) - 2)}
+
+
+def similarity(query_trigrams, text):
+    if not query_trigrams:
+        return 0.0
+    return len(query_trigrams & trigrams(text)) / len(query_trigrams)
+
+
+def fts_string(text):
+    return '"' + text.replace('"', '""') + '"'
+
+
+def like_pattern(text):
+    return "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def index_matches(column, query, limit):
+    """Returns up to ``limit`` ids of servers with ``query`` somewhere in ``column``, looked up in the trigram index."""
+    if connection.vendor == "sqlite":
+        sql = "SELECT rowid FROM server_server_fts WHERE server_server_fts MATCH %s LIMIT %s"
+        params = [f"{column} : {fts_string(query)}", limit]
+    elif connection.vendor == "postgresql":
+        sql = f"SELECT id FROM server_server WHERE lower(coalesce({column}, '')) LIKE %s LIMIT %s"
+        params = [like_pattern(query), limit]
+    else:
+        raise NotSupportedError(f"Server search is not available on {connection.vendor}")
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def fuzzy_matches(query, limit):
+    """Returns ids of servers whose names share trigrams with ``query``, closest first."""
+    if connection.vendor == "sqlite":
+        # bm25 puts the names sharing the most, and the rarest, trigrams first
+        sql = "SELECT rowid FROM server_server_fts WHERE server_server_fts MATCH %s ORDER BY rank LIMIT %s"
+        params = ["name : (" + " OR ".join(fts_string(t) for t in sorted(trigrams(query))) + ")", limit]
+    elif connection.vendor == "postgresql":
+        sql = "SELECT id FROM server_server WHERE lower(name) %% %s ORDER BY similarity(lower(name), %s) DESC LIMIT %s"
+        params = [query, query, limit]
+    else:
+        raise NotSupportedError(f"Server search is not available on {connection.vendor}")
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def prefix_matches(query, limit):
+    """Returns ids of the most popular servers whose name starts with ``query``.
+
+    Compares ``Server.name_folded``, the name lowercased with the same ``fold_case`` as the query, against the
+    range of strings starting with the query, which its index answers without looking at other servers.
+    """
+    upper = query[:-1] + chr(ord(query[-1]) + 1)
+    if connection.vendor == "postgresql":
+        # the range is in code point order, which the index is only built in under the C collation
+        folded = 'name_folded COLLATE "C"'
+    else:
+        folded = "name_folded"
+    sql = f"""
+        SELECT id FROM server_server WHERE {folded} >= %s AND {folded} < %s
+        ORDER BY member_count DESC LIMIT %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [query, upper, limit])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def substring_matches(field, query, limit):
+    """Returns ids of the most popular servers with ``query`` somewhere in ``field``."""
+    if len(query) < 3:
+        # trigrams need three characters
+        return []
+    ids = index_matches(field, query, MAX_INDEX_MATCHES + 1)
+    if len(ids) <= MAX_INDEX_MATCHES:
+        servers = Server.objects.filter(id__in=ids)
+    else:
+        # a common substring, walking the member_count index finds the most popular matches quickly
+        servers = Server.objects.filter(**{f"{field}__icontains": query})
+    return list(servers.order_by("-member_count").values_list("id", flat=True)[:limit])
+
+
+def match_tier(name, description, category, query, query_trigrams):
+    name = fold_case(name)
+    if name.startswith(query):
+        return PREFIX
+    if query in name or category == query:
+        return NAME
+    if query in fold_case(description or "") or query in category:
+        return DESCRIPTION
+    if similarity(query_trigrams, name) >= MIN_SIMILARITY:
+        return FUZZY
+    return None
+
+
+def search_servers(text, limit):
+    """Returns up to ``limit`` servers matching ``text``, best first.
+
+    Servers whose name starts with the query come first, then those with the query in their name or as their
+    category, then in their description or category, then names that are merely close (typos, though not swapped
+    letters, see ``MIN_SIMILARITY``). Within each of these, servers with more members rank higher. All servers a
+    lookup returns share a kind of match, so each only needs to return its ``limit`` most popular servers, and later
+    kinds are only looked up while the earlier ones haven't filled the page. Only the servers that make it onto the
+    page are loaded in full.
+    """
+    query = normalize(text)
+    if not query:
+        return []
+    query_trigrams = trigrams(query)
+    ranked = {}
+    candidates = Server.objects.values_list(*RANK_FIELDS)
+
+    def add(rows):
+        for pk, name, description, member_count, category in rows:
+            if pk not in ranked:
+                tier = match_tier(name, description, category, query, query_trigrams)
+                if tier is not None:
+                    ranked[pk] = (tier, -member_count, pk)
+
+    def found(tier):
+        return sum(1 for item in ranked.values() if item[0] <= tier)
+
+    # one or two letters are inside too many category names to mean anything there
+    categories = Category.objects.filter(**{"name__contains" if len(query) >= 3 else "name__startswith": query})
+    add(candidates.filter(category__in=categories).order_by("-member_count")[:limit])
+    add(candidates.filter(id__in=prefix_matches(query, limit) + substring_matches("name", query, limit)))
+    if found(NAME) < limit:
+        add(candidates.filter(id__in=substring_matches("description", query, limit)))
+    if found(DESCRIPTION) < limit and query_trigrams:
+        add(candidates.filter(id__in=fuzzy_matches(query, FUZZY_CANDIDATES)))
+
+    ids = [pk for *_, pk in sorted(ranked.values())[:limit]]
+    servers = Server.objects.select_related("category").in_bulk(ids)
+    return [servers[pk] for pk in ids if pk in servers]
@@ -0,0 +1,233 @@
+import sqlite3
+from io import BytesIO
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from PIL import Image
+
+from .images import render_derivatives
+from .models import Category, Channel, Server
+from .search import PREFIX, match_tier, prefix_matches, search_servers
+
+User = get_user_model()
+
+
+class ServerListQueryCountTests(TestCase):
+    """The server listing takes the same number of queries however many servers, members and channels it returns."""
+
+    # query string -> queries it takes on a cache miss
+    listings = {
+        "": 2,
+        "fields=id,name,icon,category": 1,
+        "fields=id,name&expand=channel_server": 2,
+        "with_num_members=true&min_members=2": 2,
+        "category=games&with_num_members=true&min_members=1&ordering=-member_count": 2,
+        "fields=id,name,category&expand=channel_server&with_num_members=true&min_members=2": 2,
+    }
+
+    def setUp(self):
+        self.owner = User.objects.create(username="owner")
+        self.categories = [Category.objects.create(name=name) for name in ("games", "music")]
+        self.users = [User.objects.create(username=f"user{i}") for i in range(4)]
+        self.servers = 0
+
+    def add_servers(self, count):
+        for _ in range(count):
+            server = Server.objects.create(
+                name=f"server {self.servers}", owner=self.owner, category=self.categories[self.servers % 2]
+            )
+            server.member.add(*self.users[: 1 + self.servers % len(self.users)])
+            for i in range(3):
+                Channel.objects.create(name=f"channel {i}", topic="topic", owner=self.owner, server=server)
+            self.servers += 1
+
+    def list_servers(self, query):
+        # responses are cached, only a miss shows what the listing itself costs
+        cache.clear()
+        response = self.client.get(f"/api/server/select/?{query}")
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_query_count_does_not_grow_with_the_servers(self):
+        for total in (2, 10, 40):
+            self.add_servers(total - self.servers)
+            for query, queries in self.listings.items():
+                with self.subTest(servers=total, query=query), self.assertNumQueries(queries):
+                    servers = self.list_servers(query)
+                if not query:
+                    self.assertEqual(len(servers), total)
+                    self.assertTrue(all(len(server["channel_server"]) == 3 for server in servers))
+
+
+class MemberCountTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create(username=f"user{i}") for i in range(3)]
+        category = Category.objects.create(name="games")
+        self.servers = [
+            Server.objects.create(name=f"server {i}", owner=self.users[0], category=category) for i in range(2)
+        ]
+
+    def assertCounts(self, *counts):
+        for server, count in zip(self.servers, counts):
+            server.refresh_from_db()
+            self.assertEqual(server.member_count, count)
+            self.assertEqual(server.member.count(), count)
+
+    def test_adding_and_removing_members(self):
+        server = self.servers[0]
+        server.member.add(*self.users)
+        self.assertCounts(3, 0)
+        # already members, nothing changes
+        server.member.add(self.users[0], self.users[1])
+        self.assertCounts(3, 0)
+        server.member.remove(self.users[0])
+        self.assertCounts(2, 0)
+        # not a member any more
+        server.member.remove(self.users[0])
+        self.assertCounts(2, 0)
+        server.member.set([self.users[0], self.users[2]])
+        self.assertCounts(2, 0)
+        server.member.clear()
+        self.assertCounts(0, 0)
+
+    def test_joining_from_the_account_side(self):
+        account = self.users[1]
+        account.server_set.add(*self.servers)
+        self.assertCounts(1, 1)
+        account.server_set.add(self.servers[0])
+        self.assertCounts(1, 1)
+        self.users[2].server_set.add(self.servers[0])
+        account.server_set.remove(self.servers[0])
+        self.assertCounts(1, 1)
+        account.server_set.remove(self.servers[0])
+        self.assertCounts(1, 1)
+        account.server_set.clear()
+        self.assertCounts(1, 0)
+        self.users[2].server_set.clear()
+        self.assertCounts(0, 0)
+
+
+class DirectoryCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        owner = User.objects.create(username="owner")
+        self.category = Category.objects.create(name="games")
+        self.server = Server.objects.create(name="server", owner=owner, category=self.category)
+
+    def get(self, url, etag=None):
+        headers = {"HTTP_IF_NONE_MATCH": etag} if etag else {}
+        return self.client.get(url, **headers)
+
+    def test_matching_etag_gets_a_304(self):
+        for url in ("/api/server/select/", "/api/server/category/"):
+            with self.subTest(url=url):
+                response = self.get(url)
+                self.assertEqual(response.status_code, 200)
+                etag = response["ETag"]
+                with self.assertNumQueries(0):
+                    response = self.get(url, etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response["ETag"], etag)
+                self.assertEqual(self.get(url, '"stale"').status_code, 200)
+
+    def test_saving_changes_the_etag(self):
+        for url, instance in (("/api/server/select/", self.server), ("/api/server/category/", self.category)):
+            with self.subTest(url=url):
+                etag = self.get(url)["ETag"]
+                instance.name = "renamed"
+                instance.save()
+                response = self.get(url, etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response["ETag"], etag)
+                self.assertIn("renamed", [item["name"] for item in response.json()])
+
+    def test_each_query_is_cached_on_its_own(self):
+        other = Category.objects.create(name="music")
+        Server.objects.create(name="band", owner=self.server.owner, category=other)
+        games = self.get("/api/server/select/?category=games")
+        music = self.get("/api/server/select/?category=music")
+        self.assertNotEqual(games["ETag"], music["ETag"])
+        self.assertEqual([server["name"] for server in games.json()], ["server"])
+        self.assertEqual([server["name"] for server in music.json()], ["band"])
+        counted = self.get("/api/server/select/?category=games&with_num_members=true")
+        self.assertNotEqual(counted["ETag"], games["ETag"])
+        # the same parameters in another order, plus unrelated ones, share the cached listing
+        with self.assertNumQueries(0):
+            again = self.get("/api/server/select/?with_num_members=true&utm=1&category=games")
+        self.assertEqual(again["ETag"], counted["ETag"])
+        self.assertEqual(again.json(), counted.json())
+
+
+class ServerSearchTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create(username="owner")
+        category = Category.objects.create(name="games")
+        self.servers = {
+            name: Server.objects.create(name=name, owner=owner, category=category)
+            for name in ("Élan Vital", "Übungsraum", "elan", "Gamers")
+        }
+
+    def test_prefix_matches_fold_non_ascii_names(self):
+        for query, name in (("élan", "Élan Vital"), ("übung", "Übungsraum")):
+            with self.subTest(query=query):
+                self.assertEqual(prefix_matches(query, 10), [self.servers[name].id])
+                found = search_servers(query.upper(), 10)
+                self.assertEqual(found[0], self.servers[name])
+                self.assertEqual(match_tier(name, "", "games", query, set()), PREFIX)
+
+    def test_close_names_are_found(self):
+        self.assertIn(self.servers["Gamers"], search_servers("gamerz", 10))
+
+    def test_renaming_folds_the_new_name(self):
+        server = self.servers["Gamers"]
+        server.name = "Ärger"
+        server.save(update_fields=["name"])
+        self.assertEqual(prefix_matches("ärg", 10), [server.id])
+        self.assertEqual(prefix_matches("gamers", 10), [])
+
+    @skipUnless(connection.vendor == "sqlite", "SQLite only")
+    def test_schema_needs_no_python_functions(self):
+        # the table as the sqlite3 shell, dbshell or a restored backup would see it, without Django's connection setup
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT sql FROM sqlite_master WHERE tbl_name IN ('server_server', 'server_server_fts') AND sql != ''"
+                " ORDER BY type = 'table' DESC, type = 'index' DESC"
+            )
+            schema = [row[0] for row in cursor.fetchall()]
+        plain = sqlite3.connect(":memory:")
+        self.addCleanup(plain.close)
+        for sql in schema:
+            plain.execute(sql)
+        plain.execute(
+            "INSERT INTO server_server (name, name_folded, owner_id, category_id, member_count, image_derivatives)"
+            " VALUES ('Élan', 'élan', 1, 1, 0, '{}')"
+        )
+        plain.execute("UPDATE server_server SET name = 'Elan', name_folded = 'elan'")
+        self.assertEqual(plain.execute("SELECT rowid, name FROM server_server_fts").fetchall(), [(1, "Elan")])
+
+
+class RenderDerivativesTests(SimpleTestCase):
+    def test_transparency_turns_white_in_jpeg(self):
+        # left half opaque red, right half fully transparent
+        image = Image.new("RGBA", (64, 64), (0, 0, 0, 0))
+        image.paste((255, 0, 0, 255), (0, 0, 32, 64))
+        buffer = BytesIO()
+        image.save(buffer, "PNG")
+
+        derivatives = list(render_derivatives(ContentFile(buffer.getvalue(), "icon.png"), "icon"))
+        jpegs = [content for width, extension, content in derivatives if extension == "jpg"]
+        self.assertEqual(len(jpegs), 2)
+        for content in jpegs:
+            with Image.open(BytesIO(content)) as jpeg:
+                red, green, blue = jpeg.getpixel((jpeg.width - 1, jpeg.height // 2))
+                self.assertGreater(min(red, green, blue), 240)
+                red, green, blue = jpeg.getpixel((0, jpeg.height // 2))
+                self.assertGreater(red, 200)
+                self.assertLess(max(green, blue), 60)
+        webp = next(content for width, extension, content in derivatives if extension == "webp")
+        with Image.open(BytesIO(webp)) as image:
+            self.assertEqual(image.mode, "RGBA")
@@ -5,7 +5,9 @@ from PIL import Image
 
 
 def validate_icon_image_size(image):
-    if image:
+    # a file that is already stored was validated when it was uploaded, don't read it back from storage again
+    if image and not getattr(image, "_committed", False):
+        # Image.open only parses the header, which is all we need for the dimensions
         with Image.open(image) as img:
             # in pixels
             if img.width > 70 or img.height > 70:
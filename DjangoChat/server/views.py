@@ -1,4 +1,3 @@
-from django.db.models import Count
 from django.shortcuts import render
 from drf_spectacular.utils import extend_schema
 from rest_framework import viewsets
@@ -6,9 +5,11 @@ from rest_framework.exceptions import AuthenticationFailed, ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
+from .cache import cache_directory_response
 from .models import Category, Server
-from .schema import server_list_docs
-from .serializer import CategorySerializer, ServerSerializer
+from .schema import server_list_docs, server_search_docs
+from .search import search_servers
+from .serializer import SERVER_LIST_FIELDS, CategorySerializer, ServerListSerializer, ServerSearchResultSerializer
 
 # views are Python functions or classes that receive a web request and return a web response. The response can be a simple HTTP response, an HTML template response, or an HTTP redirect response that redirects a user to another page.
 # Views hold the logic that is required to return information as a response in whatever form to the user. As a matter of best practice, the logic that deals with views is held in the views.py file in a Django app.
@@ -18,8 +19,9 @@ class CategoryListViewSet(viewsets.ViewSet):
     queryset = Category.objects.all()
 
     @extend_schema(responses=CategorySerializer)
+    @cache_directory_response("category")
     def list(self, request):
-        serializer = CategorySerializer(self.queryset, many=True)
+        serializer = CategorySerializer(self.queryset.all(), many=True)
         return Response(serializer.data)
 
 
@@ -32,11 +34,30 @@ class CategoryListViewSet(viewsets.ViewSet):
 # utilizing 1 endpoint and allows it to pass in multiple parameters in order to return different data/resources from this particular endpoint
 class ServerListViewSet(viewsets.ViewSet):
     # represents a collection of all Server objects/data from the database
+    # ServerListSerializer selects only the columns it needs from it, joining the category when its name is asked
+    # for and fetching the channels in one extra query when they are expanded
     queryset = Server.objects.all()
+    # what can be expanded into nested objects, left out when the listing is narrowed down with `fields`
+    expandable = ("channel_server",)
     # permission_classes = [IsAuthenticated]
 
     # list function in the viewSets is used for get request to retrieve a list of instances or objects from the database
     @server_list_docs
+    @cache_directory_response(
+        "server",
+        params=(
+            "category",
+            "qty",
+            "by_user",
+            "by_serverid",
+            "with_num_members",
+            "min_members",
+            "ordering",
+            "fields",
+            "expand",
+        ),
+        per_user="by_user",
+    )
     def list(self, request):
         """Returns a list of servers filtered by various parameters.
 
@@ -47,7 +68,12 @@ class ServerListViewSet(viewsets.ViewSet):
         - `qty`: Limits the number of servers returned.
         - `by_user`: Filters servers by user ID, only returning servers that the user is a member of.
         - `by_serverid`: Filters servers by server ID.
-        - `with_num_members`: Annotates each server with the number of members it has.
+        - `with_num_members`: Includes the number of members of each server.
+        - `min_members`: Only returns servers with at least this many members.
+        - `ordering`: Sorts servers by `member_count` (ascending) or `-member_count` (descending).
+        - `fields`: Comma separated fields to return, e.g. `id,name,icon`. Without it every field is returned,
+          channels included.
+        - `expand`: Comma separated nested objects to include along with `fields`, only `channel_server`.
 
         Args:
         request: A Django Request object containing query parameters.
@@ -59,21 +85,30 @@ class ServerListViewSet(viewsets.ViewSet):
         AuthenticationFailed: If the query includes the 'by_user' or 'by_serverid'
             parameters and the user is not authenticated.
         ValidationError: If there is an error parsing or validating the query parameters.
-            This can occur if the `by_serverid` parameter is not a valid integer, or if the
-            server with the specified ID does not exist.
+            This can occur if the `by_serverid` or `min_members` parameter is not a valid integer,
+            if `ordering` is not one of the supported values, if `fields` or `expand` name a field the
+            listing doesn't have, or if the server with the specified ID does not exist.
 
         Examples:
-        To retrieve all servers in the 'gaming' category with at least 5 members, you can make
-        the following request:
+        To retrieve all servers in the 'gaming' category with at least 5 members, most popular
+        first, you can make the following request:
 
-            GET /servers/?category=gaming&with_num_members=true&num_members__gte=5
+            GET /servers/?category=gaming&with_num_members=true&min_members=5&ordering=-member_count
 
         To retrieve the first 10 servers that the authenticated user is a member of, you can make
         the following request:
 
             GET /servers/?by_user=true&qty=10
 
+        To retrieve only what a sidebar shows, you can make the following request:
+
+            GET /servers/?fields=id,name,icon,category
+
         """
+        # start from a fresh copy of the class level queryset, iterating the shared one would cache its results
+        # across requests
+        self.queryset = self.queryset.all()
+
         # capture the category id that is being passed into this endpoint from the get request that was sent
         category = request.query_params.get("category")
         # capture number of servers
@@ -83,6 +118,9 @@ class ServerListViewSet(viewsets.ViewSet):
         by_serverid = request.query_params.get("by_serverid")
         # a boolean
         with_num_members = request.query_params.get("with_num_members") == "true"
+        min_members = request.query_params.get("min_members")
+        ordering = request.query_params.get("ordering")
+        fields = self.get_fields(request, with_num_members)
 
         # we may want to pre check whether the user is actually logged in or not before we allow the user to access some of the different end points here
         # So if the by user if the user ID is sent as a parameter to this endpoint and the user is not logged in, then we're going to tell them that the authentication is failed. You have to be authenticated to actually utilize that particular filter.
@@ -102,12 +140,17 @@ class ServerListViewSet(viewsets.ViewSet):
                 self.queryset = self.queryset.filter(member=user_id)
             else:
                 raise AuthenticationFailed()
-        # annotation is a feature that allows you to add calculated fields to a queryset and to perform complex calculations on queryset data
-        # whenever we select a particular server, we also want to include data related to how many members are in that server
-        # here, we use annotation to add additional data to our server model/data that is returned back to the frontend
-        if with_num_members:
-            # num_members is a new field that we're going to create and include in our queryset
-            self.queryset = self.queryset.annotate(num_members=Count("member"))
+        # the number of members is read from the indexed member_count column, so filtering and sorting on it doesn't
+        # need an aggregate over the member table; with_num_members only decides whether the serializer returns it
+        if min_members:
+            try:
+                self.queryset = self.queryset.filter(member_count__gte=int(min_members))
+            except ValueError:
+                raise ValidationError(detail="min_members must be an integer")
+        if ordering:
+            if ordering not in ("member_count", "-member_count"):
+                raise ValidationError(detail="ordering must be member_count or -member_count")
+            self.queryset = self.queryset.order_by(ordering, "id")
         if qty:
             # items from the beginning through int(qty)-1
             self.queryset = self.queryset[: int(qty)]
@@ -121,7 +164,51 @@ class ServerListViewSet(viewsets.ViewSet):
             except ValueError:
                 raise ValidationError(detail=f"Server value error")
 
-        # So what we're going to do here is we're going to utilize this boolean true with_num_members that we're going to pass in and we're going to pass that into the serializer.
-        # So we're going to pass in the fact that we are trying to utilize this filter into the serializer. So we're going to pass that in as context. So in the serializer here, what we're going to do is we're going to add that in. So we're simply just going to specify context equals and I'm going to call that num. Members. And so there's key value situation going on here. So that needs to be that's the key. And then the value is going to be with Num members. So that's what we're passing in remembering the filter. So that's true. Or if we don't add that into our filter, that parameter false. So we're going to pass that in and we're going to use this information, reference this and use this information to decide whether to include the field in the return data, Right? So we're going to pass that into our serializer.
-        serializer = ServerSerializer(self.queryset, many=True, context={"num_members": with_num_members})
+        # with_num_members decides whether the number of members is part of the response, so it is passed on to the
+        # serializer along with the other fields that were asked for
+        serializer = ServerListSerializer(self.queryset, fields)
+        return Response(serializer.data)
+
+    def get_fields(self, request, with_num_members):
+        """Returns the names of the fields the listing should contain."""
+        fields = self.parse_list(request.query_params.get("fields"))
+        expand = self.parse_list(request.query_params.get("expand")) or []
+        unknown = [field for field in expand if field not in self.expandable]
+        if fields is not None:
+            unknown += [field for field in fields if field not in SERVER_LIST_FIELDS]
+        if unknown:
+            raise ValidationError(detail=f"unknown fields: {', '.join(unknown)}")
+
+        if fields is None:
+            # no fields asked for: every field, channels included, like before fields could be picked
+            fields = [field for field in SERVER_LIST_FIELDS if field != "num_members"]
+        fields = set(fields) | set(expand)
+        if with_num_members:
+            fields.add("num_members")
+        return fields
+
+    @staticmethod
+    def parse_list(value):
+        # a missing or empty parameter both mean nothing was picked
+        items = [item.strip() for item in (value or "").split(",") if item.strip()]
+        return items or None
+
+
+# search for the explore page, so it doesn't have to download whole category listings and filter them itself
+class ServerSearchViewSet(viewsets.ViewSet):
+    default_limit = 20
+    max_limit = 50
+
+    @server_search_docs
+    @cache_directory_response("search", params=("q", "limit"))
+    def list(self, request):
+        try:
+            limit = min(int(request.query_params.get("limit", self.default_limit)), self.max_limit)
+        except ValueError:
+            raise ValidationError(detail="limit must be an integer")
+        if limit < 1:
+            raise ValidationError(detail="limit must be positive")
+
+        servers = search_servers(request.query_params.get("q", ""), limit)
+        serializer = ServerSearchResultSerializer(servers, many=True)
         return Response(serializer.data)
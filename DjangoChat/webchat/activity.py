@@ -0,0 +1,199 @@
+import atexit
+import logging
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+from server.models import Channel, Server
+
+from .models import ChannelActivity, Message, ServerActivity
+
+logger = logging.getLogger(__name__)
+
+
+# activity scores are message counts that decay exponentially, every message counts half as much after each
+# WEBCHAT_ACTIVITY_HALF_LIFE seconds; that is a sliding window without edges that needs no per-message state
+# a score is kept as log2 of the sum of 2 ** (t / half_life) over the times t of the messages: a new message only
+# changes the score of its own channel, and since time scales every score by the same factor, the order of the
+# scores never changes as time passes, so checkpointed rows and an index on them stay a valid ranking forever
+def log2_add(a, b):
+    """Returns log2(2 ** a + 2 ** b) without overflowing."""
+    if a is None:
+        return b
+    high, low = (a, b) if a >= b else (b, a)
+    return high + math.log2(1 + 2 ** (low - high))
+
+
+def message_score(timestamp=None):
+    moment = timestamp.timestamp() if timestamp is not None else time.time()
+    return moment / settings.WEBCHAT_ACTIVITY_HALF_LIFE
+
+
+def decayed(score, now=None):
+    """Turns a score into the decayed number of messages it stands for at ``now``."""
+    return 2 ** (score - message_score(now))
+
+
+class ActivityTracker:
+    """Per-process activity scores of the channels messages were sent to since the last checkpoint.
+
+    ``record`` is called for every message sent through this process and only updates a dict entry. A background
+    thread merges the scores into the ChannelActivity and ServerActivity tables every ``interval`` seconds, touching
+    only the channels that had messages, so the cost follows the traffic and not the number of channels. Several
+    worker processes checkpoint into the same rows.
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval or settings.WEBCHAT_ACTIVITY_CHECKPOINT_INTERVAL
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="webchat-activity", daemon=True)
+            self._thread.start()
+
+    def record(self, channel_id, timestamp=None):
+        self.start()
+        score = message_score(timestamp)
+        with self._lock:
+            self._pending[channel_id] = log2_add(self._pending.get(channel_id), score)
+
+    def pending(self):
+        return len(self._pending)
+
+    def checkpoint(self):
+        """Adds the scores recorded since the last checkpoint to the tables, returns the number of channels."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            merge_scores(pending)
+        except Exception:
+            # keep the scores for the next checkpoint, e.g. after losing a race to create the same row
+            with self._lock:
+                for channel_id, score in pending.items():
+                    self._pending[channel_id] = log2_add(self._pending.get(channel_id), score)
+            raise
+        return len(pending)
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        try:
+            self.checkpoint()
+        except Exception:
+            logger.exception("Failed to checkpoint channel activity on shutdown")
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.checkpoint()
+            except Exception:
+                logger.exception("Failed to checkpoint channel activity")
+            finally:
+                close_old_connections()
+
+
+def merge_scores(pending):
+    """Adds scores by channel id to the channel rows and the rows of their servers."""
+    # channel ids are group names, anything that isn't a channel any more is dropped
+    ids = [int(channel_id) for channel_id in pending if channel_id.isdigit()]
+    servers = dict(Channel.objects.filter(id__in=ids).values_list("id", "server_id"))
+    channel_scores = {}
+    server_scores = {}
+    for channel_id, score in pending.items():
+        if channel_id.isdigit() and int(channel_id) in servers:
+            channel_id = int(channel_id)
+            channel_scores[channel_id] = log2_add(channel_scores.get(channel_id), score)
+            server_id = servers[channel_id]
+            server_scores[server_id] = log2_add(server_scores.get(server_id), score)
+
+    now = timezone.now()
+    with transaction.atomic():
+        merge_rows(ChannelActivity, channel_scores, now, lambda pk: {"server_id": servers[pk]})
+        merge_rows(ServerActivity, server_scores, now, lambda pk: {})
+
+
+def merge_rows(model, scores, now, extra):
+    # rows are locked while they are read, so checkpoints of several processes don't overwrite each other
+    current = dict(model.objects.select_for_update().filter(pk__in=list(scores)).values_list("pk", "score"))
+    if current:
+        # one prepared statement for every row, bulk_update's CASE over hundreds of rows costs far more to build
+        table, pk_column = model._meta.db_table, model._meta.pk.column
+        updated_at = model._meta.get_field("updated_at").get_db_prep_save(now, connection)
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"UPDATE {connection.ops.quote_name(table)} SET score = %s, updated_at = %s "
+                f"WHERE {connection.ops.quote_name(pk_column)} = %s",
+                [(log2_add(score, scores[pk]), updated_at, pk) for pk, score in current.items()],
+            )
+    model.objects.bulk_create(
+        [model(pk=pk, score=score, updated_at=now, **extra(pk)) for pk, score in scores.items() if pk not in current]
+    )
+
+
+channel_activity = ActivityTracker()
+
+# scores recorded since the last checkpoint would be lost with the process
+atexit.register(channel_activity.stop)
+
+
+def popular_servers(limit):
+    """Returns the ``limit`` most active servers with their ``activity``, topped up with the biggest servers.
+
+    Both come off an index, so this costs the same however many servers and messages there are.
+    """
+    now = timezone.now()
+    servers = []
+    for row in ServerActivity.objects.select_related("server__category").order_by("-score")[:limit]:
+        row.server.activity = decayed(row.score, now)
+        servers.append(row.server)
+    if len(servers) < limit:
+        # too few servers had messages yet, e.g. right after deploying, rank the rest by members
+        biggest = (
+            Server.objects.select_related("category")
+            .exclude(id__in=[server.id for server in servers])
+            .order_by("-member_count", "id")[: limit - len(servers)]
+        )
+        for server in biggest:
+            server.activity = 0.0
+            servers.append(server)
+    return servers
+
+
+def popular_channels(limit, server_ids=None):
+    """Returns the ``limit`` most active channels, of all servers or only of ``server_ids``, with their ``activity``."""
+    now = timezone.now()
+    rows = ChannelActivity.objects.select_related("channel")
+    if server_ids is not None:
+        rows = rows.filter(server_id__in=list(server_ids))
+    channels = []
+    for row in rows.order_by("-score")[:limit]:
+        row.channel.activity = decayed(row.score, now)
+        channels.append(row.channel)
+    return channels
+
+
+def rebuild_activity(since):
+    """Replaces the activity tables with scores computed from the messages sent after ``since``."""
+    scores = {}
+    messages = Message.objects.filter(timestamp__gte=since).values_list("conversation__channel_id", "timestamp")
+    for channel_id, timestamp in messages.iterator(chunk_size=5000):
+        scores[channel_id] = log2_add(scores.get(channel_id), message_score(timestamp))
+    with transaction.atomic():
+        ChannelActivity.objects.all().delete()
+        ServerActivity.objects.all().delete()
+        merge_scores(scores)
+    return len(scores)
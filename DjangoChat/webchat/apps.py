@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class WebchatConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "webchat"
+
+    def ready(self):
+        # connects the receiver that tunes every new SQLite connection, the chat is what writes the most
+        from DjangoChat import database  # noqa: F401
+
+        # connects the receivers that clear cached server memberships, wherever memberships are changed
+        from . import auth  # noqa: F401
@@ -0,0 +1,216 @@
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlsplit
+
+from channels.auth import get_user
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from server.models import Channel, Server
+
+TOKEN_SALT = "webchat.websocket"
+
+
+class SocketUser:
+    """The user a websocket acts as, built from a token's claims or a session without keeping a model instance."""
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, id, username):
+        self.id = id
+        self.pk = id
+        self.username = username
+
+    def __str__(self):
+        return self.username
+
+
+def issue_token(user):
+    """Returns a signed websocket token for ``user``, valid for ``settings.WEBCHAT_TOKEN_MAX_AGE`` seconds."""
+    expires = int(time.time()) + settings.WEBCHAT_TOKEN_MAX_AGE
+    return signing.dumps({"id": user.id, "name": user.get_username(), "exp": expires}, salt=TOKEN_SALT)
+
+
+def read_token(token):
+    """Returns ``(SocketUser, expiry timestamp)`` for a valid token, None for a forged or expired one."""
+    try:
+        claims = signing.loads(token, salt=TOKEN_SALT)
+    except signing.BadSignature:
+        return None
+    if claims.get("exp", 0) <= time.time():
+        return None
+    return SocketUser(claims["id"], claims["name"]), claims["exp"]
+
+
+class CredentialCache:
+    """Process-wide LRU of credential -> SocketUser, entries expire after ``ttl`` seconds.
+
+    Checking a token's signature or loading a session for every connect adds up when many clients reconnect at
+    once, a cached credential is resolved without either. ``ttl`` bounds how long a logged out session keeps
+    working for new sockets.
+    """
+
+    def __init__(self, ttl=None, maxsize=None):
+        self.ttl = ttl if ttl is not None else settings.WEBCHAT_AUTH_CACHE_TTL
+        self.maxsize = maxsize or settings.WEBCHAT_AUTH_CACHE_SIZE
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return user
+
+    def set(self, key, user, valid_for=None):
+        ttl = self.ttl if valid_for is None else min(self.ttl, valid_for)
+        with self._lock:
+            self._entries[key] = (user, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+credential_cache = CredentialCache()
+
+
+def origin_allowed(scope):
+    # a session cookie is sent along by any page the browser has open, only trust it from the frontend's origins
+    headers = dict(scope.get("headers", []))
+    origin = headers.get(b"origin")
+    if origin is None:
+        return True
+    origin = origin.decode("latin1")
+    return origin in settings.CORS_ALLOWED_ORIGINS or urlsplit(origin).netloc == headers.get(b"host", b"").decode()
+
+
+class WebsocketAuthMiddleware(BaseMiddleware):
+    """Puts the user of a websocket into ``scope["user"]``, an AnonymousUser when it can't be authenticated.
+
+    The user comes from a ``token`` query parameter issued by the websocket token endpoint, or else from the
+    session cookie, so it has to be wrapped in channels' SessionMiddlewareStack. Either is looked up in
+    ``credential_cache`` first, a token that isn't cached only needs its signature checked, a session the
+    database.
+    """
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        scope["user"] = await self.resolve(scope)
+        return await self.inner(scope, receive, send)
+
+    async def resolve(self, scope):
+        token = parse_qs(scope.get("query_string", b"").decode()).get("token")
+        if token:
+            key = ("token", token[0])
+            user = credential_cache.get(key)
+            if user is None:
+                claims = read_token(token[0])
+                if claims is None:
+                    return AnonymousUser()
+                user, expires = claims
+                credential_cache.set(key, user, expires - time.time())
+            return user
+
+        session = scope.get("session")
+        if session is None or session.session_key is None or not origin_allowed(scope):
+            return AnonymousUser()
+        key = ("session", session.session_key)
+        user = credential_cache.get(key)
+        if user is None:
+            account = await get_user(scope)
+            if not account.is_authenticated:
+                return AnonymousUser()
+            user = SocketUser(account.id, account.get_username())
+            credential_cache.set(key, user)
+        return user
+
+
+def servers_key(user_id):
+    return f"webchat:servers:{user_id}"
+
+
+def channel_key(channel_id):
+    return f"webchat:channel-server:{channel_id}"
+
+
+def member_servers(user_id):
+    """Returns the ids of the servers ``user_id`` owns or is a member of, cached in the shared cache."""
+    servers = cache.get(servers_key(user_id))
+    if servers is None:
+        servers = frozenset(
+            Server.objects.filter(Q(member=user_id) | Q(owner=user_id)).values_list("id", flat=True).distinct()
+        )
+        cache.set(servers_key(user_id), servers, settings.WEBCHAT_MEMBERSHIP_CACHE_TIMEOUT)
+    return servers
+
+
+def channel_server(channel_id):
+    """Returns the id of the server ``channel_id`` belongs to, 0 when there is no such channel."""
+    server_id = cache.get(channel_key(channel_id))
+    if server_id is None:
+        server_id = Channel.objects.filter(id=channel_id).values_list("server_id", flat=True).first() or 0
+        cache.set(channel_key(channel_id), server_id, settings.WEBCHAT_MEMBERSHIP_CACHE_TIMEOUT)
+    return server_id
+
+
+def is_member(user_id, server_id):
+    try:
+        return int(server_id) in member_servers(user_id)
+    except (TypeError, ValueError):
+        return False
+
+
+def can_join(user_id, server_id, channel_id):
+    """Whether the user may open a websocket on ``channel_id``, which has to be a channel of ``server_id``."""
+    try:
+        server_id, channel_id = int(server_id), int(channel_id)
+    except (TypeError, ValueError):
+        return False
+    return channel_server(channel_id) == server_id and is_member(user_id, server_id)
+
+
+# the cached sets are dropped as soon as a membership changes, so a new member can join straight away and a removed
+# one can't open new sockets; the timeout only matters for changes that send no signal, like a queryset update()
+@receiver(m2m_changed, sender=Server.member.through)
+def membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == "pre_clear" and not reverse:
+        instance._cleared_members = list(sender.objects.filter(server_id=instance.pk).values_list("account_id"))
+    elif action in ("post_add", "post_remove", "post_clear"):
+        if reverse:
+            user_ids = [instance.pk]
+        elif action == "post_clear":
+            user_ids = [user_id for (user_id,) in getattr(instance, "_cleared_members", [])]
+        else:
+            user_ids = pk_set or []
+        cache.delete_many([servers_key(user_id) for user_id in user_ids])
+
+
+@receiver(post_save, sender=Server)
+def server_saved(sender, instance, created, **kwargs):
+    cache.delete(servers_key(instance.owner_id))
+
+
+@receiver(post_save, sender=Channel)
+@receiver(post_delete, sender=Channel)
+def channel_changed(sender, instance, **kwargs):
+    cache.delete(channel_key(instance.pk))
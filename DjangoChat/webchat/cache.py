@@ -0,0 +1,63 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Conversation
+
+
+class ConversationCache:
+    """Process-wide LRU of channel_id -> Conversation id shared by every websocket consumer.
+
+    A channel's conversation never changes once it exists, so after the first lookup a consumer can attach
+    messages to it by id without touching the Conversation table again.
+    """
+
+    def __init__(self, maxsize=None):
+        self.maxsize = maxsize or getattr(settings, "WEBCHAT_CONVERSATION_CACHE_SIZE", 1024)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, channel_id):
+        with self._lock:
+            conversation_id = self._entries.get(channel_id)
+            if conversation_id is not None:
+                self._entries.move_to_end(channel_id)
+            return conversation_id
+
+    def set(self, channel_id, conversation_id):
+        with self._lock:
+            self._entries[channel_id] = conversation_id
+            self._entries.move_to_end(channel_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get_or_create(self, channel_id):
+        conversation_id = self.get(channel_id)
+        if conversation_id is None:
+            conversation, created = Conversation.objects.get_or_create(channel_id=channel_id)
+            conversation_id = conversation.id
+            self.set(channel_id, conversation_id)
+        return conversation_id
+
+    def invalidate(self, channel_id):
+        with self._lock:
+            self._entries.pop(channel_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+conversation_cache = ConversationCache()
+
+
+# a deleted conversation must not be handed out again, the next message in that channel creates a new one
+@receiver(post_delete, sender=Conversation)
+def conversation_deleted(sender, instance, **kwargs):
+    conversation_cache.invalidate(instance.channel_id)
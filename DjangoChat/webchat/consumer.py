@@ -1,52 +1,611 @@
-from asgiref.sync import async_to_sync
-from channels.generic.websocket import JsonWebsocketConsumer
-from django.contrib.auth import get_user_model
+import asyncio
+import functools
+import queue
 
-from .models import Conversation, Message
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer, JsonWebsocketConsumer
+from django.conf import settings
+from django.utils import timezone
+from DjangoChat import jsoncodec
 
-User = get_user_model()
+from . import frames
+from .activity import channel_activity
+from .auth import can_join, is_member
+from .cache import conversation_cache
+from .metrics import QueryCounter
+from .models import Message
+from .outbound import OutboundQueue
+from .persistence import message_ids, message_writer
+from .presence import presence, server_group
+from .recent import recent_messages
+from .replay import ResumeTracker, load_missed_messages, parse_since, resume_from_scope
+from .unread import messages_written, read_states
+
+
+# frames sent to the clients, with already encoded messages spliced in
+MESSAGE_FRAME = '{{"type":"chat.message","new_message":{}}}'
+BATCH_FRAME = '{{"type":"chat.batch","messages":[{}],"dropped":{}}}'
+# same for a multiplexed socket, which has to be told which channel a message is for
+CHANNEL_MESSAGE_FRAME = '{{"type":"chat.message","channel_id":{},"new_message":{}}}'
+
+
+def message_event(channel_id, message_id, sender, content, timestamp):
+    new_message = {
+        # ids take 64 bits, more than a JavaScript number holds exactly
+        "id": str(message_id),
+        "sender": sender,
+        "content": content,
+        "timestamp": timestamp.isoformat(),
+    }
+    # encoded to JSON once here by the sender, every subscriber's handler forwards it as is instead of encoding it
+    # again. The few sockets that negotiated webchat.msgpack pack it themselves, see packed_message
+    return {
+        "type": "chat.message",
+        "channel_id": channel_id,
+        "new_message": new_message,
+        "encoded": jsoncodec.dumps(new_message),
+        # the sender already recorded it in this process' recent messages
+        "origin": recent_messages.origin,
+    }
+
+
+def encoded_message(event):
+    # events from workers that predate the encoded payload only carry the dict
+    encoded = event.get("encoded")
+    return encoded if encoded is not None else jsoncodec.dumps(event["new_message"])
+
+
+@functools.lru_cache(maxsize=256)
+def pack_message(message_id, sender, content, timestamp):
+    # every local msgpack socket of the channel gets its own copy of the event, the message is packed once for all
+    return frames.pack_message(message_id, sender, content, timestamp)
+
+
+def packed_message(event):
+    message = event["new_message"]
+    return pack_message(message["id"], message["sender"], message["content"], message["timestamp"])
+
+
+def record_event(channel_id, event):
+    # messages sent from other workers only reach this process through the group, those sent from here are already
+    # recorded by publish_message or the sync consumer
+    if event.get("origin") == recent_messages.origin:
+        return
+    message = event["new_message"]
+    recent_messages.record(channel_id, int(message["id"]), message["sender"], message["content"], message["timestamp"])
+
+
+async def load_replay(channel_id, conversation_id, since):
+    """Returns the messages of a channel after message ``since`` and whether that is all of them, for async consumers."""
+    missed = await database_sync_to_async(recent_messages.since)(channel_id, since, settings.WEBCHAT_REPLAY_LIMIT)
+    if missed is None:
+        # messages this worker broadcast may still sit in the write-behind queue, store them before looking
+        await database_sync_to_async(message_writer.flush)()
+        missed = await database_sync_to_async(load_missed_messages)(conversation_id, since)
+    return missed
+
+
+async def publish_message(channel_layer, channel_id, conversation_id, user, content):
+    """Queues a message for the write-behind queue and broadcasts it to the channel's group, for async consumers.
+
+    The id and timestamp are assigned here, so clients see exactly what ends up in the database.
+    """
+    new_message = Message(
+        id=message_ids.next_id(),
+        conversation_id=conversation_id,
+        sender_id=user.id,
+        content=content,
+        timestamp=timezone.now(),
+    )
+    try:
+        message_writer.put(new_message, block=False)
+    except queue.Full:
+        # the database is behind, wait for room off the event loop so other sockets keep going
+        await sync_to_async(message_writer.put, thread_sensitive=False)(new_message)
+    recent_messages.record(channel_id, new_message.id, user.username, new_message.content, new_message.timestamp)
+    channel_activity.record(channel_id, new_message.timestamp)
+    # the sender has read everything up to their own message
+    read_states.mark(user.id, conversation_id, new_message.id)
+
+    await channel_layer.group_send(
+        channel_id,
+        message_event(channel_id, new_message.id, user.username, new_message.content, new_message.timestamp),
+    )
 
 
 class WebChatConsumer(JsonWebsocketConsumer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.channel_id = None
+        self.server_id = None
         self.user = None
+        self.sender_name = None
+        self.conversation_id = None
+        # number of queries it took to store the last message, expected to be a single INSERT
+        self.last_message_queries = 0
+        self.write_behind = settings.WEBCHAT_WRITE_BEHIND
+        self.resume = ResumeTracker()
+        self.subscribed = False
+        # MessagePack binary frames instead of JSON text frames, see frames.py
+        self.binary = False
+        # counted as online in presence.py
+        self.present = False
 
-    def connect(self):
-        self.accept()
+    @classmethod
+    def encode_json(cls, content):
+        return jsoncodec.dumps(content)
+
+    @classmethod
+    def decode_json(cls, text_data):
+        return jsoncodec.loads(text_data)
+
+    def receive(self, text_data=None, bytes_data=None, **kwargs):
+        if bytes_data is not None:
+            self.receive_json(frames.unpack(bytes_data), **kwargs)
+        else:
+            super().receive(text_data, bytes_data, **kwargs)
 
+    def send_json(self, content, close=False):
+        if self.binary:
+            self.send(bytes_data=frames.pack(content), close=close)
+        else:
+            super().send_json(content, close)
+
+    def connect(self):
         self.channel_id = self.scope["url_route"]["kwargs"]["channelId"]
 
-        self.user = User.objects.get(id=1)
+        # resolved by WebsocketAuthMiddleware, closing before accept() turns the handshake down
+        self.user = self.scope["user"]
+        if not self.user.is_authenticated:
+            self.close(code=4001)
+            return
+        self.server_id = self.scope["url_route"]["kwargs"]["serverId"]
+        if not can_join(self.user.id, self.server_id, self.channel_id):
+            self.close(code=4003)
+            return
+        self.sender_name = self.user.username
+
+        # the channel never changes for the lifetime of the socket, so resolve its conversation once here
+        self.conversation_id = conversation_cache.get_or_create(self.channel_id)
 
         async_to_sync(self.channel_layer.group_add)(self.channel_id, self.channel_name)
+        async_to_sync(self.channel_layer.group_add)(server_group(self.server_id), self.channel_name)
+        recent_messages.subscribe(self.channel_id)
+        self.subscribed = True
+
+        subprotocol = frames.negotiate(self.scope)
+        self.binary = subprotocol is not None
+        self.accept(subprotocol)
+        async_to_sync(presence.connected)(self.channel_layer, self.server_id, self.user)
+        self.present = True
+
+        # a reconnecting client passes the last message it saw and gets only what it missed, before any live message
+        since = resume_from_scope(self.scope)
+        if since is not None:
+            self.replay(since)
+
+    def replay(self, since):
+        missed = recent_messages.since(self.channel_id, since, settings.WEBCHAT_REPLAY_LIMIT)
+        if missed is None:
+            if self.write_behind:
+                message_writer.flush()
+            missed = load_missed_messages(self.conversation_id, since)
+        messages, complete = missed
+        self.send_json({"type": "chat.replay", "messages": self.resume.replay(messages), "complete": complete})
 
     def receive_json(self, content):
-        channel_id = self.channel_id
-        sender = self.user
-        message = content["message"]
+        if content.get("type") == "resume":
+            since = parse_since(content.get("since"))
+            if since is not None and not self.resume.resumed:
+                self.replay(since)
+            return
+        if content.get("type") == "typing":
+            async_to_sync(presence.typing)(self.channel_layer, self.channel_id, self.user)
+            return
+        if content.get("type") == "read":
+            message_id = parse_since(content.get("message_id"))
+            if message_id is not None:
+                read_states.mark(self.user.id, self.conversation_id, message_id)
+            return
 
-        conversation, created = Conversation.objects.get_or_create(channel_id=channel_id)
+        message = content["message"]
 
-        new_message = Message.objects.create(conversation=conversation, sender=sender, content=message)
+        if self.write_behind:
+            new_message = Message(
+                id=message_ids.next_id(),
+                conversation_id=self.conversation_id,
+                sender_id=self.user.id,
+                content=message,
+                timestamp=timezone.now(),
+            )
+            # blocks while the queue is full, which holds this socket back until the database catches up
+            message_writer.put(new_message)
+        else:
+            with QueryCounter() as queries:
+                # ids come from the same generator as on the write-behind path, so both kinds of messages sort by
+                # id in the order they were sent
+                new_message = Message.objects.create(
+                    id=message_ids.next_id(),
+                    conversation_id=self.conversation_id,
+                    sender_id=self.user.id,
+                    content=message,
+                )
+            self.last_message_queries = queries.count
+            messages_written([new_message])
+        recent_messages.record(
+            self.channel_id, new_message.id, self.sender_name, new_message.content, new_message.timestamp
+        )
+        channel_activity.record(self.channel_id, new_message.timestamp)
+        read_states.mark(self.user.id, self.conversation_id, new_message.id)
 
         async_to_sync(self.channel_layer.group_send)(
             self.channel_id,
-            {
-                "type": "chat.message",
-                "new_message": {
-                    "id": new_message.id,
-                    "sender": new_message.sender.username,
-                    "content": new_message.content,
-                    "timestamp": new_message.timestamp.isoformat(),
-                },
-            },
+            message_event(
+                self.channel_id, new_message.id, self.sender_name, new_message.content, new_message.timestamp
+            ),
         )
 
     def chat_message(self, event):
-        self.send_json(event)
+        record_event(self.channel_id, event)
+        if not self.resume.should_send(event["new_message"]["id"]):
+            return
+        if self.binary:
+            self.send(bytes_data=frames.message_frame(packed_message(event)))
+        else:
+            self.send(text_data=MESSAGE_FRAME.format(encoded_message(event)))
+
+    def chat_typing(self, event):
+        if event["user_id"] != self.user.id:
+            self.send_json({"type": "chat.typing", "user_id": event["user_id"], "user": event["user"]})
+
+    def presence_changed(self, event):
+        self.send_json({"type": "presence", "online": event["online"], "offline": event["offline"]})
 
     def disconnect(self, close_code):
+        if self.present:
+            async_to_sync(presence.disconnected)(self.channel_layer, self.server_id, self.user)
+        if self.subscribed:
+            recent_messages.unsubscribe(self.channel_id)
+            async_to_sync(self.channel_layer.group_discard)(server_group(self.server_id), self.channel_name)
         async_to_sync(self.channel_layer.group_discard)(self.channel_id, self.channel_name)
         super().disconnect(close_code)
+
+
+# async variant of WebChatConsumer, selected with WEBCHAT_CONSUMER_MODE = "async"
+# it runs on the event loop instead of pinning a threadpool thread per socket, broadcasts a message straight away
+# and hands it to the write-behind queue in persistence.py, which stores it later with bulk_create
+# with WEBCHAT_COALESCE_WINDOW set, messages are not written to the socket one by one: they go through a bounded
+# OutboundQueue and a writer task sends everything that arrived within the window as a single chat.batch frame
+class AsyncWebChatConsumer(AsyncJsonWebsocketConsumer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.channel_id = None
+        self.server_id = None
+        self.user = None
+        self.conversation_id = None
+        self.coalesce_window = settings.WEBCHAT_COALESCE_WINDOW
+        self.outbound = None
+        self.outbound_task = None
+        self.resume = ResumeTracker()
+        self.subscribed = False
+        self.binary = False
+        self.present = False
+
+    @classmethod
+    async def encode_json(cls, content):
+        return jsoncodec.dumps(content)
+
+    @classmethod
+    async def decode_json(cls, text_data):
+        return jsoncodec.loads(text_data)
+
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        if bytes_data is not None:
+            await self.receive_json(frames.unpack(bytes_data), **kwargs)
+        else:
+            await super().receive(text_data, bytes_data, **kwargs)
+
+    async def send_json(self, content, close=False):
+        if self.binary:
+            await self.send(bytes_data=frames.pack(content), close=close)
+        else:
+            await super().send_json(content, close)
+
+    async def connect(self):
+        self.channel_id = self.scope["url_route"]["kwargs"]["channelId"]
+
+        self.user = self.scope["user"]
+        if not self.user.is_authenticated:
+            await self.close(code=4001)
+            return
+        self.server_id = self.scope["url_route"]["kwargs"]["serverId"]
+        if not await database_sync_to_async(can_join)(self.user.id, self.server_id, self.channel_id):
+            await self.close(code=4003)
+            return
+
+        self.conversation_id = conversation_cache.get(self.channel_id)
+        if self.conversation_id is None:
+            self.conversation_id = await database_sync_to_async(conversation_cache.get_or_create)(self.channel_id)
+
+        await self.channel_layer.group_add(self.channel_id, self.channel_name)
+        await self.channel_layer.group_add(server_group(self.server_id), self.channel_name)
+        recent_messages.subscribe(self.channel_id)
+        self.subscribed = True
+
+        if self.coalesce_window:
+            self.outbound = OutboundQueue(settings.WEBCHAT_OUTBOUND_QUEUE_SIZE, settings.WEBCHAT_SLOW_CONSUMER_POLICY)
+            self.outbound_task = asyncio.create_task(self.send_outbound())
+
+        # only accept once the socket is in the group, so a client never misses a broadcast right after connecting
+        subprotocol = frames.negotiate(self.scope)
+        self.binary = subprotocol is not None
+        await self.accept(subprotocol)
+        await presence.connected(self.channel_layer, self.server_id, self.user)
+        self.present = True
+
+        since = resume_from_scope(self.scope)
+        if since is not None:
+            await self.replay(since)
+
+    async def replay(self, since):
+        messages, complete = await load_replay(self.channel_id, self.conversation_id, since)
+        await self.send_json({"type": "chat.replay", "messages": self.resume.replay(messages), "complete": complete})
+
+    async def receive_json(self, content):
+        if content.get("type") == "resume":
+            since = parse_since(content.get("since"))
+            if since is not None and not self.resume.resumed:
+                await self.replay(since)
+            return
+        if content.get("type") == "typing":
+            await presence.typing(self.channel_layer, self.channel_id, self.user)
+            return
+        if content.get("type") == "read":
+            message_id = parse_since(content.get("message_id"))
+            if message_id is not None:
+                read_states.mark(self.user.id, self.conversation_id, message_id)
+            return
+
+        await publish_message(self.channel_layer, self.channel_id, self.conversation_id, self.user, content["message"])
+
+    async def chat_message(self, event):
+        record_event(self.channel_id, event)
+        if not self.resume.should_send(event["new_message"]["id"]):
+            return
+        if self.outbound is None:
+            if self.binary:
+                await self.send(bytes_data=frames.message_frame(packed_message(event)))
+            else:
+                await self.send(text_data=MESSAGE_FRAME.format(encoded_message(event)))
+        elif (
+            not self.outbound.put(packed_message(event) if self.binary else encoded_message(event))
+            and not self.outbound_task.done()
+        ):
+            # the client can't keep up and the policy is to cut it off rather than drop messages
+            self.outbound_task.cancel()
+            await self.close(code=4008)
+
+    async def send_outbound(self):
+        max_batch = settings.WEBCHAT_OUTBOUND_QUEUE_SIZE
+        while True:
+            messages = await self.outbound.get_batch(self.coalesce_window, max_batch)
+            if not messages:
+                continue
+            dropped, self.outbound.dropped = self.outbound.dropped, 0
+            # the queue holds encoded messages, so a batch is put together without encoding anything again
+            # dropped tells the client it missed messages and should refetch the history to fill the gap
+            if self.binary:
+                if len(messages) == 1 and not dropped:
+                    await self.send(bytes_data=frames.message_frame(messages[0]))
+                else:
+                    await self.send(bytes_data=frames.batch_frame(messages, dropped))
+            elif len(messages) == 1 and not dropped:
+                await self.send(text_data=MESSAGE_FRAME.format(messages[0]))
+            else:
+                await self.send(text_data=BATCH_FRAME.format(",".join(messages), dropped))
+
+    async def chat_typing(self, event):
+        if event["user_id"] != self.user.id:
+            await self.send_json({"type": "chat.typing", "user_id": event["user_id"], "user": event["user"]})
+
+    async def presence_changed(self, event):
+        await self.send_json({"type": "presence", "online": event["online"], "offline": event["offline"]})
+
+    async def disconnect(self, close_code):
+        if self.outbound_task is not None:
+            self.outbound_task.cancel()
+        if self.present:
+            await presence.disconnected(self.channel_layer, self.server_id, self.user)
+        if self.subscribed:
+            recent_messages.unsubscribe(self.channel_id)
+            await self.channel_layer.group_discard(server_group(self.server_id), self.channel_name)
+        if self.channel_id is not None:
+            await self.channel_layer.group_discard(self.channel_id, self.channel_name)
+
+
+class Subscription:
+    __slots__ = ("conversation_id", "resume")
+
+    def __init__(self, conversation_id):
+        self.conversation_id = conversation_id
+        self.resume = ResumeTracker()
+
+
+# one socket per user and server instead of one per channel, connected at /<serverId>
+# the client picks the channels it follows with control frames, and every frame it gets names the channel:
+#   {"type": "subscribe", "channel_id": "12", "since": 345}  -> {"type": "subscribed", "channel_id": "12"}
+#   {"type": "unsubscribe", "channel_id": "12"}               -> {"type": "unsubscribed", "channel_id": "12"}
+#   {"type": "message", "channel_id": "12", "message": "hi"}  -> {"type": "chat.message", "channel_id": "12", ...}
+#   {"type": "typing", "channel_id": "12"}                    -> {"type": "chat.typing", "channel_id": "12", ...}
+#   {"type": "read", "channel_id": "12", "message_id": 345}   moves the read watermark of unread.py, no answer
+# since is optional and replays what was missed in that channel like a reconnect does; requests that can't be
+# served are answered with {"type": "error", "channel_id": ..., "error": ...}
+# switching channels then costs two small frames instead of a new socket, consumer and auth check, and a user
+# following several channels holds one connection; messages are sent one per frame, without coalescing
+class MultiplexWebChatConsumer(AsyncJsonWebsocketConsumer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.server_id = None
+        self.user = None
+        self.subscriptions = {}
+        self.binary = False
+        self.present = False
+
+    @classmethod
+    async def encode_json(cls, content):
+        return jsoncodec.dumps(content)
+
+    @classmethod
+    async def decode_json(cls, text_data):
+        return jsoncodec.loads(text_data)
+
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        if bytes_data is not None:
+            await self.receive_json(frames.unpack(bytes_data), **kwargs)
+        else:
+            await super().receive(text_data, bytes_data, **kwargs)
+
+    async def send_json(self, content, close=False):
+        if self.binary:
+            await self.send(bytes_data=frames.pack(content), close=close)
+        else:
+            await super().send_json(content, close)
+
+    async def connect(self):
+        self.user = self.scope["user"]
+        if not self.user.is_authenticated:
+            await self.close(code=4001)
+            return
+        server_id = self.scope["url_route"]["kwargs"]["serverId"]
+        if not server_id.isdigit():
+            await self.close(code=4003)
+            return
+        # "/007" and "/7" are the same server, and have to share one group and one presence list
+        self.server_id = str(int(server_id))
+        if not await database_sync_to_async(is_member)(self.user.id, self.server_id):
+            await self.close(code=4003)
+            return
+        await self.channel_layer.group_add(server_group(self.server_id), self.channel_name)
+        subprotocol = frames.negotiate(self.scope)
+        self.binary = subprotocol is not None
+        await self.accept(subprotocol)
+        await presence.connected(self.channel_layer, self.server_id, self.user)
+        self.present = True
+
+    async def receive_json(self, content):
+        if not isinstance(content, dict):
+            await self.send_error(None, "frames must be objects")
+            return
+        kind = content.get("type")
+        channel_id = str(content.get("channel_id", ""))
+        # channel ids are also group names, keep them in the one form the per-channel consumers use as well
+        if channel_id.isdigit():
+            channel_id = str(int(channel_id))
+        else:
+            await self.send_error(channel_id, "channel_id must be the id of a channel")
+            return
+
+        if kind == "subscribe":
+            await self.subscribe(channel_id, parse_since(content.get("since")))
+        elif kind == "unsubscribe":
+            await self.unsubscribe(channel_id)
+            await self.send_json({"type": "unsubscribed", "channel_id": channel_id})
+        elif kind == "message":
+            subscription = self.subscriptions.get(channel_id)
+            if subscription is None:
+                await self.send_error(channel_id, "subscribe to the channel before sending to it")
+                return
+            message = content.get("message")
+            if not isinstance(message, str):
+                await self.send_error(channel_id, "message must be text")
+                return
+            await publish_message(self.channel_layer, channel_id, subscription.conversation_id, self.user, message)
+        elif kind == "typing":
+            if channel_id in self.subscriptions:
+                await presence.typing(self.channel_layer, channel_id, self.user)
+        elif kind == "read":
+            subscription = self.subscriptions.get(channel_id)
+            message_id = parse_since(content.get("message_id"))
+            if subscription is None:
+                await self.send_error(channel_id, "subscribe to the channel before marking it read")
+            elif message_id is None:
+                await self.send_error(channel_id, "message_id must be the id of a message")
+            else:
+                read_states.mark(self.user.id, subscription.conversation_id, message_id)
+        else:
+            await self.send_error(channel_id, f"unknown frame type {kind!r}")
+
+    async def subscribe(self, channel_id, since):
+        if channel_id not in self.subscriptions:
+            if len(self.subscriptions) >= settings.WEBCHAT_MAX_SUBSCRIPTIONS:
+                await self.send_error(channel_id, "too many subscriptions, unsubscribe from a channel first")
+                return
+            if not await database_sync_to_async(can_join)(self.user.id, self.server_id, channel_id):
+                await self.send_error(channel_id, "not a channel of this server you are a member of")
+                return
+            conversation_id = conversation_cache.get(channel_id)
+            if conversation_id is None:
+                conversation_id = await database_sync_to_async(conversation_cache.get_or_create)(channel_id)
+            # registered before joining the group, so no broadcast to the group is ever dropped as unknown
+            self.subscriptions[channel_id] = Subscription(conversation_id)
+            await self.channel_layer.group_add(channel_id, self.channel_name)
+            recent_messages.subscribe(channel_id)
+        await self.send_json({"type": "subscribed", "channel_id": channel_id})
+
+        subscription = self.subscriptions[channel_id]
+        if since is not None and not subscription.resume.resumed:
+            messages, complete = await load_replay(channel_id, subscription.conversation_id, since)
+            await self.send_json(
+                {
+                    "type": "chat.replay",
+                    "channel_id": channel_id,
+                    "messages": subscription.resume.replay(messages),
+                    "complete": complete,
+                }
+            )
+
+    async def unsubscribe(self, channel_id):
+        if self.subscriptions.pop(channel_id, None) is not None:
+            recent_messages.unsubscribe(channel_id)
+            await self.channel_layer.group_discard(channel_id, self.channel_name)
+
+    async def send_error(self, channel_id, error):
+        await self.send_json({"type": "error", "channel_id": channel_id, "error": error})
+
+    async def chat_message(self, event):
+        channel_id = event["channel_id"]
+        subscription = self.subscriptions.get(channel_id)
+        # still in flight from before the channel was unsubscribed
+        if subscription is None:
+            return
+        record_event(channel_id, event)
+        if not subscription.resume.should_send(event["new_message"]["id"]):
+            return
+        if self.binary:
+            await self.send(bytes_data=frames.message_frame(packed_message(event), channel_id))
+        else:
+            await self.send(
+                text_data=CHANNEL_MESSAGE_FRAME.format(jsoncodec.dumps(channel_id), encoded_message(event))
+            )
+
+    async def chat_typing(self, event):
+        if event["channel_id"] in self.subscriptions and event["user_id"] != self.user.id:
+            await self.send_json(
+                {
+                    "type": "chat.typing",
+                    "channel_id": event["channel_id"],
+                    "user_id": event["user_id"],
+                    "user": event["user"],
+                }
+            )
+
+    async def presence_changed(self, event):
+        await self.send_json({"type": "presence", "online": event["online"], "offline": event["offline"]})
+
+    async def disconnect(self, close_code):
+        if self.present:
+            await presence.disconnected(self.channel_layer, self.server_id, self.user)
+            await self.channel_layer.group_discard(server_group(self.server_id), self.channel_name)
+        for channel_id in list(self.subscriptions):
+            await self.unsubscribe(channel_id)
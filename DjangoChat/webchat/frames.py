@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta, timezone
+
+import msgpack
+
+# MessagePack encoding of the chat websocket frames, used when a client asks for the webchat.msgpack subprotocol
+# frames are the same maps with the same keys as the JSON ones, sent as binary websocket frames; only the messages
+# in them are packed differently, as [id, sender, content, timestamp] arrays with the timestamp in microseconds
+# since the epoch instead of an ISO 8601 string. Ids are decimal strings like in JSON, most MessagePack decoders
+# turn a 64 bit integer into a JavaScript number and lose its low bits:
+#   {"type": "chat.message", "new_message": [id, sender, content, timestamp]}
+#   {"type": "chat.batch", "messages": [[id, sender, content, timestamp], ...], "dropped": 0}
+#   {"type": "chat.replay", "messages": [...], "complete": true}
+# frames from the client are MessagePack maps with the keys the JSON frames have, clients that don't ask for the
+# subprotocol keep speaking JSON
+SUBPROTOCOL = "webchat.msgpack"
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+_packer = msgpack.Packer()
+# the keys in front of a packed message, so a frame is put together from a message packed once per process
+MESSAGE_HEAD = _packer.pack_map_header(2) + msgpack.packb("type") + msgpack.packb("chat.message")
+NEW_MESSAGE_KEY = msgpack.packb("new_message")
+CHANNEL_MESSAGE_HEAD = (
+    _packer.pack_map_header(3) + msgpack.packb("type") + msgpack.packb("chat.message") + msgpack.packb("channel_id")
+)
+BATCH_HEAD = (
+    _packer.pack_map_header(3) + msgpack.packb("type") + msgpack.packb("chat.batch") + msgpack.packb("messages")
+)
+DROPPED_KEY = msgpack.packb("dropped")
+
+
+def negotiate(scope):
+    """Returns the subprotocol to accept a websocket with, None to speak JSON."""
+    return SUBPROTOCOL if SUBPROTOCOL in scope.get("subprotocols", ()) else None
+
+
+def timestamp_us(timestamp):
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    # integer arithmetic, the microseconds come out exact
+    return (timestamp - EPOCH) // MICROSECOND
+
+
+def message_array(message):
+    return [str(message["id"]), message["sender"], message["content"], timestamp_us(message["timestamp"])]
+
+
+def pack_message(message_id, sender, content, timestamp):
+    return msgpack.packb([str(message_id), sender, content, timestamp_us(timestamp)])
+
+
+def message_frame(packed, channel_id=None):
+    if channel_id is None:
+        return MESSAGE_HEAD + NEW_MESSAGE_KEY + packed
+    return CHANNEL_MESSAGE_HEAD + msgpack.packb(channel_id) + NEW_MESSAGE_KEY + packed
+
+
+def batch_frame(packed_messages, dropped):
+    return (
+        BATCH_HEAD
+        + _packer.pack_array_header(len(packed_messages))
+        + b"".join(packed_messages)
+        + DROPPED_KEY
+        + msgpack.packb(dropped)
+    )
+
+
+def pack(content):
+    """Encodes any other frame, messages given as dicts are packed as arrays like in the message frames."""
+    if isinstance(content.get("new_message"), dict):
+        content = {**content, "new_message": message_array(content["new_message"])}
+    if content.get("messages") and isinstance(content["messages"][0], dict):
+        content = {**content, "messages": [message_array(message) for message in content["messages"]]}
+    return msgpack.packb(content)
+
+
+def unpack(data):
+    return msgpack.unpackb(data)
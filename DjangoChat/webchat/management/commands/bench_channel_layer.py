@@ -0,0 +1,127 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from DjangoChat.benchmarks import start_fake_redis
+
+GROUP = "bench"
+
+
+def _setup(redis_url):
+    # runs in a freshly spawned process, so settings have to be loaded with the shared Redis configured
+    import django
+
+    os.environ["REDIS_URL"] = redis_url
+    django.setup()
+
+
+def _subscriber(redis_url, subscribers, messages, ready, results):
+    _setup(redis_url)
+    from channels.layers import get_channel_layer
+
+    async def run():
+        layer = get_channel_layer()
+        channels = [await layer.new_channel() for _ in range(subscribers)]
+        for channel in channels:
+            await layer.group_add(GROUP, channel)
+        ready.set()
+
+        async def drain(channel):
+            for _ in range(messages):
+                await layer.receive(channel)
+
+        await asyncio.gather(*(drain(channel) for channel in channels))
+        results.put(("done", time.time()))
+
+    asyncio.run(run())
+
+
+def _publisher(redis_url, messages, results):
+    _setup(redis_url)
+    from channels.layers import get_channel_layer
+    from django.utils import timezone
+
+    from webchat.consumer import message_event
+
+    async def run():
+        layer = get_channel_layer()
+        results.put(("start", time.time()))
+        for i in range(messages):
+            await layer.group_send(GROUP, message_event(GROUP, i, "benchmark", f"message {i}", timezone.now()))
+
+    asyncio.run(run())
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures group_send fan-out through the configured Redis channel layer with subscribers spread over 1..N "
+        "worker processes. Starts a fakeredis stand-in unless REDIS_URL or --redis-url is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", nargs="+", type=int, default=[1, 2, 4])
+        parser.add_argument("--subscribers", type=int, default=1000, help="Sockets in the group across all workers")
+        parser.add_argument("--messages", type=int, default=100, help="Messages sent to the group")
+        parser.add_argument("--redis-url", default=os.environ.get("REDIS_URL"))
+        parser.add_argument("--timeout", type=float, default=120)
+
+    def handle(self, *args, **options):
+        redis_url = options["redis_url"]
+        server = None
+        if not redis_url:
+            try:
+                server, redis_url = start_fake_redis()
+            except ImportError as e:
+                raise CommandError(str(e))
+            self.stdout.write(f"using fakeredis on {redis_url}")
+
+        self.stdout.write(f"{'workers':>8} {'deliveries':>11} {'seconds':>9} {'deliveries/s':>13}")
+        try:
+            for workers in options["workers"]:
+                deliveries, elapsed = self.run_once(redis_url, workers, options)
+                self.stdout.write(f"{workers:>8} {deliveries:>11} {elapsed:>9.2f} {deliveries / elapsed:>13.0f}")
+        finally:
+            if server is not None:
+                server.shutdown()
+
+    def run_once(self, redis_url, workers, options):
+        context = multiprocessing.get_context("spawn")
+        results = context.Queue()
+        per_worker = max(1, options["subscribers"] // workers)
+        messages = options["messages"]
+
+        processes = []
+        for _ in range(workers):
+            ready = context.Event()
+            process = context.Process(target=_subscriber, args=(redis_url, per_worker, messages, ready, results))
+            process.start()
+            processes.append((process, ready))
+        try:
+            for process, ready in processes:
+                if not ready.wait(options["timeout"]):
+                    raise CommandError("subscriber process did not start in time")
+            # give the pub/sub subscriptions a moment to be active on the broker
+            time.sleep(0.5)
+
+            publisher = context.Process(target=_publisher, args=(redis_url, messages, results))
+            publisher.start()
+            started, finished = None, []
+            while started is None or len(finished) < workers:
+                try:
+                    kind, at = results.get(timeout=options["timeout"])
+                except queue.Empty:
+                    raise CommandError("timed out waiting for the subscribers, messages were lost")
+                if kind == "start":
+                    started = at
+                else:
+                    finished.append(at)
+            publisher.join()
+        finally:
+            for process, ready in processes:
+                process.join(1)
+                if process.is_alive():
+                    process.terminate()
+        return per_worker * workers * messages, max(finished) - started
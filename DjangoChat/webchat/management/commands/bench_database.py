@@ -0,0 +1,108 @@
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from django.test.utils import override_settings
+from DjangoChat.benchmarks import benchmark_database, run_concurrently
+
+from webchat.models import Conversation, Message
+
+User = get_user_model()
+
+# what SQLite does when nothing is configured: rollback journal and a full sync on every commit
+SQLITE_DEFAULT_PRAGMAS = {"journal_mode": "DELETE", "synchronous": "FULL", "busy_timeout": 5000}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures concurrent message inserts, one transaction per message like the sync consumer, under the "
+        "database configurations available for the configured engine: SQLite with its defaults and with "
+        "settings.SQLITE_PRAGMAS, or PostgreSQL, each with and without persistent connections"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=2000, help="Messages inserted per configuration")
+        parser.add_argument("--senders", type=int, default=8, help="Threads inserting messages concurrently")
+        parser.add_argument(
+            "--readers", type=int, default=2, help="Threads reading the newest page of messages meanwhile"
+        )
+        parser.add_argument(
+            "--conn-max-age", type=int, default=60, help="CONN_MAX_AGE used for the persistent connection runs"
+        )
+
+    def handle(self, *args, **options):
+        max_age = options["conn_max_age"]
+        if connection.vendor == "sqlite":
+            configurations = [
+                ("sqlite defaults", SQLITE_DEFAULT_PRAGMAS, 0),
+                ("sqlite tuned", settings.SQLITE_PRAGMAS, 0),
+                ("sqlite tuned, persistent", settings.SQLITE_PRAGMAS, max_age),
+            ]
+        else:
+            configurations = [
+                (connection.vendor, None, 0),
+                (f"{connection.vendor}, persistent", None, max_age),
+            ]
+
+        self.stdout.write(f"{options['messages']} messages from {options['senders']} senders")
+        self.stdout.write(f"{'configuration':>26} {'seconds':>9} {'msg/s':>10} {'reads/s':>10} {'errors':>7}")
+        old_max_age = connection.settings_dict["CONN_MAX_AGE"]
+        try:
+            for name, pragmas, conn_max_age in configurations:
+                # every thread builds its connection from this same settings dict
+                connection.settings_dict["CONN_MAX_AGE"] = conn_max_age
+                with override_settings(SQLITE_PRAGMAS=pragmas or {}):
+                    connection.close()
+                    with benchmark_database(on_disk=True):
+                        self.run(name, options)
+        finally:
+            connection.settings_dict["CONN_MAX_AGE"] = old_max_age
+
+    def run(self, name, options):
+        user = User.objects.create(username="benchmark")
+        conversation = Conversation.objects.create(channel_id="benchmark")
+        done = threading.Event()
+        reads = []
+        errors = []
+
+        def send(count):
+            for i in range(count):
+                # what database_sync_to_async does around every websocket message
+                close_old_connections()
+                try:
+                    Message.objects.create(conversation=conversation, sender=user, content=f"message {i}")
+                except Exception as e:
+                    errors.append(e)
+                close_old_connections()
+
+        def read():
+            count = 0
+            try:
+                while not done.is_set():
+                    close_old_connections()
+                    list(Message.objects.filter(conversation=conversation).order_by("-timestamp", "-id")[:50])
+                    close_old_connections()
+                    count += 1
+            finally:
+                connection.close()
+                reads.append(count)
+
+        readers = [threading.Thread(target=read) for _ in range(options["readers"])]
+        for reader in readers:
+            reader.start()
+        start = time.perf_counter()
+        seconds = run_concurrently(send, options["messages"], options["senders"])
+        done.set()
+        for reader in readers:
+            reader.join()
+        elapsed = time.perf_counter() - start
+
+        written = options["messages"] - len(errors)
+        self.stdout.write(
+            f"{name:>26} {seconds:>9.2f} {written / seconds:>10.0f} {sum(reads) / elapsed:>10.0f} {len(errors):>7}"
+        )
+        if errors:
+            self.stderr.write(f"  first error: {errors[0]}")
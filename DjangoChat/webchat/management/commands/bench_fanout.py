@@ -0,0 +1,74 @@
+import asyncio
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from DjangoChat import jsoncodec
+
+from webchat.consumer import AsyncWebChatConsumer, message_event
+from webchat.replay import ResumeTracker
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the CPU time one worker spends delivering a broadcast to all of its subscribed sockets, with the "
+        "message encoded once by the sender against once per subscriber"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--subscribers", nargs="+", type=int, default=[1000, 10000])
+        parser.add_argument("--messages", type=int, default=20, help="Broadcasts timed per run")
+        parser.add_argument("--content-length", type=int, default=200)
+
+    def handle(self, *args, **options):
+        codecs = [("json", None)]
+        if jsoncodec.orjson is not None:
+            codecs.append(("orjson", jsoncodec.orjson))
+        self.stdout.write(
+            f"{'codec':>7} {'subscribers':>12} {'encode per subscriber ms':>25} {'encoded once ms':>16} {'speedup':>8}"
+        )
+        try:
+            for name, module in codecs:
+                jsoncodec.orjson = module
+                for count in options["subscribers"]:
+                    per_subscriber, once = asyncio.run(self.run(count, options))
+                    self.stdout.write(
+                        f"{name:>7} {count:>12} {per_subscriber:>25.2f} {once:>16.2f} {per_subscriber / once:>7.1f}x"
+                    )
+        finally:
+            jsoncodec.orjson = codecs[-1][1]
+
+    async def run(self, count, options):
+        sent = []
+
+        async def base_send(message):
+            sent.append(message["text"])
+
+        # sockets as the channel layer hands them a group message, everything up to the websocket write is real
+        consumers = []
+        for _ in range(count):
+            consumer = AsyncWebChatConsumer()
+            consumer.channel_id = "benchmark"
+            consumer.resume = ResumeTracker()
+            consumer.base_send = base_send
+            consumers.append(consumer)
+
+        content = ("lorem ipsum dolor sit amet " * (options["content_length"] // 27 + 1))[: options["content_length"]]
+
+        async def broadcast(i, encode_once):
+            event = message_event("benchmark", i, "benchmark", content, timezone.now())
+            if not encode_once:
+                # what every handler did before: encode the message for its own socket
+                del event["encoded"]
+            start = time.perf_counter()
+            for consumer in consumers:
+                await consumer.chat_message(event)
+            return (time.perf_counter() - start) * 1000
+
+        timings = {False: [], True: []}
+        for i in range(options["messages"]):
+            for encode_once in timings:
+                timings[encode_once].append(await broadcast(i, encode_once))
+                sent.clear()
+        return statistics.median(timings[False]), statistics.median(timings[True])
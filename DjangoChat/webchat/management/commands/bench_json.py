@@ -0,0 +1,106 @@
+import json
+import random
+import timeit
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from DjangoChat import jsoncodec
+from rest_framework.renderers import JSONRenderer
+
+from webchat.consumer import message_event
+
+WORDS = "hey did anyone see the new release it fixes the reconnect bug finally 🎉 ça marche très bien".split()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares encoding and decoding of typical websocket frames and REST responses with the json module "
+        "against DjangoChat.jsoncodec, which uses orjson when it is installed"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--number", type=int, default=2000, help="Encodes/decodes timed per payload")
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        start = timezone.now()
+
+        def message(i):
+            content = " ".join(rng.choices(WORDS, k=rng.randint(3, 30)))
+            return message_event("1", 1_000_000 + i, f"user{i % 50}", content, start + timedelta(seconds=i))
+
+        def server(i):
+            return {
+                "id": i,
+                "channel_server": [
+                    {"id": i * 3 + j, "name": f"channel {j}", "topic": "general chat", "owner": 1, "server": i}
+                    for j in range(3)
+                ],
+                "category": "gaming",
+                "derivatives": {"icon": [], "banner": []},
+                "name": f"server {i}",
+                "description": " ".join(rng.choices(WORDS, k=12)),
+                "banner": None,
+                "icon": f"/media/server/{i}/server_icons/icon.png",
+                "owner": 1,
+            }
+
+        websocket = {
+            "chat.message": message(0),
+            "chat.batch, 50 messages": {
+                "type": "chat.batch",
+                "messages": [message(i)["new_message"] for i in range(50)],
+                "dropped": 0,
+            },
+            "chat.replay, 200 messages": {
+                "type": "chat.replay",
+                "messages": [message(i)["new_message"] for i in range(200)],
+                "complete": True,
+            },
+        }
+        rest = {
+            "message page, 50 messages": {
+                "before": "MTY5MTAwMDAwMDAwMDoxMjM0NQ==",
+                "after": None,
+                "results": [message(i)["new_message"] for i in range(50)],
+            },
+            "server list, 100 servers": [server(i) for i in range(100)],
+        }
+
+        codec = f"orjson {jsoncodec.orjson.__version__}" if jsoncodec.orjson else "json module (orjson not installed)"
+        self.stdout.write(f"jsoncodec is using {codec}, {options['number']} runs per payload, microseconds per run")
+        self.stdout.write(
+            f"{'payload':>27} {'bytes':>7} {'json enc':>9} {'fast enc':>9} {'json dec':>9} {'fast dec':>9}"
+        )
+        # the consumers used to go through json.dumps/json.loads, DRF through JSONRenderer and JSONParser
+        for name, payload in websocket.items():
+            text = json.dumps(payload)
+            self.report(
+                name,
+                len(text.encode()),
+                lambda: json.dumps(payload),
+                lambda: jsoncodec.dumps(payload),
+                lambda: json.loads(text),
+                lambda: jsoncodec.loads(text),
+                options["number"],
+            )
+        renderer, fast_renderer = JSONRenderer(), jsoncodec.FastJSONRenderer()
+        for name, payload in rest.items():
+            data = renderer.render(payload)
+            self.report(
+                name,
+                len(data),
+                lambda: renderer.render(payload),
+                lambda: fast_renderer.render(payload),
+                lambda: json.loads(data.decode()),
+                lambda: jsoncodec.loads(data),
+                options["number"],
+            )
+
+    def report(self, name, size, encode, fast_encode, decode, fast_decode, number):
+        timings = [
+            timeit.timeit(func, number=number) / number * 1e6 for func in (encode, fast_encode, decode, fast_decode)
+        ]
+        self.stdout.write(f"{name:>27} {size:>7} " + " ".join(f"{timing:>9.1f}" for timing in timings))
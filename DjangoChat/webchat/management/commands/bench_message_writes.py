@@ -0,0 +1,71 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from DjangoChat.benchmarks import benchmark_database, run_concurrently
+
+from webchat.models import Conversation, Message
+from webchat.persistence import MessageIdGenerator, MessageWriteBehindQueue
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares chat message write throughput of one INSERT transaction per message against the batched "
+        "write-behind queue, with several sender threads writing to an on-disk test database at once"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=5000, help="Messages written per run")
+        parser.add_argument("--senders", type=int, default=8, help="Threads sending messages concurrently")
+        parser.add_argument("--batch-sizes", nargs="+", type=int, default=[10, 100, 500])
+        parser.add_argument(
+            "--queue-size", type=int, default=1000, help="Write-behind queue bound, senders wait when it is full"
+        )
+
+    def handle(self, *args, **options):
+        with benchmark_database(on_disk=True):
+            user = User.objects.create(username="benchmark")
+            conversation = Conversation.objects.create(channel_id="benchmark")
+            messages, senders = options["messages"], options["senders"]
+            ids = MessageIdGenerator(worker_id=0)
+
+            def per_message(count):
+                for i in range(count):
+                    Message.objects.create(conversation=conversation, sender=user, content=f"message {i}")
+
+            self.stdout.write(f"{messages} messages from {senders} senders\n")
+            self.stdout.write(f"{'mode':>18} {'seconds':>9} {'msg/s':>10} {'waits':>7}")
+            self.report("per message", messages, run_concurrently(per_message, messages, senders), 0)
+
+            for batch_size in options["batch_sizes"]:
+                writer = MessageWriteBehindQueue(batch_size=batch_size, maxsize=options["queue_size"])
+                waits = []
+
+                def batched(count):
+                    waited = 0
+                    for i in range(count):
+                        message = Message(
+                            id=ids.next_id(),
+                            conversation=conversation,
+                            sender=user,
+                            content=f"message {i}",
+                            timestamp=timezone.now(),
+                        )
+                        if writer.pending() >= writer.maxsize:
+                            waited += 1
+                        writer.put(message)
+                    waits.append(waited)
+
+                # the run only counts as done once everything sent is in the database
+                seconds = run_concurrently(batched, messages, senders, writer.flush)
+                writer.stop()
+                self.report(f"batches of {batch_size}", messages, seconds, sum(waits))
+
+            written = Message.objects.count()
+            expected = messages * (1 + len(options["batch_sizes"]))
+            if written != expected:
+                self.stderr.write(f"expected {expected} stored messages, found {written}")
+
+    def report(self, mode, messages, seconds, waits):
+        self.stdout.write(f"{mode:>18} {seconds:>9.2f} {messages / seconds:>10.0f} {waits:>7}")
@@ -0,0 +1,97 @@
+import json
+import random
+import timeit
+from datetime import datetime, timedelta, timezone
+
+import msgpack
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone as django_timezone
+from DjangoChat import jsoncodec
+
+from webchat import frames
+from webchat.consumer import BATCH_FRAME, MESSAGE_FRAME
+
+WORDS = "hey did anyone see the new release it fixes the reconnect bug finally 🎉 ça marche très bien".split()
+
+
+def message_dict(message_id, sender, content, timestamp):
+    return {"id": message_id, "sender": sender, "content": content, "timestamp": timestamp.isoformat()}
+
+
+def unpacked_dict(array):
+    message_id, sender, content, timestamp = array
+    return message_dict(message_id, sender, content, frames.EPOCH + timedelta(microseconds=timestamp))
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the webchat.msgpack websocket subprotocol with the default JSON frames: bytes on the wire, "
+        "encoding on the server the way the consumers do it and decoding on the client. Every payload is decoded "
+        "from both encodings and checked to carry the same messages."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--number", type=int, default=2000, help="Encodes/decodes timed per payload")
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        start = django_timezone.now()
+        messages = [
+            (
+                502111941442969600 + i,
+                f"user{i % 50}",
+                " ".join(rng.choices(WORDS, k=rng.randint(3, 30))),
+                start + timedelta(seconds=i, microseconds=rng.randint(0, 999999)),
+            )
+            for i in range(200)
+        ]
+        # replays are put together from the recent messages buffer or the database, as dicts
+        replay = [message_dict(*message) for message in messages]
+
+        # live messages are encoded by their sender and spliced into each subscriber's frame, see message_event
+        payloads = {
+            "chat.message": (
+                lambda: MESSAGE_FRAME.format(jsoncodec.dumps(message_dict(*messages[0]))),
+                lambda: frames.message_frame(frames.pack_message(*messages[0])),
+            ),
+            "chat.batch, 50 messages": (
+                lambda: BATCH_FRAME.format(",".join(jsoncodec.dumps(message_dict(*m)) for m in messages[:50]), 0),
+                lambda: frames.batch_frame([frames.pack_message(*m) for m in messages[:50]], 0),
+            ),
+            "chat.replay, 200 messages": (
+                lambda: jsoncodec.dumps({"type": "chat.replay", "messages": replay, "complete": True}),
+                lambda: frames.pack({"type": "chat.replay", "messages": replay, "complete": True}),
+            ),
+        }
+
+        number = options["number"]
+        self.stdout.write(f"{number} runs per payload, microseconds per run")
+        self.stdout.write(
+            f"{'payload':>27} {'json B':>7} {'msgpack B':>10} {'json enc':>9} {'mp enc':>7} {'json dec':>9} "
+            f"{'mp dec':>7}"
+        )
+        for name, (json_encode, msgpack_encode) in payloads.items():
+            text, packed = json_encode(), msgpack_encode()
+            self.check_round_trip(name, json.loads(text), msgpack.unpackb(packed))
+            timings = [
+                timeit.timeit(func, number=number) / number * 1e6
+                for func in (json_encode, msgpack_encode, lambda: json.loads(text), lambda: msgpack.unpackb(packed))
+            ]
+            self.stdout.write(
+                f"{name:>27} {len(text.encode()):>7} {len(packed):>10} {timings[0]:>9.1f} {timings[1]:>7.1f} "
+                f"{timings[2]:>9.1f} {timings[3]:>7.1f}"
+            )
+
+    def check_round_trip(self, name, from_json, from_msgpack):
+        if "new_message" in from_msgpack:
+            from_msgpack["new_message"] = unpacked_dict(from_msgpack["new_message"])
+        if "messages" in from_msgpack:
+            from_msgpack["messages"] = [unpacked_dict(message) for message in from_msgpack["messages"]]
+        # the same instants, whatever offset the JSON timestamps were written with
+        for frame in (from_json, from_msgpack):
+            for message in frame.get("messages") or [frame["new_message"]]:
+                moment = datetime.fromisoformat(message["timestamp"]).astimezone(timezone.utc)
+                message["timestamp"] = moment.isoformat()
+        if from_json != from_msgpack:
+            raise CommandError(f"{name} doesn't decode to the same frame from JSON and MessagePack")
@@ -0,0 +1,138 @@
+import asyncio
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from DjangoChat.benchmarks import WebsocketClient, benchmark_database, percentile
+
+from server.models import Category, Channel, Server
+
+from webchat.auth import issue_token
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares a socket per channel with one multiplexed socket per server: the latency of switching channel, "
+        "reconnecting against unsubscribe/subscribe frames, and the memory of users following several channels at "
+        "once. WEBCHAT_CONSUMER_MODE picks the per-channel consumer."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--channels", type=int, default=10)
+        parser.add_argument("--hops", type=int, default=20, help="Channel switches per user")
+        parser.add_argument("--follow", type=int, default=5, help="Channels every user follows for the memory test")
+
+    def handle(self, *args, **options):
+        from DjangoChat.asgi import application
+
+        if options["follow"] > min(options["channels"], settings.WEBCHAT_MAX_SUBSCRIPTIONS):
+            raise CommandError("--follow can't be more than --channels or WEBCHAT_MAX_SUBSCRIPTIONS")
+
+        with benchmark_database(on_disk=True):
+            user = User.objects.create(username="benchmark")
+            category = Category.objects.create(name="benchmark")
+            server = Server.objects.create(name="benchmark", owner=user, category=category)
+            server.member.add(user)
+            channel_ids = [
+                str(Channel.objects.create(name=f"channel {i}", topic="benchmark", owner=user, server=server).id)
+                for i in range(options["channels"])
+            ]
+            query_string = f"token={issue_token(user)}".encode()
+            report = asyncio.run(self.run(application, server.id, channel_ids, query_string, options))
+
+        self.stdout.write(f"consumer mode       {settings.WEBCHAT_CONSUMER_MODE}")
+        self.stdout.write(
+            f"{'':>14} {'hop p50 ms':>11} {'hop p99 ms':>11} {'hops/s':>8} {'sockets':>8} {'KiB/user':>9}"
+        )
+        for name in ("per channel", "multiplexed"):
+            result = report[name]
+            self.stdout.write(
+                f"{name:>14} {result['p50']:>11.2f} {result['p99']:>11.2f} {result['rate']:>8.0f} "
+                f"{result['sockets']:>8} {result['memory'] / 1024:>9.1f}"
+            )
+
+    async def run(self, application, server_id, channel_ids, query_string, options):
+        users, hops, follow = options["users"], options["hops"], options["follow"]
+
+        async def open_socket(path):
+            client = WebsocketClient(application, path, query_string)
+            if not await client.connect():
+                raise CommandError(f"connection to {path} was rejected")
+            return client
+
+        async def subscribe(client, channel_id):
+            await client.send_json({"type": "subscribe", "channel_id": channel_id})
+            reply = await client.receive_json()
+            if reply != {"type": "subscribed", "channel_id": channel_id}:
+                raise CommandError(f"unexpected reply to subscribe: {reply}")
+
+        async def unsubscribe(client, channel_id):
+            await client.send_json({"type": "unsubscribe", "channel_id": channel_id})
+            await client.receive_json()
+
+        # what the frontend did before: close the socket of the old channel and open one on the new channel
+        async def hop_per_channel(index, latencies):
+            client = await open_socket(f"/{server_id}/{channel_ids[index % len(channel_ids)]}")
+            for hop in range(1, hops + 1):
+                start = time.perf_counter()
+                await client.disconnect()
+                client = await open_socket(f"/{server_id}/{channel_ids[(index + hop) % len(channel_ids)]}")
+                latencies.append(time.perf_counter() - start)
+            await client.disconnect()
+
+        async def hop_multiplexed(index, latencies):
+            client = await open_socket(f"/{server_id}")
+            current = channel_ids[index % len(channel_ids)]
+            await subscribe(client, current)
+            for hop in range(1, hops + 1):
+                start = time.perf_counter()
+                await unsubscribe(client, current)
+                current = channel_ids[(index + hop) % len(channel_ids)]
+                await subscribe(client, current)
+                latencies.append(time.perf_counter() - start)
+            await client.disconnect()
+
+        async def follow_per_channel(index):
+            return [
+                await open_socket(f"/{server_id}/{channel_ids[(index + i) % len(channel_ids)]}") for i in range(follow)
+            ]
+
+        async def follow_multiplexed(index):
+            client = await open_socket(f"/{server_id}")
+            for i in range(follow):
+                await subscribe(client, channel_ids[(index + i) % len(channel_ids)])
+            return [client]
+
+        report = {}
+        for name, hop, follow_channels in (
+            ("per channel", hop_per_channel, follow_per_channel),
+            ("multiplexed", hop_multiplexed, follow_multiplexed),
+        ):
+            latencies = []
+            started = time.perf_counter()
+            await asyncio.gather(*(hop(i, latencies) for i in range(users)))
+            elapsed = time.perf_counter() - started
+
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            sockets = [
+                client for clients in await asyncio.gather(*map(follow_channels, range(users))) for client in clients
+            ]
+            after = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            await asyncio.gather(*(client.disconnect() for client in sockets))
+
+            latencies_ms = [latency * 1000 for latency in latencies]
+            report[name] = {
+                "p50": percentile(latencies_ms, 50),
+                "p99": percentile(latencies_ms, 99),
+                "rate": len(latencies) / elapsed,
+                "sockets": len(sockets),
+                "memory": (after - before) / users,
+            }
+        return report
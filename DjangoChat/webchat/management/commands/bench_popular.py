@@ -0,0 +1,102 @@
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from django.utils import timezone
+from DjangoChat.benchmarks import benchmark_database, measure
+
+from server.models import Category, Channel, Server
+
+from webchat.activity import ActivityTracker, popular_channels, popular_servers, rebuild_activity
+from webchat.models import Conversation, Message
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares ranking the most active channels with a GROUP BY over the last day of messages against reading "
+        "the checkpointed activity scores, and times a checkpoint of one interval's worth of messages"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--servers", type=int, default=100)
+        parser.add_argument("--channels", type=int, default=10, help="Channels per server")
+        parser.add_argument("--messages", type=int, default=200000, help="Messages spread over the last week")
+        parser.add_argument("--limit", type=int, default=10)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        limit = options["limit"]
+
+        with benchmark_database():
+            user = User.objects.create(username="benchmark")
+            category = Category.objects.create(name="benchmark")
+            servers = Server.objects.bulk_create(
+                Server(name=f"server {i}", owner=user, category=category) for i in range(options["servers"])
+            )
+            channels = Channel.objects.bulk_create(
+                Channel(name=f"channel {i}", topic="benchmark", owner=user, server=server)
+                for server in servers
+                for i in range(options["channels"])
+            )
+            conversations = Conversation.objects.bulk_create(
+                Conversation(channel_id=str(channel.id)) for channel in channels
+            )
+            now = timezone.now()
+            start = time.perf_counter()
+            # a few busy channels and a long tail of quiet ones
+            weights = [rng.paretovariate(1.2) for _ in conversations]
+            for offset in range(0, options["messages"], 5000):
+                Message.objects.bulk_create(
+                    Message(
+                        conversation=conversation,
+                        sender=user,
+                        content="benchmark",
+                        timestamp=now - timedelta(seconds=rng.uniform(0, 7 * 86400)),
+                    )
+                    for conversation in rng.choices(conversations, weights, k=min(5000, options["messages"] - offset))
+                )
+            self.stdout.write(
+                f"created {len(channels)} channels and {options['messages']} messages "
+                f"in {time.perf_counter() - start:.1f}s"
+            )
+
+            def group_by():
+                # what the drawer would need without the scores: count every message of the last day
+                return list(
+                    Message.objects.filter(timestamp__gte=timezone.now() - timedelta(days=1))
+                    .values("conversation__channel_id")
+                    .annotate(total=Count("id"))
+                    .order_by("-total")[:limit]
+                )
+
+            start = time.perf_counter()
+            rebuild_activity(now - timedelta(days=7))
+            self.stdout.write(f"rebuild_activity took {time.perf_counter() - start:.2f}s")
+
+            self.stdout.write(f"{'ranking':>28} {'queries':>8} {'ms':>8}")
+            for name, func in (
+                ("GROUP BY over the last day", group_by),
+                ("top channels from scores", lambda: popular_channels(limit)),
+                ("top servers from scores", lambda: popular_servers(limit)),
+            ):
+                queries, ms = measure(func, options["repeat"])
+                self.stdout.write(f"{name:>28} {queries:>8} {ms:>8.2f}")
+
+            # one checkpoint interval of traffic, only the channels that had messages are written
+            tracker = ActivityTracker()
+            tracker.start = lambda: None
+            for channel in rng.choices(channels, weights, k=1000):
+                tracker.record(str(channel.id))
+            touched = tracker.pending()
+            start = time.perf_counter()
+            tracker.checkpoint()
+            self.stdout.write(
+                f"checkpoint of 1000 messages to {touched} channels took {(time.perf_counter() - start) * 1000:.2f}ms"
+            )
@@ -0,0 +1,106 @@
+import random
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from DjangoChat.benchmarks import benchmark_database, measure
+
+from server.models import Category, Channel, Server
+from webchat.models import Conversation, Message, ReadState
+from webchat.persistence import message_ids
+from webchat.unread import unread_counts
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares the unread badges of a user's servers counted one channel at a time with unread_counts, which "
+        "skips read channels using the cached latest message ids and caps the counts. Both are checked to agree. "
+        "Without REDIS_URL the cache is a LocMemCache that keeps 300 keys, keep servers times channels below that."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--servers", type=int, default=10)
+        parser.add_argument("--channels", type=int, default=20, help="Channels per server")
+        parser.add_argument("--messages", type=int, default=200000)
+        parser.add_argument("--read", type=float, default=0.8, help="Share of channels the user has read up to date")
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        cap = settings.WEBCHAT_UNREAD_CAP
+
+        with benchmark_database():
+            user = User.objects.create(username="benchmark")
+            category = Category.objects.create(name="benchmark")
+            servers = Server.objects.bulk_create(
+                Server(name=f"server {i}", owner=user, category=category) for i in range(options["servers"])
+            )
+            for server in servers:
+                server.member.add(user)
+            channels = Channel.objects.bulk_create(
+                Channel(name=f"channel {i}", topic="benchmark", owner=user, server=server)
+                for server in servers
+                for i in range(options["channels"])
+            )
+            conversations = Conversation.objects.bulk_create(
+                Conversation(channel_id=str(channel.id)) for channel in channels
+            )
+            start = time.perf_counter()
+            weights = [rng.paretovariate(1.2) for _ in conversations]
+            for offset in range(0, options["messages"], 5000):
+                Message.objects.bulk_create(
+                    Message(id=message_ids.next_id(), conversation=conversation, sender=user, content="benchmark")
+                    for conversation in rng.choices(conversations, weights, k=min(5000, options["messages"] - offset))
+                )
+            # most channels read to their last message, the rest left somewhere in their history
+            read_states = []
+            for conversation in conversations:
+                ids = list(
+                    Message.objects.filter(conversation=conversation).order_by("id").values_list("id", flat=True)
+                )
+                if ids:
+                    last_read = ids[-1] if rng.random() < options["read"] else rng.choice(ids)
+                    read_states.append(ReadState(user=user, conversation=conversation, last_read_id=last_read))
+            ReadState.objects.bulk_create(read_states)
+            self.stdout.write(
+                f"created {len(channels)} channels and {options['messages']} messages "
+                f"in {time.perf_counter() - start:.1f}s"
+            )
+
+            def per_channel():
+                # what the sidebar would take without the latest ids: an uncapped COUNT for every channel
+                watermarks = dict(ReadState.objects.filter(user=user).values_list("conversation_id", "last_read_id"))
+                counts = {}
+                for channel in Channel.objects.filter(server__member=user).values_list("id", flat=True):
+                    conversation = Conversation.objects.filter(channel_id=str(channel)).first()
+                    if conversation is None:
+                        continue
+                    unread = Message.objects.filter(
+                        conversation=conversation, id__gt=watermarks.get(conversation.id, 0)
+                    ).count()
+                    if unread:
+                        counts[channel] = unread
+                return counts
+
+            def cold():
+                cache.clear()
+                return unread_counts(user.id, [server.id for server in servers])
+
+            expected = {channel: min(unread, cap) for channel, unread in per_channel().items()}
+            if {badge["channel_id"]: badge["unread"] for badge in cold()} != expected:
+                raise CommandError("unread_counts doesn't agree with counting every channel")
+
+            self.stdout.write(f"{len(expected)} channels with unread messages")
+            self.stdout.write(f"{'badges':>32} {'queries':>8} {'ms':>8}")
+            for name, func in (
+                ("COUNT per channel", per_channel),
+                ("unread_counts, cold cache", cold),
+                ("unread_counts", lambda: unread_counts(user.id, [server.id for server in servers])),
+            ):
+                queries, ms = measure(func, options["repeat"])
+                self.stdout.write(f"{name:>32} {queries:>8} {ms:>8.2f}")
@@ -0,0 +1,162 @@
+import asyncio
+import time
+import tracemalloc
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from DjangoChat.benchmarks import WebsocketClient, benchmark_database, percentile
+
+from server.models import Category, Channel, Server
+
+from webchat.auth import issue_token
+from webchat.models import Message
+from webchat.persistence import message_writer
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Load tests the websocket path of the ASGI application in-process: opens --clients sockets spread over "
+        "--channels channels, sends --rate messages/s for --duration seconds and reports throughput, fan-out "
+        "latency, database write rate and memory per connection. WEBCHAT_CONSUMER_MODE picks the consumer and "
+        "WEBCHAT_COALESCE_WINDOW_MS enables frame coalescing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--clients", type=int, default=200)
+        parser.add_argument("--channels", type=int, default=1)
+        parser.add_argument("--senders", type=int, default=10, help="Clients that send messages")
+        parser.add_argument("--rate", type=float, default=200, help="Messages per second across all senders")
+        parser.add_argument("--duration", type=float, default=5)
+        parser.add_argument("--drain", type=float, default=5, help="Seconds to wait for late frames after sending")
+        parser.add_argument("--max-p99", type=float, help="Fail if the p99 fan-out latency in ms is above this")
+        parser.add_argument("--min-throughput", type=float, help="Fail if fewer messages/s than this were sent")
+
+    def handle(self, *args, **options):
+        from DjangoChat.asgi import application
+
+        with benchmark_database(on_disk=True):
+            user = User.objects.create(username="benchmark")
+            category = Category.objects.create(name="benchmark")
+            server = Server.objects.create(name="benchmark", owner=user, category=category)
+            server.member.add(user)
+            channels = [
+                Channel.objects.create(name=f"channel {i}", topic="benchmark", owner=user, server=server)
+                for i in range(options["channels"])
+            ]
+            # every client connects as the same member with a token, like the frontend does
+            paths = [f"/{server.id}/{channel.id}" for channel in channels]
+            report = asyncio.run(self.run(application, paths, f"token={issue_token(user)}".encode(), options))
+
+        self.stdout.write(f"consumer mode        {settings.WEBCHAT_CONSUMER_MODE}")
+        self.stdout.write(f"coalesce window      {settings.WEBCHAT_COALESCE_WINDOW * 1000:.0f} ms")
+        self.stdout.write(f"chat frames received {report['frames']}")
+        self.stdout.write(f"connections          {options['clients']} over {options['channels']} channel(s)")
+        self.stdout.write(f"messages sent        {report['sent']} ({report['send_rate']:.0f}/s)")
+        self.stdout.write(
+            f"frames delivered     {report['delivered']}/{report['expected']} ({report['fanout_rate']:.0f}/s)"
+        )
+        self.stdout.write(
+            f"fan-out latency ms   p50 {report['p50']:.2f}  p95 {report['p95']:.2f}  p99 {report['p99']:.2f}"
+        )
+        self.stdout.write(f"database writes      {report['rows']} rows ({report['write_rate']:.0f}/s)")
+        self.stdout.write(f"memory/connection    {report['memory_per_connection'] / 1024:.1f} KiB")
+
+        if report["delivered"] < report["expected"]:
+            raise CommandError(f"{report['expected'] - report['delivered']} frames were never delivered")
+        if options["max_p99"] is not None and report["p99"] > options["max_p99"]:
+            raise CommandError(f"p99 latency {report['p99']:.2f}ms is above {options['max_p99']}ms")
+        if options["min_throughput"] is not None and report["send_rate"] < options["min_throughput"]:
+            raise CommandError(f"throughput {report['send_rate']:.0f}/s is below {options['min_throughput']}/s")
+
+    async def run(self, application, channels, query_string, options):
+        clients = [
+            WebsocketClient(application, channels[i % len(channels)], query_string) for i in range(options["clients"])
+        ]
+        members = {channel: clients[i :: len(channels)] for i, channel in enumerate(channels)}
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        accepted = await asyncio.gather(*(client.connect() for client in clients))
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        if not all(accepted):
+            raise CommandError(f"{accepted.count(False)} connections were rejected")
+
+        sent_at = {}
+        latencies = []
+        frames = 0
+        expected = 0
+        sending = True
+
+        async def receive(client):
+            nonlocal frames
+            while sending or len(latencies) < expected:
+                try:
+                    event = await client.receive_json(timeout=1 if sending else options["drain"])
+                except asyncio.TimeoutError:
+                    if not sending:
+                        return
+                    continue
+                received = time.perf_counter()
+                if "new_message" in event:
+                    messages = [event["new_message"]]
+                elif "messages" in event:
+                    # with coalescing enabled several messages arrive in one chat.batch frame
+                    messages = event["messages"]
+                else:
+                    # presence and typing frames
+                    continue
+                frames += 1
+                for message in messages:
+                    latencies.append(received - sent_at[message["content"]])
+
+        async def send(index, client, interval, deadline):
+            nonlocal expected
+            channel = channels[index % len(channels)]
+            sequence = 0
+            next_send = time.perf_counter()
+            while next_send < deadline:
+                content = f"{index}:{sequence}"
+                sent_at[content] = time.perf_counter()
+                expected += len(members[channel])
+                await client.send_json({"type": "message", "message": content})
+                sequence += 1
+                next_send += interval
+                await asyncio.sleep(max(0, next_send - time.perf_counter()))
+            return sequence
+
+        receivers = [asyncio.create_task(receive(client)) for client in clients]
+        senders = clients[: max(1, min(options["senders"], len(clients)))]
+        interval = len(senders) / options["rate"]
+        started = time.perf_counter()
+        deadline = started + options["duration"]
+        sent = sum(await asyncio.gather(*(send(i, c, interval, deadline) for i, c in enumerate(senders))))
+        send_elapsed = time.perf_counter() - started
+        sending = False
+        await asyncio.gather(*receivers)
+        fanout_elapsed = time.perf_counter() - started
+
+        await asyncio.gather(*(client.disconnect() for client in clients))
+        await sync_to_async(message_writer.flush)()
+        rows = await sync_to_async(Message.objects.count)()
+        write_elapsed = time.perf_counter() - started
+
+        latencies_ms = [latency * 1000 for latency in latencies]
+        return {
+            "sent": sent,
+            "send_rate": sent / send_elapsed,
+            "delivered": len(latencies),
+            "frames": frames,
+            "expected": expected,
+            "fanout_rate": len(latencies) / fanout_elapsed,
+            "p50": percentile(latencies_ms, 50),
+            "p95": percentile(latencies_ms, 95),
+            "p99": percentile(latencies_ms, 99),
+            "rows": rows,
+            "write_rate": rows / write_elapsed,
+            "memory_per_connection": (after - before) / len(clients),
+        }
@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from webchat.activity import rebuild_activity
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes the activity scores behind the popular channels and servers from the messages of the last "
+        "--days days, after deploying them or changing WEBCHAT_ACTIVITY_HALF_LIFE"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=float, default=7)
+
+    def handle(self, *args, **options):
+        channels = rebuild_activity(timezone.now() - timedelta(days=options["days"]))
+        self.stdout.write(self.style.SUCCESS(f"scored {channels} channels"))
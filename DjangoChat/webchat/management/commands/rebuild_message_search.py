@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from webchat.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-indexes every message for full-text search in small batches, removing entries of deleted messages, "
+        "without holding a lock on the messages table for the whole run"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--optimize", action="store_true", help="Merge the index segments afterwards (SQLite)")
+
+    def handle(self, *args, **options):
+        def progress(indexed):
+            if indexed % (options["batch_size"] * 50) == 0:
+                self.stdout.write(f"indexed {indexed} messages")
+
+        result = rebuild_search_index(options["batch_size"], options["optimize"], progress)
+        self.stdout.write(
+            self.style.SUCCESS(f"indexed {result['indexed']} messages, removed {result['removed']} stale entries")
+        )
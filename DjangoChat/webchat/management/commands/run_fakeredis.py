@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from DjangoChat.benchmarks import start_fake_redis
+
+
+class Command(BaseCommand):
+    help = "Runs a local Redis stand-in (fakeredis) for developing with several ASGI workers without a Redis server"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=6379)
+
+    def handle(self, *args, **options):
+        try:
+            server, url = start_fake_redis(options["host"], options["port"])
+        except ImportError as e:
+            raise CommandError(str(e))
+        self.stdout.write(f"fakeredis listening on {url}, start the workers with REDIS_URL={url}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
@@ -0,0 +1,27 @@
+from django.db import connection
+
+
+class QueryCounter:
+    """Counts the SQL statements executed on the current database connection inside a ``with`` block.
+
+    The consumers use it to record how many queries storing a single chat message took, which should stay at one
+    INSERT once the conversation and sender have been resolved at connect time.
+    """
+
+    def __init__(self, using=connection):
+        self.using = using
+        self.count = 0
+        self._wrapper = None
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = self.using.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._wrapper.__exit__(exc_type, exc_value, traceback)
+        self._wrapper = None
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.4 on 2026-10-17 12:51
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_conversations(apps, schema_editor):
+    # concurrent get_or_create calls could create more than one conversation per channel before channel_id was
+    # unique, so move their messages onto the oldest one before adding the constraint
+    Conversation = apps.get_model("webchat", "Conversation")
+    Message = apps.get_model("webchat", "Message")
+    duplicates = Conversation.objects.values("channel_id").annotate(total=Count("id")).filter(total__gt=1)
+    for row in duplicates:
+        ids = list(
+            Conversation.objects.filter(channel_id=row["channel_id"]).order_by("id").values_list("id", flat=True)
+        )
+        Message.objects.filter(conversation_id__in=ids[1:]).update(conversation_id=ids[0])
+        Conversation.objects.filter(id__in=ids[1:]).delete()
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("webchat", "0002_message_timestamp_default"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_conversations, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="conversation",
+            name="channel_id",
+            field=models.CharField(max_length=255, unique=True),
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(
+                fields=["conversation", "timestamp", "id"],
+                name="message_conv_ts_id_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,46 @@
+from django.db import migrations
+from DjangoChat.database import vendor_sql
+
+# the full-text index lives outside the models: an FTS5 table kept in sync by triggers on SQLite, a generated
+# tsvector column with a GIN index on PostgreSQL, see webchat/search.py
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE webchat_message_fts USING fts5(content, tokenize='unicode61 remove_diacritics 2')",
+    """CREATE TRIGGER webchat_message_fts_insert AFTER INSERT ON webchat_message BEGIN
+        INSERT OR REPLACE INTO webchat_message_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER webchat_message_fts_delete AFTER DELETE ON webchat_message BEGIN
+        DELETE FROM webchat_message_fts WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER webchat_message_fts_update AFTER UPDATE OF content ON webchat_message BEGIN
+        UPDATE webchat_message_fts SET content = new.content WHERE rowid = new.id;
+    END""",
+    "INSERT INTO webchat_message_fts(rowid, content) SELECT id, content FROM webchat_message",
+]
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS webchat_message_fts_insert",
+    "DROP TRIGGER IF EXISTS webchat_message_fts_delete",
+    "DROP TRIGGER IF EXISTS webchat_message_fts_update",
+    "DROP TABLE IF EXISTS webchat_message_fts",
+]
+POSTGRES_CREATE = [
+    """ALTER TABLE webchat_message ADD COLUMN search_vector tsvector
+        GENERATED ALWAYS AS (to_tsvector('simple', content)) STORED""",
+    "CREATE INDEX webchat_message_search_idx ON webchat_message USING GIN (search_vector)",
+]
+POSTGRES_DROP = [
+    "DROP INDEX IF EXISTS webchat_message_search_idx",
+    "ALTER TABLE webchat_message DROP COLUMN IF EXISTS search_vector",
+]
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("webchat", "0003_message_history_indexes"),
+    ]
+
+    operations = [
+        vendor_sql(
+            {"sqlite": SQLITE_CREATE, "postgresql": POSTGRES_CREATE},
+            {"sqlite": SQLITE_DROP, "postgresql": POSTGRES_DROP},
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.4 on 2026-10-17 13:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("server", "0004_server_search"),
+        ("webchat", "0004_message_search"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ServerActivity",
+            fields=[
+                (
+                    "server",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="+",
+                        serialize=False,
+                        to="server.server",
+                    ),
+                ),
+                ("score", models.FloatField()),
+                ("updated_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                "indexes": [models.Index(fields=["-score"], name="server_activity_score_idx")],
+            },
+        ),
+        migrations.CreateModel(
+            name="ChannelActivity",
+            fields=[
+                (
+                    "channel",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="+",
+                        serialize=False,
+                        to="server.channel",
+                    ),
+                ),
+                ("score", models.FloatField()),
+                ("updated_at", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "server",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="server.server",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["-score"], name="channel_activity_score_idx"),
+                    models.Index(fields=["server", "-score"], name="channel_activity_server_idx"),
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.2.4 on 2026-10-17 13:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("webchat", "0005_activity"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ReadState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("last_read_id", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="message",
+            index=models.Index(fields=["conversation", "id"], name="message_conv_id_idx"),
+        ),
+        migrations.AddField(
+            model_name="readstate",
+            name="conversation",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="webchat.conversation",
+            ),
+        ),
+        migrations.AddField(
+            model_name="readstate",
+            name="user",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="readstate",
+            constraint=models.UniqueConstraint(
+                fields=("user", "conversation"),
+                name="read_state_user_conversation_unique",
+            ),
+        ),
+    ]
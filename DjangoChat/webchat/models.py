@@ -1,9 +1,10 @@
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.utils import timezone
 
 
 class Conversation(models.Model):
-    channel_id = models.CharField(max_length=255)
+    channel_id = models.CharField(max_length=255, unique=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
 
@@ -11,4 +12,53 @@ class Message(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name="message")
     sender = models.ForeignKey(get_user_model(), on_delete=models.CASCADE)
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # set from Python rather than auto_now_add so a message queued by the async consumer keeps the timestamp that
+    # was broadcast to the clients when it is written later on
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        # backs the keyset pagination in pagination.py, which walks a conversation's messages by (timestamp, id)
+        indexes = [
+            models.Index(fields=["conversation", "timestamp", "id"], name="message_conv_ts_id_idx"),
+            # unread counts in unread.py walk the messages of a conversation after a read watermark by id
+            models.Index(fields=["conversation", "id"], name="message_conv_id_idx"),
+        ]
+
+
+# how far a user has read a conversation, messages with a greater id are unread; kept up to date by unread.py from
+# the read frames of the chat websocket and the messages the user sends
+class ReadState(models.Model):
+    user = models.ForeignKey(get_user_model(), on_delete=models.CASCADE, related_name="+")
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name="+")
+    last_read_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "conversation"], name="read_state_user_conversation_unique")
+        ]
+
+
+# checkpoints of the activity scores kept by activity.py, read by the popular channels and servers endpoints
+# score is log2 of the sum of 2 ** (t / WEBCHAT_ACTIVITY_HALF_LIFE) over the times t of the messages, so ordering by
+# it ranks by decayed activity at any moment without the rows having to be decayed; it means nothing on its own
+class ChannelActivity(models.Model):
+    channel = models.OneToOneField("server.Channel", on_delete=models.CASCADE, primary_key=True, related_name="+")
+    server = models.ForeignKey("server.Server", on_delete=models.CASCADE, related_name="+")
+    score = models.FloatField()
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-score"], name="channel_activity_score_idx"),
+            models.Index(fields=["server", "-score"], name="channel_activity_server_idx"),
+        ]
+
+
+class ServerActivity(models.Model):
+    server = models.OneToOneField("server.Server", on_delete=models.CASCADE, primary_key=True, related_name="+")
+    score = models.FloatField()
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=["-score"], name="server_activity_score_idx")]
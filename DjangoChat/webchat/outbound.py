@@ -0,0 +1,48 @@
+import asyncio
+from collections import deque
+
+DROP_OLDEST = "drop_oldest"
+DISCONNECT = "disconnect"
+
+
+class OutboundQueue:
+    """Bounded per-connection queue of messages waiting to be written to one websocket.
+
+    The consumer's channel layer handler only appends to it, so a client that reads slowly never holds up the
+    delivery of group messages; the queue fills up instead and ``policy`` decides what happens then:
+
+    - ``drop_oldest`` discards the oldest pending message and counts it in ``dropped``
+    - ``disconnect`` refuses the message, the consumer then closes the slow socket
+    """
+
+    def __init__(self, maxsize, policy=DROP_OLDEST):
+        if policy not in (DROP_OLDEST, DISCONNECT):
+            raise ValueError(f"Unknown slow consumer policy {policy!r}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self._items = deque()
+        self._ready = asyncio.Event()
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        if len(self._items) >= self.maxsize:
+            if self.policy == DISCONNECT:
+                return False
+            self._items.popleft()
+            self.dropped += 1
+        self._items.append(item)
+        self._ready.set()
+        return True
+
+    async def get_batch(self, window, max_batch):
+        """Waits for a message, keeps collecting for ``window`` seconds and returns up to ``max_batch`` of them."""
+        await self._ready.wait()
+        if window:
+            await asyncio.sleep(window)
+        batch = [self._items.popleft() for _ in range(min(max_batch, len(self._items)))]
+        if not self._items:
+            self._ready.clear()
+        return batch
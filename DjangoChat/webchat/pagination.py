@@ -0,0 +1,132 @@
+import base64
+import binascii
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+
+def encode_cursor(message):
+    raw = f"{message.timestamp.isoformat()}|{message.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def parse_limit(request, default, maximum):
+    limit = request.query_params.get("limit")
+    if limit is None:
+        return default
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValidationError(detail="limit must be an integer")
+    if limit < 1:
+        raise ValidationError(detail="limit must be positive")
+    return min(limit, maximum)
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        timestamp, message_id = raw.split("|")
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValidationError(detail="Invalid cursor")
+
+
+class MessageKeysetPagination:
+    """Keyset pagination over a conversation's messages ordered by ``(timestamp, id)``.
+
+    Pages are located with a ``WHERE (timestamp, id) < cursor`` range scan on the ``(conversation, timestamp, id)``
+    index instead of an OFFSET, so fetching a page costs the same no matter how long the history is.
+
+    - no cursor: the newest ``limit`` messages
+    - ``before``: the ``limit`` messages right before the cursor
+    - ``after``: the ``limit`` messages right after the cursor
+
+    Messages are always returned oldest first, together with the cursors for the neighbouring pages.
+    """
+
+    default_limit = 50
+    max_limit = 200
+
+    def get_limit(self, request):
+        return parse_limit(request, self.default_limit, self.max_limit)
+
+    def is_newest_page(self, request):
+        return not request.query_params.get("before") and not request.query_params.get("after")
+
+    def paginate_recent(self, page, has_more):
+        """Takes a newest page that was already found elsewhere, e.g. in ``recent.recent_messages``."""
+        self.before = encode_cursor(page[0]) if page and has_more else None
+        self.after = None
+        return page
+
+    def paginate_queryset(self, queryset, request):
+        before = request.query_params.get("before")
+        after = request.query_params.get("after")
+        if before and after:
+            raise ValidationError(detail="Use either before or after, not both")
+        limit = self.get_limit(request)
+
+        if after:
+            timestamp, message_id = decode_cursor(after)
+            queryset = queryset.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=message_id))
+            page = list(queryset.order_by("timestamp", "id")[: limit + 1])
+            has_more = len(page) > limit
+            page = page[:limit]
+            # we came from an older page, so there is always something before this one
+            has_before, has_after = True, has_more
+        else:
+            if before:
+                timestamp, message_id = decode_cursor(before)
+                queryset = queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id))
+            page = list(queryset.order_by("-timestamp", "-id")[: limit + 1])
+            has_more = len(page) > limit
+            page = page[:limit][::-1]
+            has_before, has_after = has_more, bool(before)
+
+        self.before = encode_cursor(page[0]) if page and has_before else None
+        self.after = encode_cursor(page[-1]) if page and has_after else None
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({"before": self.before, "after": self.after, "results": data})
+
+    # the parameters and the page envelope are documented with extend_schema in schemas.py, these only keep
+    # drf-spectacular from adding its own on top
+    def get_schema_operation_parameters(self, view):
+        return []
+
+    def get_paginated_response_schema(self, schema):
+        # schema is the array of MessagePage drf-spectacular built for the list action, a page is a single object
+        return schema["items"]
+
+
+class MessageSearchPagination:
+    """Offset pagination for ranked search results.
+
+    Results are ordered by relevance rather than by a column, so there is no key to continue from. Offsets are
+    capped at ``max_offset`` since every page has to rank all the results before it.
+    """
+
+    default_limit = 20
+    max_limit = 100
+    max_offset = 1000
+
+    def paginate_search(self, search, request):
+        limit = parse_limit(request, self.default_limit, self.max_limit)
+        try:
+            offset = int(request.query_params.get("offset", 0))
+        except ValueError:
+            raise ValidationError(detail="offset must be an integer")
+        if not 0 <= offset <= self.max_offset:
+            raise ValidationError(detail=f"offset must be between 0 and {self.max_offset}")
+
+        # one extra row tells whether there is a next page
+        hits = search(limit + 1, offset)
+        self.next_offset = offset + limit if len(hits) > limit and offset + limit <= self.max_offset else None
+        return hits[:limit]
+
+    def get_paginated_response(self, data):
+        return Response({"next_offset": self.next_offset, "results": data})
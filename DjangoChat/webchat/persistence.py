@@ -0,0 +1,242 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, transaction
+
+from .models import Message
+from .unread import messages_written
+
+logger = logging.getLogger(__name__)
+
+# custom epoch (2023-01-01T00:00:00Z) in milliseconds, keeps the generated ids well inside a signed 64 bit integer
+ID_EPOCH_MS = 1672531200000
+WORKER_ID_BITS = 10
+SEQUENCE_BITS = 12
+# seconds before the first retry of a batch that failed to write, doubled for every further one
+RETRY_BACKOFF = 0.1
+# counter in Redis the worker ids are taken from when WEBCHAT_WORKER_ID isn't set
+WORKER_ID_KEY = "webchat:worker-id"
+
+
+def allocate_worker_id():
+    """Returns the worker id of this process: ``WEBCHAT_WORKER_ID``, the next one from Redis, or the pid.
+
+    Two processes with the same worker id hand out the same message ids, so with Redis, which is what running more
+    than one process takes, an id that can't be allocated is an error rather than a fallback to the pid, which
+    repeats across hosts and containers.
+    """
+    worker_id = getattr(settings, "WEBCHAT_WORKER_ID", None)
+    if worker_id is not None:
+        return int(worker_id)
+    redis_url = getattr(settings, "WEBCHAT_WORKER_ID_REDIS_URL", None)
+    if not redis_url:
+        # the in-memory channel layer only works in a single process, so the pid is unique enough
+        return os.getpid()
+    try:
+        import redis
+
+        # unique among any 1024 processes started in a row
+        return redis.Redis.from_url(redis_url).incr(WORKER_ID_KEY) - 1
+    except Exception as error:
+        raise ImproperlyConfigured(
+            "Set WEBCHAT_WORKER_ID to a number unique to this process, no worker id could be allocated from Redis"
+        ) from error
+
+
+class MessageIdGenerator:
+    """Hands out time-ordered 64 bit message ids without touching the database.
+
+    The async consumer broadcasts a message before it is written, so the id the clients see has to be decided up
+    front. Ids are built from the milliseconds since ``ID_EPOCH_MS``, a per-process worker id and a sequence number,
+    which keeps them unique across worker processes and roughly ordered by creation time. The worker id is
+    allocated on the first id, see ``allocate_worker_id``.
+    """
+
+    def __init__(self, worker_id=None):
+        self.worker_id = None if worker_id is None else int(worker_id) % (1 << WORKER_ID_BITS)
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_id(self):
+        with self._lock:
+            if self.worker_id is None:
+                self.worker_id = allocate_worker_id() % (1 << WORKER_ID_BITS)
+            now_ms = int(time.time() * 1000) - ID_EPOCH_MS
+            if now_ms < self._last_ms:
+                # the clock went backwards, keep issuing ids from the last timestamp we saw
+                now_ms = self._last_ms
+            if now_ms == self._last_ms:
+                self._sequence = (self._sequence + 1) & ((1 << SEQUENCE_BITS) - 1)
+                if self._sequence == 0:
+                    # sequence exhausted for this millisecond, borrow the next one
+                    now_ms += 1
+            else:
+                self._sequence = 0
+            self._last_ms = now_ms
+            return (now_ms << (WORKER_ID_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+
+
+class MessageWriteBehindQueue:
+    """In-process write-behind buffer for chat messages.
+
+    Messages are queued with their id and timestamp already assigned and a background thread writes them with
+    ``bulk_create`` once ``batch_size`` messages are waiting or ``flush_interval`` seconds have passed since the
+    first queued message, whichever comes first. Each batch is written in a single transaction, so a burst costs
+    one commit per batch instead of one per message. A batch that fails is retried ``retries`` times and then
+    written one message at a time, so a bad message only loses itself and not the rest of its batch.
+
+    The queue holds at most ``maxsize`` messages. When the database can't keep up, ``put`` blocks until the writer
+    has made room, which slows the senders down instead of letting unwritten messages pile up in memory.
+    """
+
+    def __init__(self, batch_size=None, flush_interval=None, maxsize=None, retries=None):
+        self.batch_size = batch_size or getattr(settings, "WEBCHAT_WRITE_BATCH_SIZE", 100)
+        self.retries = retries if retries is not None else getattr(settings, "WEBCHAT_WRITE_RETRIES", 3)
+        self.flush_interval = flush_interval or getattr(settings, "WEBCHAT_WRITE_FLUSH_INTERVAL", 0.05)
+        self.maxsize = maxsize or getattr(settings, "WEBCHAT_WRITE_QUEUE_SIZE", 10000)
+        self._queue = queue.Queue(self.maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._stopping = threading.Event()
+        # messages ever queued and messages whose write has finished (or failed), flush() waits for these to meet
+        self._settled_condition = threading.Condition()
+        self._queued = 0
+        self._settled = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="webchat-message-writer", daemon=True)
+            self._thread.start()
+
+    def put(self, message, block=True, timeout=None):
+        """Queues a message, waiting for room while the queue is full unless ``block`` is False.
+
+        Raises ``queue.Full`` when there is still no room after ``timeout`` seconds, or straight away when not
+        blocking.
+        """
+        self.start()
+        self._queue.put(message, block, timeout)
+        with self._settled_condition:
+            self._queued += 1
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def flush(self, timeout=5):
+        """Makes sure everything queued so far is written before returning.
+
+        Whatever is still in the queue is written from the calling thread, and a batch the background thread has
+        already taken is waited for.
+        """
+        with self._settled_condition:
+            target = self._queued
+        batch = self._drain(self._queue.qsize())
+        while batch:
+            self._write(batch)
+            batch = self._drain(self.batch_size)
+        with self._settled_condition:
+            self._settled_condition.wait_for(lambda: self._settled >= target, timeout)
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        pending = self.pending()
+        self.flush()
+        if pending:
+            logger.info("Wrote %d queued chat messages on shutdown", pending)
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    self._insert(batch)
+                    return
+                except Exception:
+                    logger.warning("Failed to persist %d chat messages, attempt %d", len(batch), attempt + 1)
+                    if attempt < self.retries:
+                        time.sleep(RETRY_BACKOFF * 2**attempt)
+            # the clients already have these messages, keep every one that can be written
+            for message in batch:
+                try:
+                    self._insert([message])
+                except Exception:
+                    logger.exception("Dropped chat message %s of conversation %s", message.id, message.conversation_id)
+        finally:
+            with self._settled_condition:
+                self._settled += len(batch)
+                self._settled_condition.notify_all()
+
+    def _insert(self, messages):
+        with self._write_lock, transaction.atomic():
+            Message.objects.bulk_create(messages, batch_size=self.batch_size)
+        try:
+            messages_written(messages)
+        except Exception:
+            logger.exception("Failed to cache the latest message ids")
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception:
+                logger.exception("Failed to persist %d chat messages", len(batch))
+            finally:
+                close_old_connections()
+
+
+message_ids = MessageIdGenerator()
+message_writer = MessageWriteBehindQueue()
+
+# make sure nothing that was already broadcast is lost when the worker process exits
+atexit.register(message_writer.stop)
+
+
+def stop_background_writers():
+    """Writes what the message writer, the channel activity and the read watermarks still hold, and stops their
+    threads. They are started again by the next message.
+
+    The same happens at exit; a benchmark or test run calls this before it drops its database, which would be gone
+    by then.
+    """
+    from .activity import channel_activity
+    from .unread import read_states
+
+    message_writer.stop()
+    channel_activity.stop()
+    read_states.stop()
@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# group of one listener channel per process, presence changes are replicated to every process through it
+PRESENCE_GROUP = "webchat.presence"
+
+
+def server_group(server_id):
+    """Group of every socket on ``server_id``, debounced presence changes are sent to it."""
+    return f"presence.{server_id}"
+
+
+class PresenceTracker:
+    """Who is online on which server, kept in memory and replicated between processes over the channel layer.
+
+    Every process counts the sockets it holds per server and user. A user's first socket in a process and its last
+    one going away are the only updates sent to the other processes, so the cost of an update doesn't depend on how
+    many members a server has. Each process also sends one heartbeat every ``WEBCHAT_PRESENCE_HEARTBEAT`` seconds
+    listing its users; a process that stops sending them, because it crashed, has its users expire after
+    ``WEBCHAT_PRESENCE_TTL`` seconds. Nothing is written to the database.
+
+    The sockets of a server are told who came online or went offline at most once per
+    ``WEBCHAT_PRESENCE_DEBOUNCE`` seconds, a user reconnecting within that window isn't reported at all.
+    """
+
+    def __init__(self):
+        self.origin = uuid.uuid4().hex
+        self._lock = threading.Lock()
+        # sockets held by this process per (server_id, user_id), and the names to report the users with
+        self._local = Counter()
+        self._names = {}
+        # replica of every process' users: server_id -> user_id -> origin -> monotonic expiry
+        self._online = defaultdict(dict)
+        # changes waiting for the debounced broadcast: server_id -> user_id -> online
+        self._changes = {}
+        self._typing = {}
+        self._listener = None
+        self._loop = None
+
+    async def connected(self, channel_layer, server_id, user):
+        """Counts a socket of ``user`` on ``server_id``, called once the socket is accepted."""
+        await self.ensure_listening(channel_layer)
+        key = (int(server_id), user.id)
+        with self._lock:
+            self._local[key] += 1
+            self._names[user.id] = user.username
+            first = self._local[key] == 1
+        if first:
+            await self.publish(channel_layer, key[0], user.id, user.username, True)
+
+    async def disconnected(self, channel_layer, server_id, user):
+        key = (int(server_id), user.id)
+        with self._lock:
+            self._local[key] -= 1
+            last = self._local[key] <= 0
+            if last:
+                del self._local[key]
+        if last:
+            await self.publish(channel_layer, key[0], user.id, user.username, False)
+
+    async def typing(self, channel_layer, channel_id, user):
+        """Tells the sockets of ``channel_id`` that ``user`` is typing, at most once per typing debounce."""
+        now = time.monotonic()
+        key = (channel_id, user.id)
+        # the sync consumer calls this through async_to_sync, which may run it on a loop of its own
+        with self._lock:
+            if self._typing.get(key, 0) > now:
+                return
+            self._typing[key] = now + settings.WEBCHAT_TYPING_DEBOUNCE
+        await channel_layer.group_send(
+            channel_id, {"type": "chat.typing", "channel_id": channel_id, "user_id": user.id, "user": user.username}
+        )
+
+    def online_members(self, server_id):
+        """Returns ``[(user_id, username)]`` of the users with a socket on ``server_id``, in any process.
+
+        Only reads the replica, which the listener started by ``lifespan`` or the first socket keeps up to date.
+        """
+        now = time.monotonic()
+        with self._lock:
+            users = self._online.get(int(server_id), {})
+            online = [
+                user_id for user_id, origins in users.items() if any(expiry > now for expiry in origins.values())
+            ]
+            return sorted(((user_id, self._names.get(user_id, "")) for user_id in online), key=lambda user: user[1])
+
+    async def publish(self, channel_layer, server_id, user_id, username, online):
+        if self.apply(self.origin, server_id, user_id, username, online):
+            self.changed(channel_layer, server_id, user_id, online)
+        await channel_layer.group_send(
+            PRESENCE_GROUP,
+            {
+                "type": "presence.update",
+                "origin": self.origin,
+                "server": server_id,
+                "user": user_id,
+                "name": username,
+                "online": online,
+            },
+        )
+
+    def apply(self, origin, server_id, user_id, username, online):
+        """Updates the replica, returns whether the user came online or went offline on the server."""
+        now = time.monotonic()
+        with self._lock:
+            users = self._online[server_id]
+            origins = users.get(user_id, {})
+            was_online = any(expiry > now for expiry in origins.values())
+            if online:
+                origins[origin] = now + settings.WEBCHAT_PRESENCE_TTL
+                users[user_id] = origins
+                self._names[user_id] = username
+            else:
+                origins.pop(origin, None)
+                if not origins:
+                    users.pop(user_id, None)
+            return was_online != any(expiry > now for expiry in origins.values())
+
+    def changed(self, channel_layer, server_id, user_id, online):
+        # reported by the process the socket is on, the others only update their replica
+        changes = self._changes.get(server_id)
+        if changes is None:
+            changes = self._changes[server_id] = {}
+            asyncio.get_running_loop().call_later(
+                settings.WEBCHAT_PRESENCE_DEBOUNCE,
+                lambda: asyncio.ensure_future(self.broadcast(channel_layer, server_id)),
+            )
+        if changes.get(user_id) == (not online):
+            # back to where it was when the window started, e.g. a reload
+            del changes[user_id]
+        else:
+            changes[user_id] = online
+
+    async def broadcast(self, channel_layer, server_id):
+        changes = self._changes.pop(server_id, {})
+        if not changes:
+            return
+        await channel_layer.group_send(
+            server_group(server_id),
+            {
+                "type": "presence.changed",
+                "online": [
+                    {"id": user_id, "username": self._names.get(user_id, "")}
+                    for user_id, online in changes.items()
+                    if online
+                ],
+                "offline": [user_id for user_id, online in changes.items() if not online],
+            },
+        )
+
+    async def ensure_listening(self, channel_layer):
+        """Starts this process' listener on the running event loop unless it is already running there."""
+        loop = asyncio.get_running_loop()
+        if self._listener is not None and self._loop is loop and not self._listener.done():
+            return
+        self._loop = loop
+        self._listener = loop.create_task(self.listen(channel_layer))
+
+    def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+        self._listener = None
+        self._loop = None
+
+    async def listen(self, channel_layer):
+        channel = await channel_layer.new_channel()
+        await channel_layer.group_add(PRESENCE_GROUP, channel)
+        # a process that just started knows nobody, ask the others for their users instead of waiting for heartbeats
+        await channel_layer.group_send(PRESENCE_GROUP, {"type": "presence.sync", "origin": self.origin})
+        next_heartbeat = time.monotonic()
+        receiving = None
+        try:
+            while True:
+                if receiving is None:
+                    receiving = asyncio.ensure_future(channel_layer.receive(channel))
+                # asyncio.wait, not wait_for: wait_for drops a cancellation that comes in just as a message arrives
+                done, _ = await asyncio.wait({receiving}, timeout=max(0, next_heartbeat - time.monotonic()))
+                if not done:
+                    next_heartbeat = time.monotonic() + settings.WEBCHAT_PRESENCE_HEARTBEAT
+                    try:
+                        # group memberships expire on some layers, joining again is a no-op otherwise
+                        await channel_layer.group_add(PRESENCE_GROUP, channel)
+                        await self.heartbeat(channel_layer)
+                    except Exception:
+                        logger.exception("Failed to send the presence heartbeat")
+                    continue
+                received, receiving = receiving, None
+                try:
+                    message = received.result()
+                except Exception:
+                    logger.exception("Failed to receive presence updates")
+                    await asyncio.sleep(1)
+                    continue
+                if message.get("origin") == self.origin:
+                    continue
+                if message["type"] == "presence.update":
+                    self.apply(
+                        message["origin"], message["server"], message["user"], message["name"], message["online"]
+                    )
+                elif message["type"] == "presence.heartbeat":
+                    for server_id, user_id, username in message["users"]:
+                        self.apply(message["origin"], server_id, user_id, username, True)
+                elif message["type"] == "presence.sync":
+                    await self.heartbeat(channel_layer)
+        finally:
+            if receiving is not None:
+                receiving.cancel()
+
+    async def heartbeat(self, channel_layer):
+        now = time.monotonic()
+        with self._lock:
+            users = [(server_id, user_id, self._names.get(user_id, "")) for server_id, user_id in self._local]
+            # drop what expired: users of processes that went away, and typing notices long sent
+            for server_id in list(self._online):
+                server_users = self._online[server_id]
+                for user_id in list(server_users):
+                    origins = server_users[user_id]
+                    for origin in [origin for origin, expiry in origins.items() if expiry <= now]:
+                        del origins[origin]
+                    if not origins:
+                        del server_users[user_id]
+                if not server_users:
+                    del self._online[server_id]
+            self._typing = {key: until for key, until in self._typing.items() if until > now}
+        for server_id, user_id, username in users:
+            self.apply(self.origin, server_id, user_id, username, True)
+        await channel_layer.group_send(
+            PRESENCE_GROUP, {"type": "presence.heartbeat", "origin": self.origin, "users": users}
+        )
+
+
+presence = PresenceTracker()
+
+
+async def lifespan(scope, receive, send):
+    """ASGI lifespan application that runs the presence listener for as long as the server process does.
+
+    That way a process serving only HTTP requests still knows who is online. Servers without lifespan support
+    start the listener with the first socket instead.
+    """
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            channel_layer = get_channel_layer()
+            if channel_layer is not None:
+                await presence.ensure_listening(channel_layer)
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            presence.stop()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
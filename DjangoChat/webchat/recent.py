@@ -0,0 +1,258 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Conversation, Message
+
+# rough size of a RecentMessage and its bookkeeping on top of the text it holds, used for the memory cap
+RECORD_OVERHEAD = 240
+
+
+class RecentMessage:
+    __slots__ = ("id", "sender", "content", "timestamp")
+
+    def __init__(self, id, sender, content, timestamp):
+        self.id = id
+        self.sender = sender
+        self.content = content
+        self.timestamp = timestamp
+
+    @property
+    def key(self):
+        return self.timestamp, self.id
+
+    @property
+    def size(self):
+        return RECORD_OVERHEAD + len(self.sender) + len(self.content)
+
+    def as_dict(self):
+        return {
+            "id": str(self.id),
+            "sender": self.sender,
+            "content": self.content,
+            "timestamp": self.timestamp.isoformat(),
+        }
+
+
+class ChannelBuffer:
+    """The newest messages of one channel, oldest first, ordered by ``(timestamp, id)`` like the history API.
+
+    A buffer only answers reads once it has been seeded from the database; before that it just collects the
+    messages broadcast to the channel so none are lost while the seed query runs. ``whole_history`` is set when the
+    channel has never had more messages than the buffer holds.
+    """
+
+    __slots__ = ("records", "ids", "size", "seeded", "whole_history")
+
+    def __init__(self, capacity):
+        self.records = deque(maxlen=capacity)
+        self.ids = set()
+        self.size = 0
+        self.seeded = False
+        self.whole_history = False
+
+    def add(self, record):
+        if record.id in self.ids:
+            return 0
+        records = self.records
+        if len(records) == records.maxlen:
+            if record.key < records[0].key:
+                # older than everything we keep
+                self.whole_history = False
+                return 0
+            dropped = records.popleft()
+            self.ids.discard(dropped.id)
+            self.size -= dropped.size
+            self.whole_history = False
+        # messages nearly always arrive in order, so the insert position is found from the right
+        position = len(records)
+        while position and records[position - 1].key > record.key:
+            position -= 1
+        records.insert(position, record)
+        self.ids.add(record.id)
+        self.size += record.size
+        return record.size
+
+    def latest(self, limit):
+        if not self.seeded or (len(self.records) < limit and not self.whole_history):
+            return None
+        page = list(self.records)[-limit:]
+        return page, len(self.records) > limit or not self.whole_history
+
+    def since(self, message_id, limit):
+        if not self.seeded or message_id not in self.ids:
+            return None
+        records = list(self.records)
+        position = next(index for index, record in enumerate(records) if record.id == message_id)
+        missed = records[position + 1 :]
+        return [record.as_dict() for record in missed[:limit]], len(missed) <= limit
+
+
+class RecentMessages:
+    """Process-wide cache of the newest messages of every channel that has a websocket open in this process.
+
+    Opening a channel asks for its newest page of messages and reconnecting sockets ask for what they missed; both
+    are answered from here instead of the database while the buffer can vouch for being complete. That holds as
+    long as a local consumer sits in the channel's group, since the group delivers every message sent to the
+    channel from any worker, so a buffer is dropped as soon as the last local socket of its channel goes away.
+
+    Buffers hold at most ``capacity`` messages each and ``max_bytes`` in total, past that the least recently used
+    channels are evicted and get seeded again on their next read.
+
+    A message another worker broadcast just before this process subscribed can still sit in that worker's
+    write-behind queue, so a seed taken right away would lack it for good. Buffers are only seeded once the channel
+    has been subscribed for ``seed_delay`` seconds, reads before that go to the database; a worker whose writes are
+    further behind than that can still leave such a gap.
+    """
+
+    def __init__(self, capacity=None, max_bytes=None, seed_delay=None):
+        # marks the broadcasts of this process, which recorded them before sending
+        self.origin = uuid.uuid4().hex
+        self.capacity = capacity or getattr(settings, "WEBCHAT_RECENT_MESSAGES_PER_CHANNEL", 200)
+        self.max_bytes = max_bytes or getattr(settings, "WEBCHAT_RECENT_MESSAGES_MAX_BYTES", 32 * 1024 * 1024)
+        self.seed_delay = seed_delay if seed_delay is not None else getattr(settings, "WEBCHAT_RECENT_SEED_DELAY", 1.0)
+        self._buffers = OrderedDict()
+        self._subscribers = {}
+        # monotonic time each channel got its first local subscriber
+        self._subscribed_at = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def subscribe(self, channel_id):
+        with self._lock:
+            self._subscribers[channel_id] = self._subscribers.get(channel_id, 0) + 1
+            self._subscribed_at.setdefault(channel_id, time.monotonic())
+
+    def unsubscribe(self, channel_id):
+        with self._lock:
+            count = self._subscribers.get(channel_id, 0) - 1
+            if count > 0:
+                self._subscribers[channel_id] = count
+                return
+            # nobody here receives the channel's broadcasts any more, so the buffer would silently go stale
+            self._subscribers.pop(channel_id, None)
+            self._subscribed_at.pop(channel_id, None)
+            self._drop(channel_id)
+
+    def record(self, channel_id, message_id, sender, content, timestamp):
+        buffer = self._buffers.get(channel_id)
+        if buffer is not None and message_id in buffer.ids:
+            # every local socket of the channel reports the same broadcast of another worker, only the first one needs
+            # the lock; a stale answer here just means taking it
+            return
+        with self._lock:
+            if channel_id not in self._subscribers:
+                return
+            buffer = self._buffers.get(channel_id)
+            if buffer is None:
+                buffer = self._buffers[channel_id] = ChannelBuffer(self.capacity)
+            elif message_id in buffer.ids:
+                return
+            self._buffers.move_to_end(channel_id)
+            if isinstance(timestamp, str):
+                timestamp = datetime.fromisoformat(timestamp)
+            self._add(buffer, RecentMessage(message_id, sender, content, timestamp))
+            self._evict()
+
+    def latest(self, channel_id, limit):
+        """Returns the newest ``limit`` messages of the channel and whether older ones exist, or None."""
+        return self._read(channel_id, lambda buffer: buffer.latest(limit))
+
+    def since(self, channel_id, message_id, limit):
+        """Returns the messages after ``message_id`` like ``replay.load_missed_messages``, or None."""
+        return self._read(channel_id, lambda buffer: buffer.since(message_id, limit))
+
+    def discard(self, channel_id):
+        with self._lock:
+            self._drop(channel_id)
+
+    def clear(self):
+        with self._lock:
+            self._buffers.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "channels": len(self._buffers),
+                "messages": sum(len(buffer.records) for buffer in self._buffers.values()),
+                "bytes": self._size,
+            }
+
+    def _read(self, channel_id, read):
+        with self._lock:
+            if channel_id not in self._subscribers:
+                self.misses += 1
+                return None
+            buffer = self._buffers.get(channel_id)
+            if buffer is None:
+                buffer = self._buffers[channel_id] = ChannelBuffer(self.capacity)
+            self._buffers.move_to_end(channel_id)
+            result = read(buffer)
+            if result is not None:
+                self.hits += 1
+                return result
+            self.misses += 1
+            if buffer.seeded:
+                # seeded but the request reaches further back than the buffer does
+                return None
+            if time.monotonic() - self._subscribed_at[channel_id] < self.seed_delay:
+                # too early to seed, messages from before the subscription may not be written yet
+                return None
+
+        # the channel is subscribed, so anything sent from here on is recorded; the newest messages stored before
+        # that come from the database and are merged with whatever was recorded while the query ran
+        rows = list(
+            Message.objects.filter(conversation__channel_id=channel_id)
+            .order_by("-timestamp", "-id")
+            .values_list("id", "sender__username", "content", "timestamp")[: self.capacity + 1]
+        )
+        with self._lock:
+            if self._buffers.get(channel_id) is not buffer:
+                # evicted or dropped meanwhile, messages may have been missed since
+                return None
+            if not buffer.seeded:
+                for row in rows[: self.capacity]:
+                    self._add(buffer, RecentMessage(*row))
+                buffer.seeded = True
+                buffer.whole_history = len(rows) <= self.capacity and len(buffer.records) < self.capacity
+                self._evict()
+            return read(buffer)
+
+    def _add(self, buffer, record):
+        before = buffer.size
+        buffer.add(record)
+        self._size += buffer.size - before
+
+    def _drop(self, channel_id):
+        buffer = self._buffers.pop(channel_id, None)
+        if buffer is not None:
+            self._size -= buffer.size
+
+    def _evict(self):
+        # never evict the channel that was just used, it sits at the end
+        while self._size > self.max_bytes and len(self._buffers) > 1:
+            _, buffer = self._buffers.popitem(last=False)
+            self._size -= buffer.size
+            self.evictions += 1
+
+
+recent_messages = RecentMessages()
+
+
+# the conversation's messages are gone with it
+@receiver(post_delete, sender=Conversation)
+def conversation_deleted(sender, instance, **kwargs):
+    recent_messages.discard(instance.channel_id)
@@ -0,0 +1,79 @@
+from collections import deque
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.db.models import Q
+
+from .models import Message
+
+
+def parse_since(value):
+    try:
+        return int(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+def load_missed_messages(conversation_id, since_id, limit=None):
+    """Returns the messages of a conversation that come after message ``since_id``, oldest first.
+
+    Messages are ordered by ``(timestamp, id)`` like the history API, so the replay lines up with what a client
+    fetched from there. The second value is False when the gap can't be filled from here, because ``since_id`` is
+    unknown or more than ``limit`` messages were missed; the client should then refetch the history instead.
+    """
+    limit = limit or settings.WEBCHAT_REPLAY_LIMIT
+    anchor = Message.objects.filter(conversation_id=conversation_id, id=since_id).values_list("timestamp", flat=True)
+    anchor = anchor.first()
+    if anchor is None:
+        return [], False
+
+    missed = list(
+        Message.objects.filter(conversation_id=conversation_id)
+        .filter(Q(timestamp__gt=anchor) | Q(timestamp=anchor, id__gt=since_id))
+        .order_by("timestamp", "id")
+        .values_list("id", "sender__username", "content", "timestamp")[: limit + 1]
+    )
+    complete = len(missed) <= limit
+    return [
+        {"id": str(message_id), "sender": sender, "content": content, "timestamp": timestamp.isoformat()}
+        for message_id, sender, content, timestamp in missed[:limit]
+    ], complete
+
+
+class ResumeTracker:
+    """Per-connection bookkeeping that keeps a resumed stream free of duplicates.
+
+    The socket joins its group before the missed messages are loaded, so a message can show up both in the replay
+    and as a live event; live events already covered by the replay are skipped. A client that resumes with a first
+    frame instead of the query string may also have been sent live messages before that frame arrived, those are
+    left out of the replay.
+    """
+
+    def __init__(self, limit=None):
+        self.resumed = False
+        self.replayed_ids = set()
+        self.live_ids = deque(maxlen=limit or settings.WEBCHAT_REPLAY_LIMIT)
+
+    def should_send(self, message_id):
+        # ids are compared as sent, strings, whatever a worker still running older code put in its events
+        message_id = str(message_id)
+        if message_id in self.replayed_ids:
+            return False
+        if not self.resumed:
+            self.live_ids.append(message_id)
+        return True
+
+    def replay(self, messages):
+        self.resumed = True
+        sent = set(self.live_ids)
+        self.live_ids.clear()
+        messages = [message for message in messages if str(message["id"]) not in sent]
+        self.replayed_ids = {str(message["id"]) for message in messages}
+        return messages
+
+
+def resume_from_scope(scope):
+    """Reads ``since`` (or ``last_message_id``) from the websocket URL's query string."""
+    params = parse_qs(scope.get("query_string", b"").decode())
+    value = (params.get("since") or params.get("last_message_id") or [None])[0]
+    return parse_since(value)
@@ -1,16 +1,120 @@
 from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import OpenApiParameter, extend_schema
 
-from .serializers import MessageSerializer
+from .serializers import (
+    MessagePageSerializer,
+    MessageSearchPageSerializer,
+    OnlineMemberSerializer,
+    PopularChannelSerializer,
+    PopularServerSerializer,
+    UnreadCountSerializer,
+    WebsocketTokenSerializer,
+)
 
 list_message_docs = extend_schema(
-    responses=MessageSerializer(many=True),
+    responses=MessagePageSerializer,
     parameters=[
         OpenApiParameter(
             name="channel_id",
             type=OpenApiTypes.STR,
             location=OpenApiParameter.QUERY,
             description="ID of the channel",
-        )
+        ),
+        OpenApiParameter(
+            name="before",
+            type=OpenApiTypes.STR,
+            location=OpenApiParameter.QUERY,
+            description="Cursor returned as `before`, fetches the page of messages older than it",
+        ),
+        OpenApiParameter(
+            name="after",
+            type=OpenApiTypes.STR,
+            location=OpenApiParameter.QUERY,
+            description="Cursor returned as `after`, fetches the page of messages newer than it",
+        ),
+        OpenApiParameter(
+            name="limit",
+            type=OpenApiTypes.INT,
+            location=OpenApiParameter.QUERY,
+            description="Number of messages per page (default 50, max 200)",
+        ),
+    ],
+)
+
+search_message_docs = extend_schema(
+    responses=MessageSearchPageSerializer,
+    parameters=[
+        OpenApiParameter(
+            name="q",
+            type=OpenApiTypes.STR,
+            location=OpenApiParameter.QUERY,
+            required=True,
+            description="Words to look for, messages have to contain all of them and the last one may be a prefix",
+        ),
+        OpenApiParameter(
+            name="channel_id",
+            type=OpenApiTypes.STR,
+            location=OpenApiParameter.QUERY,
+            description="Search the messages of this channel",
+        ),
+        OpenApiParameter(
+            name="server_id",
+            type=OpenApiTypes.INT,
+            location=OpenApiParameter.QUERY,
+            description="Search the messages of every channel of this server, used when channel_id is not given",
+        ),
+        OpenApiParameter(
+            name="limit",
+            type=OpenApiTypes.INT,
+            location=OpenApiParameter.QUERY,
+            description="Number of results per page (default 20, max 100)",
+        ),
+        OpenApiParameter(
+            name="offset",
+            type=OpenApiTypes.INT,
+            location=OpenApiParameter.QUERY,
+            description="Number of results to skip, `next_offset` of the previous page",
+        ),
+    ],
+)
+
+websocket_token_docs = extend_schema(responses=WebsocketTokenSerializer)
+
+online_members_docs = extend_schema(responses=OnlineMemberSerializer(many=True))
+
+unread_counts_docs = extend_schema(
+    responses=UnreadCountSerializer(many=True),
+    parameters=[
+        OpenApiParameter(
+            name="server_id",
+            type=OpenApiTypes.INT,
+            location=OpenApiParameter.QUERY,
+            description="Only count the channels of this server, otherwise those of every server of the user",
+        ),
+    ],
+)
+
+popular_limit_parameter = OpenApiParameter(
+    name="limit",
+    type=OpenApiTypes.INT,
+    location=OpenApiParameter.QUERY,
+    description="Number of results (default 10, max 50)",
+)
+
+popular_servers_docs = extend_schema(
+    responses=PopularServerSerializer(many=True),
+    parameters=[popular_limit_parameter],
+)
+
+popular_channels_docs = extend_schema(
+    responses=PopularChannelSerializer(many=True),
+    parameters=[
+        OpenApiParameter(
+            name="server_id",
+            type=OpenApiTypes.INT,
+            location=OpenApiParameter.QUERY,
+            description="Only rank the channels of this server, otherwise those of every server of the user",
+        ),
+        popular_limit_parameter,
     ],
 )
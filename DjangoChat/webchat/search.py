@@ -0,0 +1,104 @@
+import re
+
+from django.db import NotSupportedError, connection, transaction
+
+# words of the query, anything else (quotes, operators, punctuation) is dropped so user input can't form an invalid
+# or expensive full-text query
+TERM_RE = re.compile(r"\w+")
+MAX_TERMS = 10
+
+
+def search_terms(text):
+    return TERM_RE.findall(text or "")[:MAX_TERMS]
+
+
+def search_messages(text, conversation_ids, limit, offset=0):
+    """Returns ``(message id, rank)`` pairs of the messages matching every word of ``text``, best match first.
+
+    Only messages of ``conversation_ids`` are searched and the last word also matches as a prefix, so results show
+    up while the user is still typing. Higher ranks are better on every database.
+    """
+    terms = search_terms(text)
+    conversation_ids = list(conversation_ids)
+    if not terms or not conversation_ids:
+        return []
+    placeholders = ", ".join(["%s"] * len(conversation_ids))
+
+    if connection.vendor == "sqlite":
+        # quoting keeps words like AND, OR or NEAR from being read as FTS5 operators
+        match = " ".join(f'"{term}"' for term in terms) + "*"
+        sql = f"""
+            SELECT m.id, -bm25(webchat_message_fts) AS rank
+            FROM webchat_message_fts JOIN webchat_message m ON m.id = webchat_message_fts.rowid
+            WHERE webchat_message_fts MATCH %s AND m.conversation_id IN ({placeholders})
+            ORDER BY rank DESC, m.id DESC LIMIT %s OFFSET %s
+        """
+    elif connection.vendor == "postgresql":
+        match = " & ".join(terms) + ":*"
+        sql = f"""
+            SELECT m.id, ts_rank(m.search_vector, query) AS rank
+            FROM webchat_message m, to_tsquery('simple', %s) query
+            WHERE m.search_vector @@ query AND m.conversation_id IN ({placeholders})
+            ORDER BY rank DESC, m.id DESC LIMIT %s OFFSET %s
+        """
+    else:
+        raise NotSupportedError(f"Message search is not available on {connection.vendor}")
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [match, *conversation_ids, limit, offset])
+        return cursor.fetchall()
+
+
+def rebuild_search_index(batch_size=1000, optimize=False, progress=None):
+    """Brings the full-text index back in line with the messages table.
+
+    On SQLite every message is indexed again and entries of deleted messages are removed, one short transaction per
+    ``batch_size`` rows, so the messages table is never locked for longer than a batch and searches keep working
+    while the rebuild runs. ``progress`` is called with the number of rows handled after every batch. On PostgreSQL
+    the index is derived from a generated column and can't drift, it is only rebuilt concurrently.
+    """
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("REINDEX INDEX CONCURRENTLY webchat_message_search_idx")
+        return {"indexed": 0, "removed": 0}
+    if connection.vendor != "sqlite":
+        raise NotSupportedError(f"Message search is not available on {connection.vendor}")
+
+    indexed = removed = 0
+    last_id = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT id, content FROM webchat_message WHERE id > %s ORDER BY id LIMIT %s", [last_id, batch_size]
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            # REPLACE makes it safe to overlap with the triggers indexing new messages meanwhile
+            cursor.executemany("INSERT OR REPLACE INTO webchat_message_fts(rowid, content) VALUES (%s, %s)", rows)
+        last_id = rows[-1][0]
+        indexed += len(rows)
+        if progress:
+            progress(indexed)
+
+    last_id = 0
+    while True:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT rowid FROM webchat_message_fts WHERE rowid > %s ORDER BY rowid LIMIT %s", [last_id, batch_size]
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                break
+            cursor.execute("SELECT id FROM webchat_message WHERE id >= %s AND id <= %s", [ids[0], ids[-1]])
+            existing = {row[0] for row in cursor.fetchall()}
+            stale = [(message_id,) for message_id in ids if message_id not in existing]
+            cursor.executemany("DELETE FROM webchat_message_fts WHERE rowid = %s", stale)
+        last_id = ids[-1]
+        removed += len(stale)
+
+    if optimize:
+        # merges the index segments, only locks the index table
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO webchat_message_fts(webchat_message_fts) VALUES ('optimize')")
+    return {"indexed": indexed, "removed": removed}
@@ -1,11 +1,71 @@
 from rest_framework import serializers
+from server.models import Channel
+from server.serializer import ServerSearchResultSerializer
 
 from .models import Message
 
 
 class MessageSerializer(serializers.ModelSerializer):
+    id = serializers.CharField(
+        read_only=True, help_text="64 bit message id as a decimal string, too big for a JavaScript number"
+    )
     sender = serializers.StringRelatedField()
 
     class Meta:
         model = Message
         fields = ["id", "sender", "content", "timestamp"]
+
+
+class MessagePageSerializer(serializers.Serializer):
+    before = serializers.CharField(allow_null=True, help_text="Cursor for the previous (older) page")
+    after = serializers.CharField(allow_null=True, help_text="Cursor for the next (newer) page")
+    results = MessageSerializer(many=True)
+
+
+class MessageSearchResultSerializer(MessageSerializer):
+    channel_id = serializers.CharField(source="conversation.channel_id", read_only=True)
+    rank = serializers.FloatField(read_only=True, help_text="Relevance of the match, higher is better")
+
+    class Meta(MessageSerializer.Meta):
+        fields = MessageSerializer.Meta.fields + ["channel_id", "rank"]
+
+
+class MessageSearchPageSerializer(serializers.Serializer):
+    next_offset = serializers.IntegerField(allow_null=True, help_text="Offset of the next page of results")
+    results = MessageSearchResultSerializer(many=True)
+
+
+class WebsocketTokenSerializer(serializers.Serializer):
+    token = serializers.CharField(help_text="Pass as ?token= when opening the chat websocket")
+    expires_in = serializers.IntegerField(help_text="Seconds the token stays valid for new sockets")
+
+
+class OnlineMemberSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    username = serializers.CharField()
+
+
+class UnreadCountSerializer(serializers.Serializer):
+    channel_id = serializers.IntegerField()
+    server_id = serializers.IntegerField()
+    unread = serializers.IntegerField(help_text="Unread messages, counted up to WEBCHAT_UNREAD_CAP (99)")
+    capped = serializers.BooleanField(help_text="There are more unread messages than counted, show e.g. 99+")
+
+
+class PopularServerSerializer(ServerSearchResultSerializer):
+    activity = serializers.FloatField(
+        read_only=True, help_text="Recent messages, each counting half as much per half life that passed since"
+    )
+
+    class Meta(ServerSearchResultSerializer.Meta):
+        fields = ServerSearchResultSerializer.Meta.fields + ("activity",)
+
+
+class PopularChannelSerializer(serializers.ModelSerializer):
+    activity = serializers.FloatField(
+        read_only=True, help_text="Recent messages, each counting half as much per half life that passed since"
+    )
+
+    class Meta:
+        model = Channel
+        fields = ("id", "name", "topic", "server", "activity")
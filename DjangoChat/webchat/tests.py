@@ -0,0 +1,859 @@
+import asyncio
+import base64
+import json
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from channels.routing import URLRouter
+from channels.sessions import SessionMiddlewareStack
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import path
+from django.utils import timezone
+from DjangoChat.benchmarks import WebsocketClient
+from DjangoChat.urls import websocket_urlpatterns
+from server.models import Category, Channel, Server
+
+from . import frames
+from .activity import ActivityTracker
+from .auth import WebsocketAuthMiddleware, credential_cache, issue_token
+from .cache import conversation_cache
+from .consumer import (
+    AsyncWebChatConsumer,
+    MultiplexWebChatConsumer,
+    WebChatConsumer,
+    message_event,
+    packed_message,
+    publish_message,
+    record_event,
+)
+from .metrics import QueryCounter
+from .models import Conversation, Message
+from .outbound import DISCONNECT, DROP_OLDEST, OutboundQueue
+from .presence import lifespan, presence, server_group
+from .replay import ResumeTracker, load_missed_messages
+from .recent import RecentMessages, recent_messages
+from .unread import latest_key, latest_message_ids, messages_written
+from .persistence import (
+    SEQUENCE_BITS,
+    WORKER_ID_BITS,
+    MessageIdGenerator,
+    MessageWriteBehindQueue,
+    message_ids,
+    message_writer,
+    stop_background_writers,
+)
+
+User = get_user_model()
+
+
+class MessageWriteBehindQueueTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="alice")
+        self.conversation = Conversation.objects.create(channel_id="1")
+        self.ids = MessageIdGenerator(worker_id=0)
+
+    def message(self, message_id=None):
+        return Message(
+            id=message_id or self.ids.next_id(),
+            conversation=self.conversation,
+            sender=self.user,
+            content="hi",
+            timestamp=timezone.now(),
+        )
+
+    def test_failing_batch_only_loses_the_bad_message(self):
+        taken = self.message()
+        taken.save()
+        batch = [self.message(), self.message(taken.id), self.message()]
+        writer = MessageWriteBehindQueue(retries=1)
+        with self.assertLogs("webchat.persistence", "WARNING"):
+            writer._write(batch)
+        self.assertEqual(Message.objects.count(), 3)
+        self.assertTrue(Message.objects.filter(id=batch[0].id).exists())
+        self.assertTrue(Message.objects.filter(id=batch[2].id).exists())
+
+
+class MessageIdGeneratorTests(TestCase):
+    @override_settings(WEBCHAT_WORKER_ID="5")
+    def test_worker_id_from_settings(self):
+        message_id = MessageIdGenerator().next_id()
+        self.assertEqual((message_id >> SEQUENCE_BITS) & ((1 << WORKER_ID_BITS) - 1), 5)
+
+    @override_settings(WEBCHAT_WORKER_ID=None, WEBCHAT_WORKER_ID_REDIS_URL="redis://127.0.0.1:1/0")
+    def test_unallocated_worker_id_fails(self):
+        with self.assertRaises(ImproperlyConfigured):
+            MessageIdGenerator().next_id()
+
+
+class RecentMessagesTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="alice")
+        self.conversation = Conversation.objects.create(channel_id="1")
+
+    def test_buffer_is_not_seeded_before_other_workers_wrote(self):
+        recent = RecentMessages(seed_delay=60)
+        recent.subscribe("1")
+        # broadcast by another worker before the subscription, written by it after
+        Message.objects.create(conversation=self.conversation, sender=self.user, content="late")
+        self.assertIsNone(recent.latest("1", 10))
+
+        recent.seed_delay = 0
+        messages, more = recent.latest("1", 10)
+        self.assertEqual([message.content for message in messages], ["late"])
+
+
+class ResumeTrackerTests(SimpleTestCase):
+    """Whatever order the replay and the live events come in, each message is sent once."""
+
+    def setUp(self):
+        self.resume = ResumeTracker(limit=10)
+        self.sent = []
+
+    def live(self, message_id):
+        if self.resume.should_send(message_id):
+            self.sent.append(str(message_id))
+
+    def replay(self, *message_ids):
+        self.sent.extend(message["id"] for message in self.resume.replay([{"id": str(id)} for id in message_ids]))
+
+    def test_live_event_before_the_replay(self):
+        # a client resuming with a first frame was sent message 3 before asking for what it missed
+        self.live(3)
+        self.replay(1, 2, 3)
+        self.live(4)
+        self.assertEqual(self.sent, ["3", "1", "2", "4"])
+
+    def test_live_event_after_the_replay(self):
+        # the socket joined its group before the replay was loaded, so message 3 is broadcast after it too
+        self.replay(1, 2, 3)
+        self.live(3)
+        self.live(4)
+        self.assertEqual(self.sent, ["1", "2", "3", "4"])
+
+    def test_ids_compare_whatever_their_type(self):
+        # a worker still running older code puts integer ids in its events
+        self.live(3)
+        self.sent.extend(message["id"] for message in self.resume.replay([{"id": "3"}, {"id": "4"}]))
+        self.live(4)
+        self.assertEqual(self.sent, ["3", "4"])
+
+
+class FrameTests(SimpleTestCase):
+    # a snowflake id from late in the id space, multi-byte text and a timestamp with microseconds
+    message = (
+        2**62 + 12345,
+        "zoë 🦊",
+        "héllo wörld, 你好 👋",
+        datetime(2031, 5, 17, 8, 30, 12, 654321, tzinfo=dt_timezone.utc),
+    )
+
+    def array(self, message_id, sender, content, timestamp):
+        return [str(message_id), sender, content, frames.timestamp_us(timestamp)]
+
+    def test_message_frame_round_trips(self):
+        packed = frames.pack_message(*self.message)
+        self.assertEqual(
+            frames.unpack(frames.message_frame(packed)),
+            {"type": "chat.message", "new_message": self.array(*self.message)},
+        )
+        self.assertEqual(
+            frames.unpack(frames.message_frame(packed, "42")),
+            {"type": "chat.message", "channel_id": "42", "new_message": self.array(*self.message)},
+        )
+
+    def test_batch_frame_round_trips(self):
+        messages = [self.message, (1, "a", "", self.message[3] - timedelta(days=3000))]
+        frame = frames.batch_frame([frames.pack_message(*message) for message in messages], 7)
+        self.assertEqual(
+            frames.unpack(frame),
+            {"type": "chat.batch", "messages": [self.array(*message) for message in messages], "dropped": 7},
+        )
+
+    def test_timestamps_keep_their_microseconds(self):
+        timestamp = self.message[3]
+        microseconds = frames.timestamp_us(timestamp)
+        self.assertEqual(frames.EPOCH + timedelta(microseconds=microseconds), timestamp)
+        self.assertEqual(frames.timestamp_us(timestamp.isoformat()), microseconds)
+
+    def test_other_frames_round_trip(self):
+        message_id, sender, content, timestamp = self.message
+        as_dict = {"id": message_id, "sender": sender, "content": content, "timestamp": timestamp.isoformat()}
+        replay = {"type": "chat.replay", "messages": [as_dict], "complete": True}
+        self.assertEqual(frames.unpack(frames.pack(replay)), {**replay, "messages": [self.array(*self.message)]})
+        typing = {"type": "chat.typing", "user": "zoë 🦊", "server_id": 2**40}
+        self.assertEqual(frames.unpack(frames.pack(typing)), typing)
+
+
+class MessageKeysetPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username="alice")
+        conversation = Conversation.objects.create(channel_id="1")
+        start = timezone.now()
+        # (id, seconds after start): ids don't follow the timestamps, and several messages share one
+        rows = [(70, 0), (20, 0), (10, 0), (60, 1), (30, 1), (50, 2), (40, 3)]
+        for message_id, seconds in rows:
+            Message.objects.create(
+                id=message_id,
+                conversation=conversation,
+                sender=self.user,
+                content=str(message_id),
+                timestamp=start + timedelta(seconds=seconds),
+            )
+        # what every page has to line up with: by timestamp, then by id
+        self.ordered = [str(message_id) for message_id, _ in sorted(rows, key=lambda row: (row[1], row[0]))]
+
+    def page(self, **params):
+        response = self.client.get("/api/messages/", {"channel_id": "1", "limit": 3, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def ids(self, page):
+        return [message["id"] for message in page["results"]]
+
+    def test_walking_back_and_forth_visits_every_message_once(self):
+        newest = self.page()
+        self.assertEqual(self.ids(newest), self.ordered[-3:])
+        self.assertIsNone(newest["after"])
+
+        older = self.page(before=newest["before"])
+        self.assertEqual(self.ids(older), self.ordered[1:4])
+        oldest = self.page(before=older["before"])
+        self.assertEqual(self.ids(oldest), self.ordered[:1])
+        self.assertIsNone(oldest["before"])
+
+        newer = self.page(after=oldest["after"])
+        self.assertEqual(self.ids(newer), self.ordered[1:4])
+        last = self.page(after=newer["after"])
+        self.assertEqual(self.ids(last), self.ordered[4:])
+        self.assertIsNone(last["after"])
+
+    def test_bad_parameters_are_rejected(self):
+        cursor = self.page()["before"]
+        for params in (
+            {"before": "not a cursor"},
+            {"after": base64.urlsafe_b64encode(b"yesterday|1").decode()},
+            {"limit": 0},
+            {"limit": "ten"},
+            {"before": cursor, "after": cursor},
+        ):
+            with self.subTest(**params):
+                response = self.client.get("/api/messages/", {"channel_id": "1", **params})
+                self.assertEqual(response.status_code, 400)
+
+
+class OutboundQueueTests(SimpleTestCase):
+    def test_messages_within_the_window_come_as_one_batch(self):
+        outbound = OutboundQueue(10)
+
+        async def run():
+            batch = asyncio.ensure_future(outbound.get_batch(0.05, 10))
+            outbound.put("a")
+            await asyncio.sleep(0.01)
+            outbound.put("b")
+            outbound.put("c")
+            return await batch
+
+        self.assertEqual(async_to_sync(run)(), ["a", "b", "c"])
+        self.assertEqual(len(outbound), 0)
+
+    def test_drop_oldest_counts_what_it_dropped(self):
+        outbound = OutboundQueue(2, DROP_OLDEST)
+        for item in "abcd":
+            self.assertTrue(outbound.put(item))
+        self.assertEqual(outbound.dropped, 2)
+        self.assertEqual(async_to_sync(outbound.get_batch)(0, 10), ["c", "d"])
+
+    def test_disconnect_refuses_once_full(self):
+        outbound = OutboundQueue(2, DISCONNECT)
+        self.assertTrue(outbound.put("a"))
+        self.assertTrue(outbound.put("b"))
+        self.assertFalse(outbound.put("c"))
+        self.assertEqual(outbound.dropped, 0)
+        self.assertEqual(async_to_sync(outbound.get_batch)(0, 10), ["a", "b"])
+
+    def test_batches_are_capped(self):
+        outbound = OutboundQueue(10)
+        for item in "abc":
+            outbound.put(item)
+        self.assertEqual(async_to_sync(outbound.get_batch)(0, 2), ["a", "b"])
+        self.assertEqual(async_to_sync(outbound.get_batch)(0, 2), ["c"])
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            OutboundQueue(1, "block")
+
+
+class MessageIdTests(TestCase):
+    """Message ids take 64 bits, clients read every JSON number as a double, which holds 53."""
+
+    def setUp(self):
+        cache.clear()
+        conversation_cache.clear()
+        self.user = User.objects.create(username="alice")
+        self.server = Server.objects.create(
+            name="server", owner=self.user, category=Category.objects.create(name="category")
+        )
+        self.server.member.add(self.user)
+        self.channel = Channel.objects.create(name="channel", topic="topic", owner=self.user, server=self.server)
+        self.conversation = Conversation.objects.create(channel_id=str(self.channel.id))
+        # consecutive ids, as a double they'd nearly always come out the same
+        first = message_ids.next_id()
+        self.messages = [
+            Message.objects.create(id=first + i, conversation=self.conversation, sender=self.user, content=str(i))
+            for i in range(2)
+        ]
+        self.ids = [str(message.id) for message in self.messages]
+
+    def parse(self, text):
+        # the way JSON.parse reads it
+        return json.loads(text, parse_int=float)
+
+    def test_history_ids_survive_a_double(self):
+        self.client.force_login(self.user)
+        response = self.client.get("/api/messages/", {"channel_id": self.channel.id})
+        self.assertEqual([message["id"] for message in self.parse(response.content)["results"]], self.ids)
+
+    def test_frame_ids_survive_a_double(self):
+        for message in self.messages:
+            event = message_event(self.channel.id, message.id, "alice", message.content, message.timestamp)
+            self.assertEqual(self.parse(event["encoded"])["id"], str(message.id))
+            self.assertEqual(frames.unpack(packed_message(event))[0], str(message.id))
+        missed, _ = load_missed_messages(self.conversation.id, self.messages[0].id)
+        replay = self.parse(json.dumps({"type": "chat.replay", "messages": missed}))
+        self.assertEqual([message["id"] for message in replay["messages"]], self.ids[1:])
+
+
+class MessageEventTests(SimpleTestCase):
+    def setUp(self):
+        recent_messages.subscribe("events")
+        self.addCleanup(recent_messages.unsubscribe, "events")
+
+    def test_only_other_workers_broadcasts_are_recorded(self):
+        own = message_event("events", 1, "alice", "mine", timezone.now())
+        record_event("events", own)
+        self.assertEqual(recent_messages.stats()["messages"], 0)
+
+        # the same broadcast as every local socket of the channel hands it over
+        remote = {**message_event("events", 2, "bob", "theirs", timezone.now()), "origin": "another worker"}
+        for _ in range(3):
+            record_event("events", dict(remote))
+        self.assertEqual(recent_messages.stats()["messages"], 1)
+
+    def test_messages_are_packed_on_demand(self):
+        event = message_event("events", 1, "alice", "hi", timezone.now())
+        self.assertNotIn("packed", event)
+        self.assertEqual(
+            packed_message(event), frames.pack_message(1, "alice", "hi", event["new_message"]["timestamp"])
+        )
+
+
+class MessageSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.member = User.objects.create(username="alice")
+        self.stranger = User.objects.create(username="mallory")
+        self.server = Server.objects.create(
+            name="server", owner=self.member, category=Category.objects.create(name="category")
+        )
+        self.server.member.add(self.member)
+        self.channel = Channel.objects.create(name="channel", topic="topic", owner=self.member, server=self.server)
+        conversation = Conversation.objects.create(channel_id=str(self.channel.id))
+        Message.objects.create(conversation=conversation, sender=self.member, content="the secret plan")
+
+    def search(self, user, **params):
+        if user is not None:
+            self.client.force_login(user)
+        return self.client.get("/api/messages/search/", {"q": "secret", **params})
+
+    def test_members_find_messages(self):
+        for params in ({"channel_id": self.channel.id}, {"server_id": self.server.id}):
+            response = self.search(self.member, **params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([message["content"] for message in response.json()["results"]], ["the secret plan"])
+
+    def test_others_are_refused(self):
+        for user in (self.stranger, None):
+            for params in ({"channel_id": self.channel.id}, {"server_id": self.server.id}):
+                with self.subTest(user=user, **params):
+                    self.client.logout()
+                    self.assertEqual(self.search(user, **params).status_code, 403)
+
+
+class PopularChannelsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.member = User.objects.create(username="alice")
+        self.stranger = User.objects.create(username="mallory")
+        category = Category.objects.create(name="category")
+        owner = User.objects.create(username="owner")
+        self.servers = [Server.objects.create(name=name, owner=owner, category=category) for name in "ab"]
+        self.servers[0].member.add(self.member)
+        self.channels = [
+            Channel.objects.create(name=f"secret {server.name}", topic="topic", owner=owner, server=server)
+            for server in self.servers
+        ]
+        tracker = ActivityTracker()
+        for channel in self.channels:
+            tracker.record(str(channel.id))
+        tracker.checkpoint()
+
+    def popular(self, user, **params):
+        self.client.logout()
+        if user is not None:
+            self.client.force_login(user)
+        return self.client.get("/api/popular/channels/", params)
+
+    def test_members_only_see_their_servers(self):
+        for params in ({}, {"server_id": self.servers[0].id}):
+            response = self.popular(self.member, **params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([channel["id"] for channel in response.json()], [self.channels[0].id])
+        self.assertEqual(self.popular(self.stranger).json(), [])
+
+    def test_others_are_refused(self):
+        self.assertEqual(self.popular(self.stranger, server_id=self.servers[0].id).status_code, 403)
+        self.assertEqual(self.popular(None).status_code, 403)
+        self.assertEqual(self.popular(None, server_id=self.servers[0].id).status_code, 403)
+
+
+class PresenceTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username="alice")
+        self.server = Server.objects.create(
+            name="server", owner=self.user, category=Category.objects.create(name="category")
+        )
+        # as if another process had reported the user
+        presence.apply("another process", self.server.id, self.user.id, "alice", True)
+        self.addCleanup(presence.apply, "another process", self.server.id, self.user.id, "alice", False)
+
+    def test_online_members_come_from_the_replica(self):
+        self.client.force_login(self.user)
+        with mock.patch.object(presence, "ensure_listening") as ensure_listening:
+            response = self.client.get(f"/api/presence/{self.server.id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{"id": self.user.id, "username": "alice"}])
+        ensure_listening.assert_not_called()
+
+    def test_lifespan_runs_the_listener(self):
+        async def run():
+            communicator = ApplicationCommunicator(lifespan, {"type": "lifespan"})
+            await communicator.send_input({"type": "lifespan.startup"})
+            self.assertEqual(await communicator.receive_output(), {"type": "lifespan.startup.complete"})
+            self.assertFalse(presence._listener.done())
+            await communicator.send_input({"type": "lifespan.shutdown"})
+            self.assertEqual(await communicator.receive_output(), {"type": "lifespan.shutdown.complete"})
+            self.assertIsNone(presence._listener)
+
+        async_to_sync(run)()
+
+
+class UnreadCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        conversation_cache.clear()
+        self.member = User.objects.create(username="alice")
+        self.stranger = User.objects.create(username="mallory")
+        owner = User.objects.create(username="owner")
+        category = Category.objects.create(name="category")
+        self.servers = [Server.objects.create(name=name, owner=owner, category=category) for name in "ab"]
+        self.servers[0].member.add(self.member)
+        self.channels = []
+        for server in self.servers:
+            channel = Channel.objects.create(name="channel", topic="topic", owner=owner, server=server)
+            conversation = Conversation.objects.create(channel_id=str(channel.id))
+            Message.objects.create(id=message_ids.next_id(), conversation=conversation, sender=owner, content="hi")
+            self.channels.append(channel)
+
+    def unread(self, user, **params):
+        self.client.logout()
+        if user is not None:
+            self.client.force_login(user)
+        return self.client.get("/api/unread/", params)
+
+    def test_members_get_the_badges_of_their_servers(self):
+        for params in ({}, {"server_id": self.servers[0].id}):
+            response = self.unread(self.member, **params)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([badge["channel_id"] for badge in response.json()], [self.channels[0].id])
+        self.assertEqual(self.unread(self.stranger).json(), [])
+
+    def test_others_are_refused(self):
+        for server in self.servers[1:]:
+            self.assertEqual(self.unread(self.member, server_id=server.id).status_code, 403)
+        self.assertEqual(self.unread(self.stranger, server_id=self.servers[0].id).status_code, 403)
+        self.assertEqual(self.unread(None).status_code, 403)
+
+    def test_lookup_keeps_a_newer_cached_id(self):
+        conversation = Conversation.objects.get(channel_id=str(self.channels[0].id))
+        newest = Message.objects.get(conversation=conversation).id
+        # a writer caches a message written after the lookup missed the cache and ran its query
+        messages_written([Message(id=newest + 1, conversation=conversation)])
+        with mock.patch.object(cache, "get_many", return_value={}):
+            self.assertEqual(latest_message_ids([conversation.id]), {conversation.id: newest + 1})
+        self.assertEqual(latest_message_ids([conversation.id]), {conversation.id: newest + 1})
+        # a miss on its own caches what the query found
+        cache.clear()
+        self.assertEqual(latest_message_ids([conversation.id]), {conversation.id: newest})
+        self.assertEqual(cache.get(latest_key(conversation.id)), newest)
+
+
+class CountingConsumer(WebChatConsumer):
+    """Keeps the queries of every frame it received, counted on the thread that handled it."""
+
+    def receive_json(self, content):
+        with QueryCounter() as queries:
+            super().receive_json(content)
+        self.scope["frame_queries"].append(queries.count)
+
+
+class ChatSocketMixin:
+    def setUp(self):
+        cache.clear()
+        conversation_cache.clear()
+        credential_cache.clear()
+        self.user = User.objects.create(username="alice")
+        self.server = Server.objects.create(
+            name="server", owner=self.user, category=Category.objects.create(name="category")
+        )
+        self.server.member.add(self.user)
+        self.channel = Channel.objects.create(name="channel", topic="topic", owner=self.user, server=self.server)
+
+    def tearDown(self):
+        # read watermarks and activity of the messages sent, while their rows are still there
+        stop_background_writers()
+
+    def client_for(self, application, path, subprotocols=None):
+        return WebsocketClient(
+            application, path, f"token={issue_token(self.user)}".encode(), subprotocols=subprotocols
+        )
+
+    def chat_application(self, consumer=WebChatConsumer, **scope):
+        """Routes chat sockets to ``consumer`` with the user already in the scope, plus ``scope``."""
+        application = URLRouter([path("<str:serverId>/<str:channelId>", consumer.as_asgi())])
+
+        async def scoped(connection_scope, receive, send):
+            return await application({**connection_scope, "user": self.user, **scope}, receive, send)
+
+        return scoped
+
+
+# the consumers use the database from other threads, which only see committed rows
+class WebChatConsumerQueryTests(ChatSocketMixin, TransactionTestCase):
+    def send_one_message(self):
+        frame_queries = []
+        application = self.chat_application(CountingConsumer, frame_queries=frame_queries)
+
+        async def chat():
+            client = self.client_for(application, f"/{self.server.id}/{self.channel.id}")
+            self.assertTrue(await client.connect())
+            await client.send_json({"message": "hello"})
+            frame = await client.receive_json()
+            await client.disconnect()
+            return frame
+
+        frame = async_to_sync(chat)()
+        self.assertEqual(frame["new_message"]["content"], "hello")
+        return frame_queries
+
+    @override_settings(WEBCHAT_WRITE_BEHIND=False)
+    def test_message_is_a_single_insert(self):
+        self.assertEqual(self.send_one_message(), [1])
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_messages_share_one_id_scheme(self):
+        # the write-behind queue, the sync consumer without it, and the async consumer's publish_message
+        with override_settings(WEBCHAT_WRITE_BEHIND=True):
+            self.send_one_message()
+        with override_settings(WEBCHAT_WRITE_BEHIND=False):
+            self.send_one_message()
+        message_writer.flush()
+        async_to_sync(publish_message)(
+            InMemoryChannelLayer(), str(self.channel.id), Message.objects.first().conversation_id, self.user, "async"
+        )
+        message_writer.flush()
+        ids = list(Message.objects.order_by("timestamp").values_list("id", flat=True))
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(ids, sorted(ids))
+        self.assertTrue(all(message_id >> (WORKER_ID_BITS + SEQUENCE_BITS) for message_id in ids))
+
+    @override_settings(WEBCHAT_WRITE_BEHIND=True)
+    def test_write_behind_message_runs_no_query(self):
+        self.assertEqual(self.send_one_message(), [0])
+        message_writer.flush()
+        self.assertEqual(Message.objects.count(), 1)
+
+
+class WebsocketAuthTests(ChatSocketMixin, TransactionTestCase):
+    """Sockets that can't be authenticated or aren't allowed in are closed before they are accepted."""
+
+    def first_output(self, path, query_string=b""):
+        application = SessionMiddlewareStack(WebsocketAuthMiddleware(URLRouter(websocket_urlpatterns)))
+
+        async def connect():
+            client = WebsocketClient(application, path, query_string)
+            await client.communicator.send_input({"type": "websocket.connect"})
+            output = await client.communicator.receive_output(5)
+            await client.disconnect()
+            return output
+
+        return async_to_sync(connect)()
+
+    def paths(self):
+        # a single channel's socket and the multiplexed one of the whole server
+        return (f"/{self.server.id}/{self.channel.id}", f"/{self.server.id}")
+
+    def assertClosed(self, code, query_string=b""):
+        for path in self.paths():
+            with self.subTest(path=path):
+                self.assertEqual(self.first_output(path, query_string), {"type": "websocket.close", "code": code})
+
+    def test_member_with_a_token_is_accepted(self):
+        for path in self.paths():
+            with self.subTest(path=path):
+                output = self.first_output(path, f"token={issue_token(self.user)}".encode())
+                self.assertEqual(output["type"], "websocket.accept")
+
+    def test_missing_token(self):
+        self.assertClosed(4001)
+
+    def test_forged_token(self):
+        token = issue_token(self.user)
+        payload, signature = token.rsplit(":", 1)
+        self.assertClosed(4001, f"token={payload}:{signature[::-1]}".encode())
+        # a token signed for another user id
+        other = issue_token(User(id=self.user.id + 1, username="mallory")).rsplit(":", 1)[0]
+        self.assertClosed(4001, f"token={other}:{signature}".encode())
+
+    def test_expired_token(self):
+        with override_settings(WEBCHAT_TOKEN_MAX_AGE=-1):
+            token = issue_token(self.user)
+        self.assertClosed(4001, f"token={token}".encode())
+
+    def test_non_member_is_refused(self):
+        mallory = User.objects.create(username="mallory")
+        self.assertClosed(4003, f"token={issue_token(mallory)}".encode())
+
+
+class MultiplexConsumerTests(ChatSocketMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.other_channel = Channel.objects.create(name="other", topic="topic", owner=self.user, server=self.server)
+
+    def connect(self, server_id=None):
+        application = URLRouter([path("<str:serverId>", MultiplexWebChatConsumer.as_asgi())])
+
+        async def scoped(scope, receive, send):
+            return await application({**scope, "user": self.user}, receive, send)
+
+        return self.client_for(scoped, f"/{server_id or self.server.id}")
+
+    async def receive(self, client):
+        # presence updates can come in between
+        while True:
+            frame = await client.receive_json()
+            if frame["type"] != "presence":
+                return frame
+
+    def test_subscribe_send_and_unsubscribe(self):
+        channel_id = str(self.channel.id)
+
+        async def chat():
+            client = self.connect()
+            self.assertTrue(await client.connect())
+            await client.send_json({"type": "subscribe", "channel_id": channel_id})
+            self.assertEqual(await self.receive(client), {"type": "subscribed", "channel_id": channel_id})
+            await client.send_json({"type": "message", "channel_id": channel_id, "message": "hello"})
+            message = await self.receive(client)
+            await client.send_json({"type": "unsubscribe", "channel_id": channel_id})
+            unsubscribed = await self.receive(client)
+            await client.send_json({"type": "message", "channel_id": channel_id, "message": "gone"})
+            error = await self.receive(client)
+            await client.disconnect()
+            return message, unsubscribed, error
+
+        message, unsubscribed, error = async_to_sync(chat)()
+        self.assertEqual(message["channel_id"], channel_id)
+        self.assertEqual(message["new_message"]["content"], "hello")
+        self.assertEqual(unsubscribed, {"type": "unsubscribed", "channel_id": channel_id})
+        self.assertEqual(error["type"], "error")
+        self.assertEqual(error["channel_id"], channel_id)
+
+    def test_messages_are_routed_by_channel(self):
+        first, second = str(self.channel.id), str(self.other_channel.id)
+
+        async def chat():
+            client = self.connect()
+            self.assertTrue(await client.connect())
+            # leading zeros name the same channel
+            await client.send_json({"type": "subscribe", "channel_id": "0" + first})
+            await client.send_json({"type": "subscribe", "channel_id": int(second)})
+            subscribed = [await self.receive(client), await self.receive(client)]
+            channel_layer = get_channel_layer()
+            for channel_id, content in ((second, "to second"), (first, "to first")):
+                event = message_event(channel_id, message_ids.next_id(), "bob", content, timezone.now())
+                await channel_layer.group_send(channel_id, {**event, "origin": "another worker"})
+            received = [await self.receive(client), await self.receive(client)]
+            await client.disconnect()
+            return subscribed, received
+
+        subscribed, received = async_to_sync(chat)()
+        self.assertEqual([frame["channel_id"] for frame in subscribed], [first, second])
+        self.assertEqual(
+            [(frame["channel_id"], frame["new_message"]["content"]) for frame in received],
+            [(second, "to second"), (first, "to first")],
+        )
+
+    def test_bad_frames_are_answered_with_errors(self):
+        channel_id = str(self.channel.id)
+        other_server = Server.objects.create(name="other", owner=self.user, category=self.server.category)
+        foreign = Channel.objects.create(name="foreign", topic="topic", owner=self.user, server=other_server)
+        frames_sent = [
+            [1, 2],
+            "subscribe",
+            {"type": "subscribe"},
+            {"type": "subscribe", "channel_id": "general"},
+            {"type": "subscribe", "channel_id": str(foreign.id)},
+            {"type": "message", "channel_id": channel_id, "message": "not subscribed"},
+            {"type": "subscribe", "channel_id": channel_id},
+            {"type": "message", "channel_id": channel_id},
+            {"type": "message", "channel_id": channel_id, "message": {"text": "hello"}},
+            {"type": "read", "channel_id": channel_id, "message_id": "latest"},
+            {"type": "shout", "channel_id": channel_id},
+        ]
+
+        async def chat():
+            client = self.connect()
+            self.assertTrue(await client.connect())
+            replies = []
+            for frame in frames_sent:
+                await client.send_json(frame)
+                replies.append(await self.receive(client))
+            await client.disconnect()
+            return replies
+
+        replies = async_to_sync(chat)()
+        self.assertEqual([reply["type"] for reply in replies], ["error"] * 6 + ["subscribed"] + ["error"] * 4)
+        self.assertEqual(replies[0]["channel_id"], None)
+
+    def test_server_id_is_normalised(self):
+        async def chat():
+            client = self.connect(f"00{self.server.id}")
+            self.assertTrue(await client.connect())
+            await get_channel_layer().group_send(
+                server_group(str(self.server.id)), {"type": "presence.changed", "online": [], "offline": [0]}
+            )
+            frame = await client.receive_json()
+            await client.disconnect()
+            refused = self.connect("server")
+            return frame, await refused.connect()
+
+        frame, accepted = async_to_sync(chat)()
+        self.assertEqual(frame, {"type": "presence", "online": [], "offline": [0]})
+        self.assertFalse(accepted)
+
+
+class MessagePackSubprotocolTests(ChatSocketMixin, TransactionTestCase):
+    @override_settings(WEBCHAT_WRITE_BEHIND=True)
+    def test_each_client_gets_the_encoding_it_asked_for(self):
+        application = self.chat_application()
+        channel_path = f"/{self.server.id}/{self.channel.id}"
+
+        async def next_chat_frame(client):
+            # presence updates of the other socket can come first
+            while True:
+                text, data = await client.receive()
+                frame = frames.unpack(data) if data is not None else json.loads(text)
+                if frame["type"] == "chat.message":
+                    return text, data, frame
+
+        async def chat():
+            json_client = self.client_for(application, channel_path)
+            msgpack_client = self.client_for(application, channel_path, subprotocols=[frames.SUBPROTOCOL])
+            self.assertTrue(await json_client.connect())
+            self.assertTrue(await msgpack_client.connect())
+            self.assertIsNone(json_client.subprotocol)
+            self.assertEqual(msgpack_client.subprotocol, frames.SUBPROTOCOL)
+
+            await json_client.send_json({"message": "héllo"})
+            received = [await next_chat_frame(json_client), await next_chat_frame(msgpack_client)]
+            await json_client.disconnect()
+            await msgpack_client.disconnect()
+            return received
+
+        (text, data, as_json), (binary_text, binary, as_msgpack) = async_to_sync(chat)()
+        message_writer.flush()
+        message = Message.objects.get()
+        self.assertIsNone(data)
+        self.assertIsNone(binary_text)
+        self.assertEqual(
+            as_json["new_message"],
+            {
+                "id": str(message.id),
+                "sender": "alice",
+                "content": "héllo",
+                "timestamp": message.timestamp.isoformat(),
+            },
+        )
+        self.assertEqual(
+            as_msgpack["new_message"], [str(message.id), "alice", "héllo", frames.timestamp_us(message.timestamp)]
+        )
+
+
+class CoalescingConsumerTests(ChatSocketMixin, TransactionTestCase):
+    def burst(self, count):
+        """Broadcasts ``count`` messages to a coalescing socket, returns what it was sent."""
+
+        async def chat():
+            client = self.client_for(
+                self.chat_application(AsyncWebChatConsumer), f"/{self.server.id}/{self.channel.id}"
+            )
+            self.assertTrue(await client.connect())
+            channel_layer = get_channel_layer()
+            for i in range(count):
+                event = message_event(str(self.channel.id), i + 1, "bob", f"message {i}", timezone.now())
+                await channel_layer.group_send(str(self.channel.id), {**event, "origin": "another worker"})
+            received = []
+            while True:
+                output = await client.communicator.receive_output(2)
+                received.append(output)
+                if output["type"] == "websocket.close" or "chat.batch" in output.get("text", ""):
+                    break
+            await client.disconnect()
+            return received
+
+        return async_to_sync(chat)()
+
+    @override_settings(WEBCHAT_COALESCE_WINDOW=0.1, WEBCHAT_OUTBOUND_QUEUE_SIZE=10)
+    def test_burst_arrives_as_one_batch(self):
+        *_, last = self.burst(3)
+        frame = json.loads(last["text"])
+        self.assertEqual(frame["type"], "chat.batch")
+        self.assertEqual(
+            [message["content"] for message in frame["messages"]], ["message 0", "message 1", "message 2"]
+        )
+        self.assertEqual(frame["dropped"], 0)
+
+    @override_settings(
+        WEBCHAT_COALESCE_WINDOW=0.1, WEBCHAT_OUTBOUND_QUEUE_SIZE=2, WEBCHAT_SLOW_CONSUMER_POLICY=DROP_OLDEST
+    )
+    def test_overflow_drops_the_oldest(self):
+        *_, last = self.burst(5)
+        frame = json.loads(last["text"])
+        self.assertEqual([message["content"] for message in frame["messages"]], ["message 3", "message 4"])
+        self.assertEqual(frame["dropped"], 3)
+
+    @override_settings(
+        WEBCHAT_COALESCE_WINDOW=0.1, WEBCHAT_OUTBOUND_QUEUE_SIZE=2, WEBCHAT_SLOW_CONSUMER_POLICY=DISCONNECT
+    )
+    def test_overflow_closes_the_socket(self):
+        *_, last = self.burst(5)
+        self.assertEqual(last, {"type": "websocket.close", "code": 4008})
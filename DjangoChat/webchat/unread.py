@@ -0,0 +1,268 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connection, transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from server.models import Channel
+
+from .cache import conversation_cache
+from .models import Conversation, Message, ReadState
+
+logger = logging.getLogger(__name__)
+
+# conversations counted per query by count_unread, four parameters each
+UNREAD_COUNT_CHUNK = 200
+
+
+def latest_key(conversation_id):
+    return f"webchat:latest:{conversation_id}"
+
+
+def messages_written(messages):
+    """Caches the newest message id of each conversation in ``messages``, called once they are in the database."""
+    latest = {}
+    for message in messages:
+        latest[message.conversation_id] = max(latest.get(message.conversation_id, 0), message.id)
+    cache.set_many(
+        {latest_key(conversation_id): message_id for conversation_id, message_id in latest.items()},
+        settings.WEBCHAT_LATEST_MESSAGE_CACHE_TIMEOUT,
+    )
+
+
+def latest_message_ids(conversation_ids):
+    """Returns the newest message id by conversation id, 0 for conversations without messages.
+
+    Comes from the shared cache the message writers keep current; whatever isn't cached is looked up with one query
+    that takes a single index entry per conversation.
+    """
+    cached = cache.get_many([latest_key(conversation_id) for conversation_id in conversation_ids])
+    latest = {}
+    missing = []
+    for conversation_id in conversation_ids:
+        message_id = cached.get(latest_key(conversation_id))
+        if message_id is None:
+            missing.append(conversation_id)
+        else:
+            latest[conversation_id] = message_id
+    if missing:
+        newest = Message.objects.filter(conversation=OuterRef("pk")).order_by("-id").values("id")[:1]
+        found = dict(
+            Conversation.objects.filter(id__in=missing).annotate(latest=Subquery(newest)).values_list("id", "latest")
+        )
+        for conversation_id in missing:
+            key = latest_key(conversation_id)
+            message_id = found.get(conversation_id) or 0
+            # add, not set: a writer may have cached a message newer than what the query saw since it ran
+            if not cache.add(key, message_id, settings.WEBCHAT_LATEST_MESSAGE_CACHE_TIMEOUT):
+                message_id = max(message_id, cache.get(key) or 0)
+            latest[conversation_id] = message_id
+    return latest
+
+
+class ReadTracker:
+    """Per-process read watermarks that still have to be written, by (user id, conversation id).
+
+    ``mark`` is called for every read frame and every message a user sends and only updates a dict entry. A
+    background thread writes them to ReadState every ``interval`` seconds, so a user scrolling through a channel
+    costs one row write per interval instead of one per frame. Watermarks only ever move forward.
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval or settings.WEBCHAT_READ_CHECKPOINT_INTERVAL
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="webchat-read-state", daemon=True)
+            self._thread.start()
+
+    def mark(self, user_id, conversation_id, message_id):
+        self.start()
+        key = (user_id, conversation_id)
+        with self._lock:
+            if message_id > self._pending.get(key, 0):
+                self._pending[key] = message_id
+
+    def pending(self, user_id=None):
+        """Returns the watermarks not written yet, of ``user_id`` only by conversation id when given."""
+        with self._lock:
+            if user_id is None:
+                return dict(self._pending)
+            return {
+                conversation: message_id
+                for (user, conversation), message_id in self._pending.items()
+                if user == user_id
+            }
+
+    def checkpoint(self):
+        """Writes the watermarks marked since the last checkpoint, returns how many there were."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            merge_watermarks(pending)
+        except Exception:
+            # keep them for the next checkpoint, e.g. after losing a race to create the same row
+            with self._lock:
+                for key, message_id in pending.items():
+                    self._pending[key] = max(self._pending.get(key, 0), message_id)
+            raise
+        return len(pending)
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        try:
+            self.checkpoint()
+        except Exception:
+            logger.exception("Failed to write read watermarks on shutdown")
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.checkpoint()
+            except Exception:
+                logger.exception("Failed to write read watermarks")
+            finally:
+                close_old_connections()
+
+
+def merge_watermarks(pending):
+    """Moves the ReadState rows of (user id, conversation id) forward to the given message ids, creating missing ones."""
+    users = {user_id for user_id, _ in pending}
+    conversations = {conversation_id for _, conversation_id in pending}
+    now = timezone.now()
+    with transaction.atomic():
+        # rows are locked while they are read, so checkpoints of several processes don't move a watermark back
+        rows = (
+            ReadState.objects.select_for_update()
+            .filter(user_id__in=users, conversation_id__in=conversations)
+            .values_list("id", "user_id", "conversation_id", "last_read_id")
+        )
+        current = {}
+        updates = []
+        for pk, user_id, conversation_id, last_read_id in rows:
+            message_id = pending.get((user_id, conversation_id))
+            if message_id is None:
+                continue
+            current[user_id, conversation_id] = pk
+            if message_id > last_read_id:
+                updates.append((message_id, pk))
+        if updates:
+            updated_at = ReadState._meta.get_field("updated_at").get_db_prep_save(now, connection)
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f"UPDATE {connection.ops.quote_name(ReadState._meta.db_table)} "
+                    "SET last_read_id = %s, updated_at = %s WHERE id = %s",
+                    [(message_id, updated_at, pk) for message_id, pk in updates],
+                )
+        ReadState.objects.bulk_create(
+            [
+                ReadState(user_id=user_id, conversation_id=conversation_id, last_read_id=message_id, updated_at=now)
+                for (user_id, conversation_id), message_id in pending.items()
+                if (user_id, conversation_id) not in current
+            ]
+        )
+
+
+read_states = ReadTracker()
+
+# watermarks marked since the last checkpoint would be lost with the process
+atexit.register(read_states.stop)
+
+
+def count_unread(watermarks, cap):
+    """Returns the number of messages after each watermark by conversation id, counting at most ``cap`` of them.
+
+    Every count is a range scan of the (conversation, id) index that stops after ``cap`` entries, and the counts of
+    up to ``UNREAD_COUNT_CHUNK`` conversations are taken with one query.
+    """
+    table = connection.ops.quote_name(Message._meta.db_table)
+    count = (
+        f"SELECT %s, (SELECT COUNT(*) FROM (SELECT 1 FROM {table} WHERE conversation_id = %s AND id > %s LIMIT %s) "
+        "AS capped)"
+    )
+    items = list(watermarks.items())
+    counts = {}
+    with connection.cursor() as cursor:
+        for start in range(0, len(items), UNREAD_COUNT_CHUNK):
+            chunk = items[start : start + UNREAD_COUNT_CHUNK]
+            params = []
+            for conversation_id, last_read_id in chunk:
+                params += [conversation_id, conversation_id, last_read_id, cap]
+            cursor.execute(" UNION ALL ".join([count] * len(chunk)), params)
+            counts.update(cursor.fetchall())
+    return counts
+
+
+def unread_counts(user_id, server_ids):
+    """Returns ``[{"channel_id", "server_id", "unread", "capped"}]`` for the channels of ``server_ids`` with unread
+    messages for ``user_id``.
+
+    Channels whose newest message is at or below the user's watermark are settled from the latest message ids
+    without touching the messages, the others are counted up to ``WEBCHAT_UNREAD_CAP``. That's a handful of queries
+    however many channels and messages there are.
+    """
+    cap = settings.WEBCHAT_UNREAD_CAP
+    channels = dict(Channel.objects.filter(server_id__in=server_ids).values_list("id", "server_id"))
+
+    conversations = {}
+    missing = []
+    for channel_id in channels:
+        conversation_id = conversation_cache.get(str(channel_id))
+        if conversation_id is None:
+            missing.append(str(channel_id))
+        else:
+            conversations[conversation_id] = channel_id
+    if missing:
+        for channel_id, conversation_id in Conversation.objects.filter(channel_id__in=missing).values_list(
+            "channel_id", "id"
+        ):
+            conversation_cache.set(channel_id, conversation_id)
+            conversations[conversation_id] = int(channel_id)
+
+    latest = {
+        conversation_id: message_id
+        for conversation_id, message_id in latest_message_ids(list(conversations)).items()
+        if message_id
+    }
+    watermarks = dict.fromkeys(latest, 0)
+    watermarks.update(
+        ReadState.objects.filter(user_id=user_id, conversation_id__in=list(latest)).values_list(
+            "conversation_id", "last_read_id"
+        )
+    )
+    # reads this process hasn't written yet, e.g. from the socket the user has open right now
+    for conversation_id, message_id in read_states.pending(user_id).items():
+        if conversation_id in watermarks:
+            watermarks[conversation_id] = max(watermarks[conversation_id], message_id)
+
+    behind = {
+        conversation_id: last_read_id
+        for conversation_id, last_read_id in watermarks.items()
+        if latest[conversation_id] > last_read_id
+    }
+    counts = count_unread(behind, cap + 1) if behind else {}
+    return [
+        {
+            "channel_id": conversations[conversation_id],
+            "server_id": channels[conversations[conversation_id]],
+            "unread": min(unread, cap),
+            "capped": unread > cap,
+        }
+        for conversation_id, unread in sorted(counts.items(), key=lambda item: conversations[item[0]])
+        if unread
+    ]
@@ -1,21 +1,203 @@
-from django.shortcuts import render
-from rest_framework import viewsets
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import views, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from server.models import Channel
 
-from .models import Conversation
-from .schemas import list_message_docs
-from .serializers import MessageSerializer
+from .activity import popular_channels, popular_servers
+from .auth import channel_server, is_member, issue_token, member_servers
+from .models import Conversation, Message
+from .pagination import MessageKeysetPagination, MessageSearchPagination
+from .presence import presence
+from .recent import recent_messages
+from .schemas import (
+    list_message_docs,
+    online_members_docs,
+    popular_channels_docs,
+    popular_servers_docs,
+    search_message_docs,
+    unread_counts_docs,
+    websocket_token_docs,
+)
+from .search import search_messages, search_terms
+from .serializers import (
+    MessageSearchResultSerializer,
+    MessageSerializer,
+    OnlineMemberSerializer,
+    PopularChannelSerializer,
+    PopularServerSerializer,
+    UnreadCountSerializer,
+    WebsocketTokenSerializer,
+)
+from .unread import unread_counts
 
 
 class MessageViewSet(viewsets.ViewSet):
+    pagination_class = MessageKeysetPagination
+
     @list_message_docs
     def list(self, request):
         channel_id = request.query_params.get("channel_id")
 
+        # a channel without a conversation simply has no messages, so there is no need to look the conversation up
+        message = Message.objects.filter(conversation__channel_id=channel_id).select_related("sender")
+        paginator = self.pagination_class()
+        page = None
+        if paginator.is_newest_page(request):
+            # the newest page of a channel somebody here is chatting in is usually in memory already
+            recent = recent_messages.latest(channel_id, paginator.get_limit(request))
+            if recent is not None:
+                page = paginator.paginate_recent(*recent)
+        if page is None:
+            page = paginator.paginate_queryset(message, request)
+        serializer = MessageSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @search_message_docs
+    @action(detail=False, permission_classes=[IsAuthenticated])
+    def search(self, request):
+        text = request.query_params.get("q", "")
+        channel_id = request.query_params.get("channel_id")
+        server_id = request.query_params.get("server_id")
+
+        if not search_terms(text):
+            raise ValidationError(detail="q must contain at least one word")
+        # only the messages of servers the user is in, the same check the chat websockets make
+        if channel_id:
+            try:
+                channel_id = str(int(channel_id))
+            except ValueError:
+                raise ValidationError(detail="channel_id must be an integer")
+            if not is_member(request.user.id, channel_server(channel_id)):
+                raise PermissionDenied(detail="Not a member of this channel's server")
+            channel_ids = [channel_id]
+        elif server_id:
+            try:
+                server_id = int(server_id)
+            except ValueError:
+                raise ValidationError(detail="server_id must be an integer")
+            if not is_member(request.user.id, server_id):
+                raise PermissionDenied(detail="Not a member of this server")
+            channel_ids = [str(pk) for pk in Channel.objects.filter(server_id=server_id).values_list("id", flat=True)]
+        else:
+            raise ValidationError(detail="Pass either channel_id or server_id")
+        conversation_ids = Conversation.objects.filter(channel_id__in=channel_ids).values_list("id", flat=True)
+
+        paginator = MessageSearchPagination()
+        hits = paginator.paginate_search(
+            lambda limit, offset: search_messages(text, conversation_ids, limit, offset), request
+        )
+        messages = Message.objects.select_related("sender", "conversation").in_bulk([pk for pk, rank in hits])
+        results = []
+        for pk, rank in hits:
+            # the index can briefly point at a message that was just deleted
+            if pk in messages:
+                messages[pk].rank = rank
+                results.append(messages[pk])
+        serializer = MessageSearchResultSerializer(results, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+
+# the chat websocket can't rely on the session cookie reaching it from the frontend's origin, so a logged in user
+# fetches a short lived signed token here and passes it when connecting
+class WebsocketTokenView(views.APIView):
+    permission_classes = [IsAuthenticated]
+
+    @websocket_token_docs
+    def get(self, request):
+        serializer = WebsocketTokenSerializer(
+            {"token": issue_token(request.user), "expires_in": settings.WEBCHAT_TOKEN_MAX_AGE}
+        )
+        return Response(serializer.data)
+
+
+# members of a server with a chat socket open in any process, answered from presence.py's in-memory replica;
+# changes after this are pushed to the server's sockets as presence frames
+class OnlineMembersView(views.APIView):
+    permission_classes = [IsAuthenticated]
+
+    @online_members_docs
+    def get(self, request, server_id):
+        if not is_member(request.user.id, server_id):
+            raise PermissionDenied(detail="Not a member of this server")
+        members = presence.online_members(server_id)
+        serializer = OnlineMemberSerializer(
+            [{"id": user_id, "username": name} for user_id, name in members], many=True
+        )
+        return Response(serializer.data)
+
+
+# unread badges for the sidebar, of one server or of every server the user is in; see unread.py for how the counts
+# stay a handful of queries, channels without unread messages are left out
+class UnreadCountView(views.APIView):
+    permission_classes = [IsAuthenticated]
+
+    @unread_counts_docs
+    def get(self, request):
+        server_id = request.query_params.get("server_id")
+        if server_id is None:
+            server_ids = member_servers(request.user.id)
+        else:
+            try:
+                server_id = int(server_id)
+            except ValueError:
+                raise ValidationError(detail="server_id must be an integer")
+            if not is_member(request.user.id, server_id):
+                raise PermissionDenied(detail="Not a member of this server")
+            server_ids = [server_id]
+        serializer = UnreadCountSerializer(unread_counts(request.user.id, server_ids), many=True)
+        return Response(serializer.data)
+
+
+# rankings for the popular drawer, read off the activity tables that activity.py checkpoints instead of counting
+# messages; they only change with a checkpoint, so they are cached for as long as one takes
+class PopularViewSet(viewsets.ViewSet):
+    default_limit = 10
+    max_limit = 50
+
+    @popular_servers_docs
+    @action(detail=False)
+    def servers(self, request):
+        limit = self.get_limit(request)
+        return self.cached(f"webchat:popular:servers:{limit}", lambda: popular_servers(limit), PopularServerSerializer)
+
+    # channel names and topics are only for the members of their server
+    @popular_channels_docs
+    @action(detail=False, permission_classes=[IsAuthenticated])
+    def channels(self, request):
+        limit = self.get_limit(request)
+        server_id = request.query_params.get("server_id")
+        if server_id is None:
+            # the user's own ranking, across the servers they are in
+            key = f"webchat:popular:channels:user:{request.user.id}:{limit}"
+            server_ids = member_servers(request.user.id)
+        else:
+            try:
+                server_id = int(server_id)
+            except ValueError:
+                raise ValidationError(detail="server_id must be an integer")
+            if not is_member(request.user.id, server_id):
+                raise PermissionDenied(detail="Not a member of this server")
+            key = f"webchat:popular:channels:{server_id}:{limit}"
+            server_ids = [server_id]
+        return self.cached(key, lambda: popular_channels(limit, server_ids), PopularChannelSerializer)
+
+    def get_limit(self, request):
         try:
-            conversation = Conversation.objects.get(channel_id=channel_id)
-            message = conversation.message.all()
-            serializer = MessageSerializer(message, many=True)
-            return Response(serializer.data)
-        except Conversation.DoesNotExist:
-            return Response([])
+            limit = min(int(request.query_params.get("limit", self.default_limit)), self.max_limit)
+        except ValueError:
+            raise ValidationError(detail="limit must be an integer")
+        if limit < 1:
+            raise ValidationError(detail="limit must be positive")
+        return limit
+
+    @staticmethod
+    def cached(key, rank, serializer_class):
+        data = cache.get(key)
+        if data is None:
+            data = list(serializer_class(rank(), many=True).data)
+            cache.set(key, data, settings.WEBCHAT_ACTIVITY_CHECKPOINT_INTERVAL)
+        return Response(data)
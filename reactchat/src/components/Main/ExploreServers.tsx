@@ -30,9 +30,11 @@ interface Server {
   
 const ExploreServers = () => {
     const { categoryName } = useParams();
+    // only what the cards show, the channels of every server aren't needed here
+    const fields = "fields=id,name,icon,banner,category";
     const url = categoryName
-      ? `/server/select/?category=${categoryName}`
-      : "/server/select";
+      ? `/server/select/?category=${categoryName}&${fields}`
+      : `/server/select/?${fields}`;
     const { dataCRUD, fetchData } = useCrud<Server>([], url);
   
     useEffect(() => {
@@ -1,7 +1,9 @@
-import { useState } from "react";
+import { useCallback, useEffect, useRef, useState } from "react";
 import { useParams } from "react-router-dom";
-import useWebSocket from "react-use-websocket";
+import useWebSocket, { ReadyState } from "react-use-websocket";
 import useCrud from "../../hooks/useCrud";
+import useAxiosWithInterceptor from "../../helpers/jwtinterceptor";
+import { BASE_URL } from "../../config";
 import { Server } from "../../@types/server.d";
 import {
   Avatar,
@@ -29,11 +31,19 @@ interface ServerChannelProps {
 }
 
 interface Message {
+  // 64 bit ids sent as strings, a JavaScript number only holds 53 bits of them
+  id: string;
   sender: string;
   content: string;
   timestamp: string;
 }
 
+// message ids are sent as decimal strings, compared as BigInt
+const compareIds = (a: string, b: string) => {
+  const difference = BigInt(a) - BigInt(b);
+  return difference > 0n ? 1 : difference < 0n ? -1 : 0;
+};
+
 const messageInterface = (props: ServerChannelProps) => {
   const { data } = props;
   const theme = useTheme();
@@ -46,22 +56,46 @@ const messageInterface = (props: ServerChannelProps) => {
     `/messages/?channel_id=${channelId}`
   );
 
-  const socketUrl = channelId
-    ? `ws://127.0.0.1:8000/${serverId}/${channelId}`
-    : null;
-
-  const { sendJsonMessage } = useWebSocket(socketUrl, {
-    onOpen: async () => {
-      try {
-        const data = await fetchData();
-        setNewMessage([]);
-        setNewMessage(Array.isArray(data) ? data : []);
-        console.log("Connected!!!");
-      } catch (error) {
-        console.log(error);
-      }
+  // last message shown for the current channel, so a reconnect only asks for what it missed
+  const lastSeen = useRef<{ channelId?: string; id?: string }>({});
+
+  const jwtAxios = useAxiosWithInterceptor();
+
+  // channel the socket currently receives messages for, the server forgets it when the socket closes
+  const subscribed = useRef<string | undefined>();
+
+  // one socket per server, switching channels only swaps subscriptions on it. the socket only accepts members of
+  // the server, identified by a short lived token fetched for every (re)connect, so a reconnect after the token
+  // expired still gets in
+  const getSocketUrl = useCallback(async () => {
+    const response = await jwtAxios.get(`${BASE_URL}/ws-token/`, { withCredentials: true });
+    return `ws://127.0.0.1:8000/${serverId}?token=${encodeURIComponent(response.data.token)}`;
+  }, [serverId]);
+
+  const socketUrl = serverId ? getSocketUrl : null;
+
+  const showMessages = (messages: Message[]) => {
+    if (messages.length > 0) {
+      lastSeen.current = { channelId, id: messages[messages.length - 1].id };
+    }
+  };
+
+  const loadHistory = async () => {
+    // the messages API returns the newest page as { before, after, results }
+    const data: any = await fetchData();
+    const results: Message[] = Array.isArray(data?.results) ? data.results : [];
+    lastSeen.current = { channelId };
+    showMessages(results);
+    setNewMessage(results);
+  };
+
+  const { sendJsonMessage, readyState } = useWebSocket(socketUrl, {
+    shouldReconnect: () => true,
+    onOpen: () => {
+      console.log("Connected!!!");
     },
     onClose: () => {
+      subscribed.current = undefined;
       console.log("Closed!");
     },
     onError: () => {
@@ -69,16 +103,63 @@ const messageInterface = (props: ServerChannelProps) => {
     },
     onMessage: (msg) => {
       const data = JSON.parse(msg.data);
-      setNewMessage((prev_msg) => [...prev_msg, data.new_message]);
+      if (data.type === "error") {
+        console.log(data.error);
+        return;
+      }
+      if (data.channel_id !== subscribed.current || !["chat.message", "chat.replay"].includes(data.type)) {
+        // subscription acknowledgements, and messages still in flight for the channel that was left
+        return;
+      }
+      if (data.type === "chat.replay") {
+        if (!data.complete) {
+          // too much was missed to fill the gap from the socket, start over from the history API
+          loadHistory().catch((error) => console.log(error));
+          return;
+        }
+        // replayed messages are older than anything received live since the subscription
+        setNewMessage((prev_msg) => {
+          const merged = [...prev_msg, ...data.messages].sort(
+            (a: Message, b: Message) => Date.parse(a.timestamp) - Date.parse(b.timestamp) || compareIds(a.id, b.id)
+          );
+          showMessages(merged);
+          return merged;
+        });
+      } else {
+        showMessages([data.new_message]);
+        setNewMessage((prev_msg) => [...prev_msg, data.new_message]);
+      }
       setMessage("");
     },
   });
 
+  const subscribe = async () => {
+    if (subscribed.current && subscribed.current !== channelId) {
+      sendJsonMessage({ type: "unsubscribe", channel_id: subscribed.current });
+    }
+    subscribed.current = channelId;
+    if (!channelId) {
+      return;
+    }
+    if (lastSeen.current.channelId !== channelId || !lastSeen.current.id) {
+      await loadHistory();
+    }
+    // the server replays whatever arrived after the last message shown, on a reconnect as on a channel switch
+    sendJsonMessage({ type: "subscribe", channel_id: channelId, since: lastSeen.current.id });
+  };
+
+  useEffect(() => {
+    if (readyState === ReadyState.OPEN) {
+      subscribe().catch((error) => console.log(error));
+    }
+  }, [channelId, readyState]);
+
   const handleKeyDown = (e: React.KeyboardEvent<HTMLInputElement>) => {
     if (e.key === "Enter") {
       e.preventDefault();
       sendJsonMessage({
         type: "message",
+        channel_id: channelId,
         message,
       } as SendMessageData);
     }
@@ -88,6 +169,7 @@ const messageInterface = (props: ServerChannelProps) => {
     e.preventDefault();
     sendJsonMessage({
       type: "message",
+      channel_id: channelId,
       message,
     } as SendMessageData);
   };
@@ -29,7 +29,7 @@ type Props = {
 const PopularChannels: React.FC<Props> = ({ open }) => {
     const { dataCRUD, error, isLoading, fetchData } = useCrud<Server>(
         [],
-        "/server/select/"
+        "/popular/servers/?limit=10"
     );
     
     // initiate the fetchData() function whenever we use this component